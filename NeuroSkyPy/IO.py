@@ -1,12 +1,18 @@
 import json
-import matplotlib.pyplot as plt
+import multiprocessing
+import os
 import numpy as np
 import random
-from sklearn.preprocessing import normalize
+from matplotlib import cm
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_hex
+from matplotlib.figure import Figure
 
 # por mejorar
 # guardar si eso en pandas
-# Guardar usando parquet
+# los datos de la sesion se guardan en parquet con recorder.SessionRecorder
+
+COLOR_PREDEFINED = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
 
 
 def generate_hex_color():
@@ -23,33 +29,174 @@ def generate_hex_color():
 	return hex_number
 
 
+def variable_colors(labels):
+	'''
+	Colors of the variables, the predefined ones and then the tab20 palette, the same in every figure and session
+	:param labels: names of the variables
+	:return: list of colors
+	'''
+	colors = []
+	for idx in range(len(labels)):
+		if idx < len(COLOR_PREDEFINED): colors.append(COLOR_PREDEFINED[idx])
+		else: colors.append(to_hex(cm.tab20((idx - len(COLOR_PREDEFINED)) % 20)))
+	return colors
+
+
+def normalize_max(values):
+	'''
+	Scales a series to [-1, 1] dividing it by its largest absolute value, a series of zeros is left as it is
+	:param values: sequence of numbers
+	:return: float array
+	'''
+	values = np.asarray(values, dtype=np.float64)
+	peak = np.abs(values).max() if len(values) else 0.0
+	return values / peak if peak else values
+
+
+def path_to_save(config):
+	'''
+	Folder where the images of an experiment are saved
+	:param config: dict with folder_exp, name and hour_exp, and optionally root, the folder of folder_exp (. by default)
+	:return: path ending with /
+	'''
+	return config.get('root', '.')+"/"+config['folder_exp']+"/Resultados_"+config['name']+"_"+config['hour_exp']+"/Imagenes/"
+
+
 def save_session(dic, config):
 	'''
 	Function to store the data in the path and files chosen
-	:param dic: dic of values
+	:param dic: dic of values, variable -> (timestamps, values) as returned by getTimeTaken. The former format,
+	variable -> {time string: value}, is still accepted: its values are drawn in order, one second apart, as
+	those time strings cannot be read back
 	:param config: variable where the configurariton data must be saved
 	:return: nothing
 	'''
+	dic = dict((name, _legacy_series(values) if isinstance(values, dict) else values) for name, values in dic.items())
 
-	# labels to be drawn ( remove raw and poor signal ) Check them afterwards
+	# raw signal se puede utilizar para identificar el ruido y como hace el paciente uso del casco
+	# y poor signal para verificar los datos, config['exclude_from_drawing'] los quita de las graficas
 
+	# pintamos y guardamos los datos sin abrir ventanas
+	export_session(dic, config)
 
-	# raw signal se puede utilizar para identificar el ruido y como hace el paciente uso del casco
-	# y poor signal para verificar los datos
-	for i in config['exclude_from_drawing']:
-		del dic[i]
 
-	# preparamos los datos
-	data = {
-		'x': list(dic[list(dic.keys())[0]].keys()),
-		'y': [dic[i].values() for i in dic.keys()]
-	}
+def _legacy_series(values):
+	'''
+	Converts the values of a variable of the former getTimeTaken, {time string: value}, to (timestamps, values)
+	:param values: dict of time string -> value, in the order they were taken
+	:return: (int64 array one second apart in ns, array of values)
+	'''
+	return np.arange(len(values), dtype=np.int64) * 10 ** 9, np.array(list(values.values()))
 
-	# pintamos y guardamos los datos
-	plot_graphics(data, list(dic.keys()), config, save_img=True)
+
+def session_series(dic):
+	'''
+	Converts the values of a session to series in seconds since its first value
+	:param dic: dict of variable -> (timestamps in ns, values), as returned by getTimeTaken
+	:return: dict of variable -> (seconds, values) float arrays, the variables without values are left out
+	'''
+	dic = dict((name, (np.asarray(times), np.asarray(values))) for name, (times, values) in dic.items() if len(times))
+	if not dic:
+		return {}
+	start = min(times[0] for times, values in dic.values())
+	return dict((name, ((times - start) / 1e9, values.astype(np.float64))) for name, (times, values) in dic.items())
 
 
-def plot_graphics(data, var_names, config, save_img=False, transparent=False):
+def decimate_minmax(x, y, buckets):
+	'''
+	Reduces a series to the minimum and maximum of each of `buckets` consecutive slices, kept in order.
+	Drawn `buckets` pixels wide it looks like the whole series, peaks included.
+	:param x: times
+	:param y: values
+	:param buckets: number of slices, i.e. the width of the plot in pixels
+	:return: (x, y) with at most 2*buckets points
+	'''
+	n = len(y)
+	if n <= 2 * buckets:
+		return x, y
+	size = -(-n // buckets)
+	whole = n // size * size
+	blocks = y[:whole].reshape(-1, size)
+	offsets = np.arange(0, whole, size)
+	keep = [offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1)]
+	if whole < n:
+		tail = y[whole:]
+		keep.append(np.array([whole + tail.argmin(), whole + tail.argmax()]))
+	index = np.unique(np.concatenate(keep))
+	return x[index], y[index]
+
+
+# figure and axes reused by every image drawn in a process, with their size
+_figure = None
+
+
+def _render(job):
+	'''
+	Draws a figure with Agg, without pyplot, and saves it
+	:param job: (path, title, lines as (x, y, color, label), legend, width, height, dpi, transparent)
+	:return: path of the image
+	'''
+	global _figure
+	path, title, lines, legend, width, height, dpi, transparent = job
+	if _figure is None or _figure[0] != (width, height, dpi):
+		figure = Figure(figsize=(width / float(dpi), height / float(dpi)), dpi=dpi)
+		FigureCanvasAgg(figure)
+		_figure = ((width, height, dpi), figure, figure.add_subplot(1, 1, 1))
+	size, figure, axes = _figure
+	axes.clear()
+	for x, y, color, label in lines:
+		axes.plot(x, y, color=color, label=label, linewidth=0.8)
+	axes.set_title(title)
+	axes.set_xlabel("Time in seconds")
+	axes.set_ylabel("Intensity")
+	if legend: axes.legend(loc='upper right')
+	figure.savefig(path, transparent=transparent)
+	return path
+
+
+def export_session(dic, config, processes=None, width=1600, height=900, dpi=100, transparent=False):
+	'''
+	Headless export of the figures of a session: all the signals, normalized and unnormalized, and one per variable.
+	Every series is decimated to the width of the image and the figures are drawn with Agg by a pool of processes,
+	so hours of raw signal are exported in seconds. On Windows call it under if __name__ == "__main__".
+	:param dic: dict of variable -> (timestamps, values), as returned by getTimeTaken
+	:param config: dict with name, hour_exp, folder_exp and optionally exclude_from_drawing
+	:param processes: size of the pool, one per cpu by default, 1 draws in this process
+	:param width: width of the images in pixels
+	:param height: height of the images in pixels
+	:param dpi: resolution of the images
+	:param transparent: transparent background
+	:return: list with the paths of the images
+	'''
+	folder = path_to_save(config)
+	os.makedirs(folder, exist_ok=True)
+	exclude = config.get('exclude_from_drawing', ())
+	series = session_series(dict((name, values) for name, values in dic.items() if name not in exclude))
+	labels = list(series)
+	colors = variable_colors(labels)
+	# one slice per pixel of the plotting area, about 80% of the figure
+	buckets = max(1, int(width * 0.8))
+	lines = [decimate_minmax(x, y, buckets) + (color, label) for (x, y), color, label in zip(series.values(), colors, labels)]
+	# the decimation keeps the maximum, the normalization gives the same result as with every point
+	lines_norm = [(x, normalize_max(y), color, label) for x, y, color, label in lines]
+
+	title = "Señales del usuario: "+config['name']+" para el experimento: "+config['hour_exp']
+	jobs = [
+		(folder+"All_signals_normalized.png", title, lines_norm, True, width, height, dpi, transparent),
+		(folder+"All_signals_unnormalized.png", title, lines, True, width, height, dpi, transparent),
+	]
+	for line in lines:
+		jobs.append((folder+line[3]+".png", "Variable: " + line[3] + " " + config['name'] + "_" + config['hour_exp'],
+			[line], False, width, height, dpi, transparent))
+
+	processes = min(processes or os.cpu_count() or 1, len(jobs))
+	if processes <= 1:
+		return [_render(job) for job in jobs]
+	with multiprocessing.Pool(processes) as pool:
+		return pool.map(_render, jobs, chunksize=1)
+
+
+def plot_graphics(data, var_names, config, save_img=False, transparent=False, show=True):
 	'''
 	Draw the graphics and also store in its rigthful folder
 	:param data:
@@ -57,22 +204,21 @@ def plot_graphics(data, var_names, config, save_img=False, transparent=False):
 	:param config:
 	:param save_img:
 	:param transparent:
+	:param show: show every figure in a window, export_session saves them without windows and much faster
 	:return:
 	'''
 
+	import matplotlib.pyplot as plt  # only to show the figures, export_session draws without it
+
 	# declaramos el path to save
-	path_to_save = "./"+config['folder_exp']+"/Resultados_"+config['name']+"_"+config['hour_exp']+"/Imagenes/"
+	path_to_save_img = path_to_save(config)
 
 	# extraemos los datos y fijamos los colores
 	x = np.array(data['x'])
 	lines = [np.array(list(i)) for i in data['y']]
-	lines_norm = [normalize(np.array(list(i))[:, np.newaxis], axis=0, norm='max').ravel() for i in data['y']]
+	lines_norm = [normalize_max(list(i)) for i in data['y']]
 	labels = var_names
-	color_predefined = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
-	colors = []
-	for idx in range(len(labels)):
-		if idx < len(color_predefined): colors.append(color_predefined[idx])
-		else: colors.append(generate_hex_color())
+	colors = variable_colors(labels)
 
 	for idy, y in enumerate([lines_norm, lines]):
 		# fijamos la variable de guardado
@@ -84,13 +230,13 @@ def plot_graphics(data, var_names, config, save_img=False, transparent=False):
 		plt.ylabel("Intensity")
 
 		for i, c, l in zip(y, colors, labels):
-			plt.plot(x, i, c, label='l')
-			plt.legend(labels)
+			plt.plot(x, i, color=c, label=l)
+		plt.legend()
 
 		# guardamos la imagen
-		if save_img: plt.savefig(path_to_save+"All_signals_"+save_var+".png", transparent=transparent)
+		if save_img: plt.savefig(path_to_save_img+"All_signals_"+save_var+".png", transparent=transparent)
 		# la mostramos
-		plt.show()
+		if show: plt.show()
 		# la borramos y volvemos a dibujar
 		plt.clf()
 
@@ -99,9 +245,9 @@ def plot_graphics(data, var_names, config, save_img=False, transparent=False):
 		plt.title("Variable: " + var_names[idx] + " " + config['name'] + "_" + config['hour_exp'])
 		plt.xlabel("Time in seconds")
 		plt.ylabel("Intensity")
-		plt.plot(x, i, colors[idx])
-		if save_img: plt.savefig(path_to_save+var_names[idx]+".png", transparent=transparent)
-		plt.show()
+		plt.plot(x, i, color=colors[idx])
+		if save_img: plt.savefig(path_to_save_img+var_names[idx]+".png", transparent=transparent)
+		if show: plt.show()
 		plt.clf()
 
 
@@ -115,7 +261,7 @@ if __name__ == "__main__":
 	}
 	config = {
 		'name': 'usuario_x',
-		'hour_exp': datetime.now().strftime("%Y%M%d%H%m%S"),
+		'hour_exp': datetime.now().strftime("%Y%m%d%H%M%S"),
 		'folder_exp':"Resultados_Exp",
 		'session_time':60, # in seconds
 		'port': "COM3"
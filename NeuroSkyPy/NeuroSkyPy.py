@@ -26,9 +26,24 @@
 ##NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 ##SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import serial
-import _thread as thread  # Modified thread for _thread due to it's the new library in python 3.7
-from datetime import datetime
+import logging
+import threading
+from time import monotonic_ns
+from .buffer import CHANNEL_RATES, RingBuffer
+from .clock import SampleClock
+from .dispatch import EVERY, SYNC, CallbackDispatcher
+from .metrics import ReaderMetrics, code_counts
+from .parser import FIELD_DTYPES, ThinkGearParser
+from .rolling import rolling
+from .sources import serial_source
+
+logger = logging.getLogger(__name__)
+
+
+def _variable(name):
+    "read-only property with the last value received of a variable"
+    return property(lambda self: self._NeuroSkyPy__latest[name], doc="Get value for " + name)
+
 
 class NeuroSkyPy(object):
     """NeuroSkyPy libraby, to get data from neurosky mindwave.
@@ -45,304 +60,356 @@ class NeuroSkyPy(object):
     #other variables: attention,meditation,rawValue,delta,theta,lowAlpha,highAlpha,lowBeta,highBeta,lowGamma,midGamma, poorSignal and blinkStrength
     
     Setting callback:a call back can be associated with all the above variables so that a function is called when the variable is updated. Syntax: setCallBack("variable",callback_function)
-    for eg.to set a callback for attention data the syntax will be setCallBack("attention",callback_function)"""
-    __attention = 0
-    __meditation = 0
-    __rawValue = 0
-    __delta = 0
-    __theta = 0
-    __lowAlpha = 0
-    __highAlpha = 0
-    __lowBeta = 0
-    __highBeta = 0
-    __lowGamma = 0
-    __midGamma = 0
-    __poorSignal = 0
-    __blinkStrength = 0
+    for eg.to set a callback for attention data the syntax will be setCallBack("attention",callback_function)
+    setCallBack("packet",callback_function) calls the function once per packet with the Sample holding all its values
+    setCallBack keeps one callback per variable, subscribe("variable",callback_function) adds as many as needed
+    and rolling("variable","mean",window=10) keeps a moving aggregate of a variable, see rolling.py
+
+    When the serial port fails (headset switched off, dongle unplugged...) the reader thread closes it and opens it
+    again, waiting reconnectDelay seconds doubled after every failed attempt up to maxReconnectDelay.
+    getStats() returns the corruption and connection counters i.e. checksumErrors, syncLosses, reconnects
+    getMetrics() adds the counters of the reads, parse and callback times, see metrics.py (metrics=False skips them)
+
+    Every packet is stamped with time.monotonic_ns() when it is read. The raw values, which arrive in bursts, are
+    then stamped with their sample time on the 512 Hz clock of the headset fitted by sampleClock (see clock.py),
+    sampleClock=False keeps their arrival time"""
     __port = None
     __baudRate = None
-    __thread_id = None
+    __thread = None
     srl = None
     threadRun = True  # controls the running of thread
-    callBacksDictionary = {}  # keep a track of all callbacks
-    time_value = {}  # keep time and value of the different values
+    connected = False  # the reader thread has an open source
+    reconnectDelay = 0.5  # seconds before the first attempt to open a failed port again
+    maxReconnectDelay = 30.0
 
-    def __init__(self, port, baudRate=57600):
+    def __init__(self, port, baudRate=57600, bufferSeconds=600, dispatcher=None, metrics=True, sampleClock=True):
         self.__port, self.__baudRate = port, baudRate
-        
+        self.callBacksDictionary = {}  # keep a track of all callbacks, per instance
+        self.__callBacks = {}  # variable -> Subscription of setCallBack
+        self.__subscriptions = {}  # variable -> tuple of Subscriptions, replaced as a whole on every change
+        self.__subscribing = threading.Lock()
+        # runs the callbacks outside the parser thread, it can be shared by several headsets
+        self.__ownsDispatcher = dispatcher is None  # closed by stop()
+        self.dispatcher = dispatcher if dispatcher is not None else CallbackDispatcher()
+        self.__parser = ThinkGearParser()
+        self.__metrics = ReaderMetrics() if metrics else None
+        self.__created = monotonic_ns()  # start of the uptime and of the code rates without metrics
+        self.sampleClock = SampleClock(CHANNEL_RATES['rawValue']) if sampleClock else None
+        self.__latest = dict.fromkeys(FIELD_DTYPES, 0)
+        # keep the last bufferSeconds of every variable, memory is allocated once here
+        self.__buffers = dict((name, RingBuffer(CHANNEL_RATES.get(name, 1) * bufferSeconds, dtype))
+                              for name, dtype in FIELD_DTYPES.items())
+        self.__open = None  # opens the serial port again after a failure, None for the sources given to start()
+        self.__stopping = threading.Event()  # interrupts the waits between reconnections
+        self.disconnects = 0
+        self.reconnects = 0
+        self.errors = 0  # exceptions raised while decoding or publishing
+        self.lastError = None
+
     def __del__(self):
-        self.srl.close()
+        # start() may never have been called, or the port is already closed
+        srl = self.srl
+        if srl is not None:
+            try:
+                srl.close()
+            except Exception:
+                pass
+
+    @property
+    def port(self):
+        return self.__port
+
+    @property
+    def baudRate(self):
+        return self.__baudRate
     
-    def start(self):
-        """starts packetparser in a separate thread"""
+    def start(self, source=None):
+        """starts packetparser in a separate thread.
+           source replaces the serial port with any object with read(size), in_waiting and close(), see sources.py"""
         self.threadRun = True
-        self.srl = serial.Serial(self.__port, self.__baudRate)
-        # uncomment when the know how to kill a thread
-        self.__thread = thread.start_new_thread(self.__packetParser,(self.srl,))
-        # thread.start_new_thread(self.__packetParser, (self.srl,))
+        self.__stopping.clear()
+        if source is None:
+            # the timeout lets the thread check threadRun when the headset sends nothing
+            self.__open = lambda: serial_source(self.__port, self.__baudRate, timeout=0.5)
+            source = self.__open()
+        else:
+            self.__open = None
+        self.srl = source
+        self.connected = True
+        self.__parser.reset()
+        if self.sampleClock is not None:
+            self.sampleClock.reset()
+        self._startDispatcher()
+        self.__thread = threading.Thread(target=self.__packetParser, args=(self.srl,), daemon=True)
+        self.__thread.start()
 
     def __packetParser(self, srl):
         "packetParser runs continously in a separate thread to parse packets from mindwave and update the corresponding variables"
-        # if not srl.isOpen(): srl.open()
+        metrics = self.__metrics
+        inWaitingMax = 0
         while self.threadRun:
-            p1 = srl.read(1).hex()  # read first 2 packets
-            p2 = srl.read(1).hex()
-            while p1 != 'aa' or p2 != 'aa':
-                p1 = p2
-                p2 = srl.read(1).hex()
-            else:
-                #a valid packet is available
-                payload=[]
-                checksum=0;
-                payloadLength=int(srl.read(1).hex(),16)
-                for i in range(payloadLength):
-                    tempPacket=srl.read(1).hex()
-                    payload.append(tempPacket)
-                    checksum+=int(tempPacket,16)
-                checksum=~checksum&0x000000ff
-                if checksum==int(srl.read(1).hex(),16):
-                   i=0
-                   while i<payloadLength:
-                       code=payload[i]
-                       if(code=='02'):#poorSignal
-                           i=i+1; self.poorSignal=int(payload[i],16)
-                       elif(code=='04'):#attention
-                           i=i+1; self.attention=int(payload[i],16)
-                       elif(code=='05'):#meditation
-                           i=i+1; self.meditation=int(payload[i],16)
-                       elif(code=='16'):#blink strength
-                           i=i+1; self.blinkStrength=int(payload[i],16)
-                       elif(code=='80'):#raw value
-                           i=i+1 #for length/it is not used since length =1 byte long and always=2
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; self.rawValue=val0*256+int(payload[i],16)
-                           if self.rawValue>32768 :
-                               self.rawValue=self.rawValue-65536
-                       elif(code=='83'):#ASIC_EEG_POWER
-                           i=i+1;#for length/it is not used since length =1 byte long and always=2
-                           #delta:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.delta=val0*65536+val1*256+int(payload[i],16)
-                           #theta:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.theta=val0*65536+val1*256+int(payload[i],16)
-                           #lowAlpha:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.lowAlpha=val0*65536+val1*256+int(payload[i],16)
-                           #highAlpha:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.highAlpha=val0*65536+val1*256+int(payload[i],16)
-                           #lowBeta:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.lowBeta=val0*65536+val1*256+int(payload[i],16)
-                           #highBeta:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.highBeta=val0*65536+val1*256+int(payload[i],16)
-                           #lowGamma:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.lowGamma=val0*65536+val1*256+int(payload[i],16)
-                           #midGamma:
-                           i=i+1; val0=int(payload[i],16)
-                           i=i+1; val1=int(payload[i],16)
-                           i=i+1; self.midGamma=val0*65536+val1*256+int(payload[i],16)
-                       else:
-                           pass
-                       i=i+1
-
-        # when the thread is closed then we exit and close the thread
-        self.srl.close()
-        # raise exception to close the thread
-        thread.exit()
+            try:
+                # read everything already buffered by the OS, or block until at least one byte arrives
+                waiting = srl.in_waiting
+                data = srl.read(waiting or 1)
+            except OSError as error:  # serial.SerialException is an IOError
+                srl = self.__reconnect(srl, error)
+                if srl is None:
+                    break
+                continue
+            if not data and getattr(srl, 'exhausted', False):  # a replay reached its end
+                break
+            if waiting > inWaitingMax and metrics is not None:
+                inWaitingMax = metrics.inWaitingMax = max(waiting, metrics.inWaitingMax)
+            try:
+                self.feed(data)
+            except Exception as error:
+                # a bad packet or callback must not stop the reading
+                self.errors += 1
+                self.lastError = error
+                logger.exception("%s: error handling the data read", self.__port)
+
+        # when the thread is closed then we close the port
+        self.connected = False
+        if srl is not None:
+            self.__close(srl)
+
+    def __close(self, srl):
+        try:
+            srl.close()
+        except Exception:
+            pass
+
+    def __reconnect(self, srl, error):
+        "closes a failed port and opens it again with backoff, returns the new one or None when stopped"
+        self._sourceFailed(srl, error)
+        if self.__open is None:  # a source given to start() cannot be opened again
+            return None
+        delay = self.reconnectDelay
+        while not self.__stopping.wait(delay):
+            try:
+                srl = self.__open()
+            except OSError as error:
+                self._reopenFailed(error)
+                delay = min(delay * 2, self.maxReconnectDelay)
+                continue
+            self._sourceReopened(srl)
+            return srl
+        return None
+
+    def _sourceFailed(self, srl, error):
+        "counts and logs the failure of the port and closes it, shared with the asyncio reader"
+        self.connected = False
+        self.disconnects += 1
+        self.lastError = error
+        logger.warning("%s: read failed, %s", self.__port, error)
+        self.__close(srl)
+
+    def _reopenFailed(self, error):
+        self.lastError = error
+        logger.debug("%s: reconnection failed, %s", self.__port, error)
+
+    def _sourceReopened(self, srl):
+        "starts reading a reopened port"
+        # the partial packet read before the failure is discarded, the samples restart on a new clock segment
+        self.__parser.reset()
+        if self.sampleClock is not None:
+            self.sampleClock.reset()
+        self.srl = srl
+        self.connected = True
+        self.reconnects += 1
+        logger.info("%s: reconnected", self.__port)
+
+    def feed(self, data, timestamp=None):
+        """parses bytes read from the headset and publishes the packets they complete, returns their Samples.
+           The thread started by start() calls it, other readers (asyncio, several headsets...) can call it directly"""
+        metrics = self.__metrics
+        if metrics is not None:
+            metrics.countdown -= 1
+            if not metrics.countdown:  # one read in metrics.interval is timed
+                return self.__measuredFeed(metrics, data, timestamp)
+        samples = self.__parse(data, timestamp)
+        for sample in samples:
+            self.__publish(sample)
+        return samples
+
+    def __parse(self, data, timestamp):
+        "decodes the packets completed by data and puts the raw values on the sample clock"
+        parser = self.__parser
+        clock = self.sampleClock
+        if clock is None:
+            return parser.feed(data, timestamp)
+        discarded = parser.bytesDiscarded
+        samples = parser.feed(data, timestamp)
+        if samples:
+            clock.restamp(samples, parser.bytesDiscarded != discarded)
+        return samples
+
+    def __measuredFeed(self, metrics, data, timestamp):
+        start = monotonic_ns()
+        samples = self.__parse(data, start if timestamp is None else timestamp)
+        parsed = monotonic_ns()
+        for sample in samples:
+            self.__publish(sample)
+        metrics.record(len(data), len(samples), start, parsed, monotonic_ns())
+        return samples
+
+    def __publish(self, sample):
+        "stores the values of a packet and notifies the callbacks, once per packet"
+        latest = self.__latest
+        buffers = self.__buffers
+        timestamp = sample.timestamp
+        items = sample.items()
+        for name, value in items:
+            latest[name] = value
+            buffers[name].append(timestamp, value)
+        subscriptions = self.__subscriptions
+        if subscriptions: #if callbacks have been set, hand them the values
+            if "packet" in subscriptions:
+                for subscription in subscriptions["packet"]:
+                    subscription.publish(timestamp, sample)
+            for name, value in items:
+                if name in subscriptions:
+                    for subscription in subscriptions[name]:
+                        subscription.publish(timestamp, value)
+
+    def wait(self, timeout=None):
+        "waits for packetparser's thread to finish, i.e. the end of a replayed source, returns True if it did"
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+            return not self.__thread.is_alive()
+        return True
 
     def stop(self):
-        "stops packetparser's thread and releases com port i.e disconnects mindwave"
+        """stops packetparser's thread, waits for it to finish and releases com port i.e disconnects mindwave.
+           The open batches are delivered and the dispatcher created by this object is closed"""
         self.threadRun = False
+        self.__stopping.set()
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self._releaseDispatcher()
+
+    def _startDispatcher(self):
+        "runs the workers of the dispatcher of this object again after stop(), shared with the asyncio reader"
+        if self.__ownsDispatcher and any(subscription.policy != SYNC
+                                         for subscriptions in self.__subscriptions.values()
+                                         for subscription in subscriptions):
+            self.dispatcher.start()
 
-    def setCallBack(self, variable_name, callback_function):
+    def _releaseDispatcher(self):
+        "delivers the open batches of the callbacks and closes the dispatcher if this object created it"
+        for subscriptions in list(self.__subscriptions.values()):
+            for subscription in subscriptions:
+                subscription.flush()
+        if self.__ownsDispatcher:
+            self.dispatcher.close()
+
+    def setCallBack(self, variable_name, callback_function, policy=EVERY, queueSize=1024, batchSize=64, batchMillis=None):
         """Setting callback:a call back can be associated with all the above variables so that a function is called when the variable is updated. Syntax: setCallBack("variable",callback_function)
-           for eg. to set a callback for attention data the syntax will be setCallBack("attention",callback_function)"""
+           for eg. to set a callback for attention data the syntax will be setCallBack("attention",callback_function)
+           "packet" as variable receives the Sample of every packet
+           The callbacks run in the dispatcher workers, not in the parser thread, and policy chooses what they get:
+           "every" every value (the oldest are dropped beyond queueSize waiting), "latest" only the last value when
+           the callback is slower than the headset, "batch" (timestamps, values) arrays of batchSize values or of
+           batchMillis milliseconds, "sync" every value called from the parser thread"""
+        self.removeCallBack(variable_name)
         self.callBacksDictionary[variable_name]=callback_function
-        self.time_value[variable_name]={}
+        self.__callBacks[variable_name] = self.subscribe(variable_name, callback_function, policy, queueSize, batchSize,
+                                                         batchMillis)
+
+    def removeCallBack(self, variable_name):
+        "removes the callback of a variable, if any"
+        self.callBacksDictionary.pop(variable_name, None)
+        subscription = self.__callBacks.pop(variable_name, None)
+        if subscription is not None:
+            self.unsubscribe(subscription)
+
+    def subscribe(self, variable_name, callback_function, policy=EVERY, queueSize=1024, batchSize=64, batchMillis=None):
+        """adds a callback to a variable, or "packet", next to the ones it already has, with the policies of
+           setCallBack. Returns the Subscription, give it to unsubscribe() to remove the callback"""
+        subscription = self.dispatcher.subscribe(callback_function, policy, queueSize, batchSize, batchMillis,
+                                                 name="%s/%s" % (self.__port, variable_name))
+        with self.__subscribing:
+            self.__subscriptions[variable_name] = self.__subscriptions.get(variable_name, ()) + (subscription,)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        "removes a callback added with subscribe()"
+        with self.__subscribing:
+            for name, subscriptions in list(self.__subscriptions.items()):
+                if subscription in subscriptions:
+                    subscriptions = tuple(other for other in subscriptions if other is not subscription)
+                    if subscriptions:
+                        self.__subscriptions[name] = subscriptions
+                    else:
+                        del self.__subscriptions[name]
+        self.dispatcher.unsubscribe(subscription)
+
+    def rolling(self, variable_name, aggregate, **options):
+        """returns a rolling aggregate of a variable updated with every value: "mean", "ema", "min", "max",
+           "variance", "std" or "percentile", over window values or seconds, see rolling.py
+           i.e. mean = object1.rolling("attention", "mean", window=10); mean.value
+           aggregate.detach() stops updating it"""
+        return rolling(aggregate, **options).attach(self, variable_name)
+
+    def getStats(self):
+        """returns a dict with the counters of the parser (packets, checksumErrors, invalidLengths, syncLosses,
+           bytesDiscarded) and of the connection (connected, disconnects, reconnects, errors)"""
+        stats = self.__parser.stats()
+        stats.update(connected=self.connected, disconnects=self.disconnects, reconnects=self.reconnects,
+                     errors=self.errors)
+        return stats
+
+    def getMetrics(self):
+        """returns a snapshot dict of the reader: getStats() plus reads, readSizes, parseNsPerPacket,
+           inWaitingMax, secondsSinceLastPacket, packets and packets/s per data row code and, per variable
+           with a callback, its queue depth and execution time"""
+        now = monotonic_ns()
+        reader = self.__metrics
+        if reader is None:  # no read counters, only the uptime of this object
+            reader = ReaderMetrics()
+            reader.started = self.__created
+        metrics = reader.snapshot(now)
+        metrics.update(self.getStats())
+        # the newest timestamp in the buffers is the arrival of the last valid packet
+        last = [buffer.last()[0] for buffer in self.__buffers.values() if buffer.count]
+        metrics['secondsSinceLastPacket'] = (now - max(last)) / 1e9 if last else None
+        codes = code_counts(self.__buffers)
+        seconds = max(metrics['uptimeSeconds'], 1e-9)
+        metrics['codes'] = codes
+        metrics['codesPerSecond'] = dict((code, count / seconds) for code, count in codes.items())
+        callbacks = metrics['callbacks'] = {}
+        for name, subscriptions in list(self.__subscriptions.items()):
+            for subscription in subscriptions:
+                while name in callbacks:
+                    name += "'"
+                callbacks[name] = subscription.metrics()
+        metrics['queueDepth'] = sum(callback['queueDepth'] for callback in metrics['callbacks'].values())
+        if self.sampleClock is not None:
+            metrics['clockDriftPpm'] = self.sampleClock.driftPpm
+            metrics['clockLostSamples'] = self.sampleClock.lostSamples
+        return metrics
+
+    def getBuffer(self, variable_name):
+        """returns the RingBuffer with the last values of a variable, taken with time.monotonic_ns()
+           i.e. times, values = object1.getBuffer("rawValue").window(t0, t1)"""
+        return self.__buffers[variable_name]
 
     def getTimeTaken(self):
-        return self.time_value
+        "returns a dict of variable name -> (timestamps, values) arrays with every stored value"
+        return dict((name, buffer.latest()) for name, buffer in self.__buffers.items())
 
-    #setting getters and setters for all variables
-    
-    #attention
-    @property
-    def attention(self):
-        "Get value for attention"
-        return self.__attention
-    @attention.setter
-    def attention(self,value):
-        # extract actual time
-        at_time_taken = datetime.now().strftime("%H%m%S")
-        self.__attention=value
-        if "attetion" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["attention"](self.__attention)
-            self.time_value["attention"][str(at_time_taken)] = self.__attention
-
-    #meditation
-    @property
-    def meditation(self):
-        "Get value for meditation"
-        return self.__meditation
-    @meditation.setter
-    def meditation(self,value):
-        md_time_taken = datetime.now().strftime("%H%m%S")
-        self.__meditation=value
-        if "meditation" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["meditation"](self.__meditation)
-            self.time_value["meditation"][str(md_time_taken)] = self.__meditation
-
-    #rawValue
-    @property
-    def rawValue(self):
-        "Get value for rawValue"
-        return self.__rawValue
-    @rawValue.setter
-    def rawValue(self,value):
-        rw_time_taken = datetime.now().strftime("%H%m%S")
-        self.__rawValue=value
-        if "rawValue" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["rawValue"](self.__rawValue)
-            self.time_value["rawValue"][str(rw_time_taken)] = self.__rawValue
-
-    #delta
-    @property
-    def delta(self):
-        "Get value for delta"
-        return self.__delta
-    @delta.setter
-    def delta(self,value):
-        dl_time_taken = datetime.now().strftime("%H%m%S")
-        self.__delta=value
-        if "delta" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["delta"](self.__delta)
-            self.time_value["delta"][str(dl_time_taken)] = self.__delta
-
-    #theta
-    @property
-    def theta(self):
-        "Get value for theta"
-        return self.__theta
-    @theta.setter
-    def theta(self,value):
-        tt_time_taken = datetime.now().strftime("%H%m%S")
-        self.__theta=value
-        if "theta" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["theta"](self.__theta)
-            self.time_value["theta"][str(tt_time_taken)] = self.__theta
-
-    #lowAlpha
-    @property
-    def lowAlpha(self):
-        "Get value for lowAlpha"
-        return self.__lowAlpha
-    @lowAlpha.setter
-    def lowAlpha(self,value):
-        la_time_taken = datetime.now().strftime("%H%m%S")
-        self.__lowAlpha=value
-        if "lowAlpha" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["lowAlpha"](self.__lowAlpha)
-            self.time_value["lowAlpha"][str(la_time_taken)] = self.__lowAlpha
-
-    #highAlpha
-    @property
-    def highAlpha(self):
-        "Get value for highAlpha"
-        return self.__highAlpha
-    @highAlpha.setter
-    def highAlpha(self,value):
-        ha_time_taken = datetime.now().strftime("%H%m%S")
-        self.__highAlpha=value
-        if "highAlpha" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["highAlpha"](self.__highAlpha)
-            self.time_value["highAlpha"][str(ha_time_taken)] = self.__highAlpha
-
-
-    #lowBeta
-    @property
-    def lowBeta(self):
-        "Get value for lowBeta"
-        return self.__lowBeta
-    @lowBeta.setter
-    def lowBeta(self,value):
-        lb_time_taken = datetime.now().strftime("%H%m%S")
-        self.__lowBeta=value
-        if "lowBeta" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["lowBeta"](self.__lowBeta)
-            self.time_value["lowBeta"][str(lb_time_taken)] = self.__lowBeta
-
-    #highBeta
-    @property
-    def highBeta(self):
-        "Get value for highBeta"
-        return self.__highBeta
-    @highBeta.setter
-    def highBeta(self,value):
-        hb_time_taken = datetime.now().strftime("%H%m%S")
-        self.__highBeta=value
-        if "highBeta" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["highBeta"](self.__highBeta)
-            self.time_value["highBeta"][str(hb_time_taken)] = self.__highBeta
-
-    #lowGamma
-    @property
-    def lowGamma(self):
-        "Get value for lowGamma"
-        return self.__lowGamma
-    @lowGamma.setter
-    def lowGamma(self,value):
-        lg_time_taken = datetime.now().strftime("%H%m%S")
-        self.__lowGamma=value
-        if "lowGamma" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["lowGamma"](self.__lowGamma)
-            self.time_value["lowGamma"][str(lg_time_taken)] = self.__lowGamma
-
-    #midGamma
-    @property
-    def midGamma(self):
-        "Get value for midGamma"
-        return self.__midGamma
-    @midGamma.setter
-    def midGamma(self,value):
-        mg_time_taken = datetime.now().strftime("%H%m%S")
-        self.__midGamma=value
-        if "midGamma" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["midGamma"](self.__midGamma)
-            self.time_value["midGamma"][str(mg_time_taken)] = self.__midGamma
-
-    #poorSignal
-    @property
-    def poorSignal(self):
-        "Get value for poorSignal"
-        return self.__poorSignal
-    @poorSignal.setter
-    def poorSignal(self,value):
-        ps_time_taken = datetime.now().strftime("%H%m%S")
-        self.__poorSignal=value
-        if "poorSignal" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["poorSignal"](self.__poorSignal)
-            self.time_value["poorSignal"][str(ps_time_taken)] = self.__poorSignal
-
-    #blinkStrength
-    @property
-    def blinkStrength(self):
-        "Get value for blinkStrength"
-        return self.__blinkStrength
-    @blinkStrength.setter
-    def blinkStrength(self,value):
-        bs_time_taken = datetime.now().strftime("%H%m%S")
-        self.__blinkStrength=value
-        if "blinkStrength" in self.callBacksDictionary.keys(): #if callback has been set, execute the function
-            self.callBacksDictionary["blinkStrength"](self.__blinkStrength)
-            self.time_value["blinkStrength"][str(bs_time_taken)] = self.__blinkStrength
+    #getters for all variables, the values are set once per packet by __publish
+    attention = _variable("attention")
+    meditation = _variable("meditation")
+    rawValue = _variable("rawValue")
+    delta = _variable("delta")
+    theta = _variable("theta")
+    lowAlpha = _variable("lowAlpha")
+    highAlpha = _variable("highAlpha")
+    lowBeta = _variable("lowBeta")
+    highBeta = _variable("highBeta")
+    lowGamma = _variable("lowGamma")
+    midGamma = _variable("midGamma")
+    poorSignal = _variable("poorSignal")
+    blinkStrength = _variable("blinkStrength")
@@ -8,9 +8,10 @@ from tqdm import tqdm
 att = tqdm(total=100, desc="attention")
 med = tqdm(total=100, desc="meditation")
 
-object1=NeuroSkyPy("/dev/ttyUSB0", 115200, '7d55')
+object1=NeuroSkyPy("/dev/ttyUSB0", 115200)
 
-volume = [ 50, 50, 50, 50, 50]
+# mean of the last 5 values of meditation, kept up to date by the library
+volume = object1.rolling("meditation", "mean", window=5)
 
 def attention_callback(value):
     "this function will be called everytime NeuroPy has a new value for attention"
@@ -25,15 +26,10 @@ def attention_callback(value):
 
 def meditation_callback(value):
 
-    volume.append(value)
-    volume.pop(0)
     med.update(value)
     med.refresh()
     med.update(-value)
-    value = 0
-    for v in volume:
-        value = value + v
-    value = value / len(volume)
+    value = volume.value
 
     os.system("amixer sset 'Master' " + str(value) + "% > /dev/null")
     #do other stuff (fire a rocket), based on the obtained value of attention_value
@@ -45,7 +41,8 @@ def blink_cb(value):
 
 #set call back:
 object1.setCallBack("attention",attention_callback)
-object1.setCallBack("meditation",meditation_callback)
+# amixer is slow, with "latest" it only gets the last value when it falls behind
+object1.setCallBack("meditation",meditation_callback,policy="latest")
 object1.setCallBack("blinkStrength",blink_cb)
 #call start method
 object1.start()
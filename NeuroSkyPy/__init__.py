@@ -1,2 +1,30 @@
-from NeuroSkyPy import NeuroSkyPy
-from IO import *
+"""Reading of NeuroSky's MindWave EEG headsets.
+
+Importing the package only loads the acquisition path (NeuroSkyPy, the parser and the buffers), which needs
+the standard library and pyserial. The plotting and analysis functions of IO, which need numpy and matplotlib,
+and the submodules are imported on first use (PEP 562).
+"""
+import importlib
+
+from .NeuroSkyPy import NeuroSkyPy
+
+# names of IO that the package exported with from .IO import *
+_IO_NAMES = ('COLOR_PREDEFINED', 'generate_hex_color', 'variable_colors', 'path_to_save', 'save_session',
+             'session_series', 'decimate_minmax', 'normalize_max', 'export_session', 'plot_graphics')
+_SUBMODULES = ('IO', 'aio', 'archive', 'batch', 'buffer', 'clock', 'dispatch', 'features', 'hub', 'metrics', 'net',
+               'offline', 'parser', 'quality', 'recorder', 'rolling', 'shm', 'sources', 'triggers')
+
+
+def __getattr__(name):
+    if name in _IO_NAMES:
+        value = getattr(importlib.import_module('.IO', __name__), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_IO_NAMES) | set(_SUBMODULES))
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+
+import serial
+
+from .NeuroSkyPy import NeuroSkyPy
+
+logger = logging.getLogger(__name__)
+
+
+async def _readable(loop, fd):
+    "waits until fd has data to read"
+    future = loop.create_future()
+
+    def ready():
+        if not future.done():
+            future.set_result(None)
+
+    loop.add_reader(fd, ready)
+    try:
+        await future
+    finally:
+        loop.remove_reader(fd)
+
+
+class AsyncNeuroSkyPy(NeuroSkyPy):
+    """asyncio version of NeuroSkyPy, the serial port is read from the event loop instead of a thread
+    so one loop can serve many headsets.
+    i.e.
+        headset = AsyncNeuroSkyPy("/dev/ttyUSB0", 57600)
+        await headset.start()
+        async for sample in headset:
+            print(sample.rawValue)
+        await headset.stop()
+
+    Each iteration gets its own queue of queueSize Samples and the port is not read while one of them
+    is full, the data waits in the OS buffer. Values, buffers and callbacks work as in NeuroSkyPy,
+    callbacks set with the "sync" policy run in the event loop.
+    When the port fails it is opened again as NeuroSkyPy does, waiting reconnectDelay seconds doubled after every
+    failed attempt; with reconnect=False, or after an unexpected error, the reading ends: the error is kept in
+    lastError and the iterations end once their queue is empty.
+    start(source) reads any object with read(size), in_waiting and close() instead, see sources.py, the iterations
+    end when it fails or a replay reaches its end."""
+
+    def __init__(self, port, baudRate=57600, bufferSeconds=600, queueSize=1024, dispatcher=None, reconnect=True,
+                 metrics=True, sampleClock=True):
+        NeuroSkyPy.__init__(self, port, baudRate, bufferSeconds, dispatcher, metrics, sampleClock)
+        self.queueSize = queueSize
+        self.reconnect = reconnect
+        self.__reopen = True  # the port can be opened again, not a source given to start()
+        self.__queues = []
+        self.__task = None
+        self.__stopped = False
+        self.__ended = False  # the reader task is over
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    def __aiter__(self):
+        return self.stream()
+
+    async def start(self, source=None):
+        """opens the port and starts reading it from a task of the running loop.
+           source replaces the serial port with any object with read(size), in_waiting and close(), see sources.py"""
+        loop = asyncio.get_running_loop()
+        self.__stopped = self.__ended = False
+        self.__reopen = source is None
+        self.srl = self.__open() if source is None else source
+        self.connected = True
+        if self.sampleClock is not None:
+            self.sampleClock.reset()
+        self._startDispatcher()
+        self.__task = loop.create_task(self.__reader(loop, self.srl))
+
+    def __open(self):
+        return serial.Serial(self.port, self.baudRate, timeout=0)
+
+    async def stop(self):
+        "cancels the reading, waits for it and closes the port, the iterations end once their queue is empty"
+        self.__stopped = True
+        task, self.__task = self.__task, None
+        try:
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                except Exception:
+                    logger.exception("%s: the reader failed", self.port)
+        finally:
+            self.connected = False
+            if self.srl is not None:
+                try:
+                    self.srl.close()
+                except Exception:
+                    pass
+            self.__wake()
+            self._releaseDispatcher()
+
+    def __wake(self):
+        "wakes up the iterations waiting for a Sample, they end once their queue is empty"
+        for queue in self.__queues:
+            if queue.empty():
+                queue.put_nowait(None)
+
+    async def stream(self, queueSize=None):
+        "async iterator over the Samples received from now on"
+        queue = asyncio.Queue(queueSize or self.queueSize)
+        self.__queues.append(queue)
+        try:
+            while not ((self.__stopped or self.__ended) and queue.empty()):
+                sample = await queue.get()
+                if sample is None:
+                    break
+                yield sample
+        finally:
+            self.__queues.remove(queue)
+
+    async def __reader(self, loop, srl):
+        "reads the port, opening it again when it fails, until stop() or the end of a replay"
+        try:
+            while True:
+                try:
+                    await self.__read(loop, srl)
+                    return
+                except OSError as error:  # serial.SerialException is an IOError
+                    srl = await self.__reconnect(srl, error)
+                    if srl is None:
+                        return
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            self.errors += 1
+            self.lastError = error
+            logger.exception("%s: error reading the port", self.port)
+        finally:
+            self.__ended = True
+            self.__wake()
+
+    async def __reconnect(self, srl, error):
+        "closes a failed port and opens it again with backoff, returns the new one or None with reconnect=False"
+        self._sourceFailed(srl, error)
+        if not self.reconnect or not self.__reopen:  # a source given to start() cannot be opened again
+            return None
+        delay = self.reconnectDelay
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                srl = self.__open()
+            except OSError as error:
+                self._reopenFailed(error)
+                delay = min(delay * 2, self.maxReconnectDelay)
+                continue
+            self._sourceReopened(srl)
+            return srl
+
+    async def __read(self, loop, srl):
+        "reads the port until it fails, returns when a replay reaches its end"
+        try:
+            fd = srl.fileno()
+            await _readable(loop, fd)
+        except (AttributeError, NotImplementedError):
+            # no selectable handle (Windows, the sources without a file), read from the default executor instead
+            srl.timeout = 0.5
+            while True:
+                data = await loop.run_in_executor(None, lambda: srl.read(srl.in_waiting or 1))
+                if not data and getattr(srl, 'exhausted', False):
+                    return
+                await self.__deliver(data)
+        while True:
+            await self.__deliver(srl.read(srl.in_waiting or 1))
+            await _readable(loop, fd)
+
+    async def __deliver(self, data):
+        try:
+            samples = self.feed(data)
+        except Exception as error:
+            # a bad packet or callback must not stop the reading
+            self.errors += 1
+            self.lastError = error
+            logger.exception("%s: error handling the data read", self.port)
+            return
+        for sample in samples:
+            for queue in self.__queues:
+                if queue.full():  # backpressure, stop reading until the consumer catches up
+                    await queue.put(sample)
+                else:
+                    queue.put_nowait(sample)
@@ -0,0 +1,227 @@
+import json
+import os
+import time
+from time import monotonic_ns
+
+import numpy as np
+
+from .dispatch import SYNC
+from .parser import FIELD_DTYPES
+
+ARCHIVE = 'archive.json'
+# one timestamp of the sparse index every INDEX_STRIDE records
+INDEX_STRIDE = 1024
+
+
+def record_dtype(name):
+    '''
+    Fixed width record of a channel in the archive, little-endian on every platform
+    :param name: name of the variable
+    :return: numpy structured dtype with timestamp and value
+    '''
+    return np.dtype([('timestamp', '<i8'), ('value', '<' + FIELD_DTYPES[name])])
+
+
+class _Channel(object):
+    "files, memory maps and pending records of a channel of the archive"
+
+    def __init__(self, directory, name, bufferRecords):
+        self.name = name
+        self.dtype = record_dtype(name)
+        self.path = os.path.join(directory, name + '.dat')
+        self.indexPath = os.path.join(directory, name + '.idx')
+        self.records = np.zeros(0, self.dtype)
+        self.index = np.zeros(0, '<i8')
+        self.file = None
+        self.indexFile = None
+        self.pending = np.zeros(bufferRecords, self.dtype) if bufferRecords else None
+        self.rows = 0
+        self.opened = 0  # timestamp of the first pending record
+        self.count = 0  # records in the file
+
+
+class SessionArchive(object):
+    """Decoded values of a session on disk as one file of fixed width records (timestamp, value) per channel and
+    a sparse index with the timestamp of every INDEX_STRIDE-th record, read through np.memmap.
+    i.e.
+        archive=SessionArchive("./session1.archive", mode="a")
+        archive.attach(headset)  # or archive.record(sample) / archive.append(channel, timestamps, values)
+        ...
+        times, values = SessionArchive("./session1.archive").slice("rawValue", t0, t1)
+    slice() finds the records with two binary searches, on the index and in one block of the file, and returns
+    views of the memory map, nothing is copied or read beyond the pages touched. There is one writer, mode "a",
+    which appends whole records and then their index entries, and any number of readers, in other processes
+    too, that size the channels from the length of their files, so they see the records flushed so far.
+    The writer keeps bufferRecords records per channel and writes them when the buffer is full or flushSeconds
+    after the first one."""
+
+    def __init__(self, directory, mode='r', bufferRecords=512, flushSeconds=1.0):
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'")
+        self.directory = directory
+        self.mode = mode
+        self.flushNs = int(flushSeconds * 1e9)
+        self.subscription = None
+        self.headset = None
+        header = os.path.join(directory, ARCHIVE)
+        if mode == 'a' and not os.path.exists(header):
+            os.makedirs(directory, exist_ok=True)
+            info = {
+                'channels': dict((name, record_dtype(name).descr) for name in FIELD_DTYPES),
+                'indexStride': INDEX_STRIDE,
+                'wallOffsetNs': time.time_ns() - monotonic_ns(),
+            }
+            with open(header + '.tmp', 'w') as f:
+                json.dump(info, f)
+            os.replace(header + '.tmp', header)
+        with open(header) as f:
+            self.info = json.load(f)
+        self.stride = self.info['indexStride']
+        self.__channels = dict((name, _Channel(directory, name, bufferRecords if mode == 'a' else 0))
+                               for name in self.info['channels'])
+        if mode == 'a':
+            for channel in self.__channels.values():
+                self.__openForAppend(channel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __openForAppend(self, channel):
+        "opens the files of a channel, a record cut by a crash is dropped and the index is rebuilt from the records"
+        size = os.path.getsize(channel.path) if os.path.exists(channel.path) else 0
+        channel.count = size // channel.dtype.itemsize
+        channel.file = open(channel.path, 'ab')
+        if size % channel.dtype.itemsize:
+            channel.file.truncate(channel.count * channel.dtype.itemsize)
+        records = self.__records(channel)
+        index = records['timestamp'][::self.stride].astype('<i8')
+        with open(channel.indexPath, 'wb') as f:
+            f.write(index.tobytes())
+        channel.indexFile = open(channel.indexPath, 'ab')
+
+    def channels(self):
+        return list(self.__channels)
+
+    def count(self, channel):
+        "records of a channel in the files"
+        return len(self.__records(self.__channels[channel]))
+
+    def __records(self, channel):
+        "memory map of the records of a channel, mapped again when the file has grown"
+        try:
+            count = os.path.getsize(channel.path) // channel.dtype.itemsize
+        except OSError:
+            count = 0
+        if count != len(channel.records):
+            channel.records = np.memmap(channel.path, channel.dtype, 'r', shape=(count,)) if count else \
+                np.zeros(0, channel.dtype)
+        return channel.records
+
+    def __index(self, channel, count):
+        "memory map of the index entries of the first count records"
+        try:
+            entries = min(os.path.getsize(channel.indexPath) // 8, -(-count // self.stride))
+        except OSError:
+            entries = 0
+        if entries != len(channel.index):
+            channel.index = np.memmap(channel.indexPath, '<i8', 'r', shape=(entries,)) if entries else \
+                np.zeros(0, '<i8')
+        return channel.index
+
+    def __locate(self, times, index, timestamp, side):
+        "position of timestamp in times, searching the index first and then one block of records"
+        block = int(np.searchsorted(index, timestamp, side=side))
+        first = max(block - 1, 0) * self.stride
+        last = min(block * self.stride + 1, len(times)) if block < len(index) else len(times)
+        return first + int(np.searchsorted(times[first:last], timestamp, side=side))
+
+    def slice(self, channel, t0, t1):
+        "returns (timestamps, values) views of the records of a channel taken between t0 and t1, both included"
+        channel = self.__channels[channel]
+        records = self.__records(channel)
+        index = self.__index(channel, len(records))
+        times = records['timestamp']
+        first = self.__locate(times, index, t0, 'left')
+        last = self.__locate(times, index, t1, 'right')
+        return times[first:last], records['value'][first:last]
+
+    def latest(self, channel, n):
+        "returns (timestamps, values) views of the last n records of a channel"
+        records = self.__records(self.__channels[channel])
+        records = records[max(len(records) - n, 0):]
+        return records['timestamp'], records['value']
+
+    def attach(self, headset):
+        "archives every packet of a NeuroSkyPy object, through a subscription to its 'packet' variable"
+        self.detach()
+        self.headset = headset
+        self.subscription = headset.subscribe("packet", self.record, policy=SYNC)
+
+    def detach(self):
+        "stops archiving the packets of the NeuroSkyPy object attached"
+        if self.subscription is not None:
+            self.headset.unsubscribe(self.subscription)
+            self.subscription = self.headset = None
+
+    def record(self, sample):
+        "appends the values of a decoded Sample"
+        timestamp = sample.timestamp
+        for name, value in sample.items():
+            channel = self.__channels[name]
+            if channel.rows and timestamp - channel.opened >= self.flushNs:
+                self.__flushChannel(channel)
+            if not channel.rows:
+                channel.opened = timestamp
+            channel.pending[channel.rows] = (timestamp, value)
+            channel.rows += 1
+            if channel.rows == len(channel.pending):
+                self.__flushChannel(channel)
+
+    def append(self, channel, timestamps, values):
+        "appends arrays of records to a channel, in order of time after the ones already there"
+        channel = self.__channels[channel]
+        self.__flushChannel(channel)
+        records = np.zeros(len(timestamps), channel.dtype)
+        records['timestamp'] = timestamps
+        records['value'] = values
+        self.__write(channel, records)
+
+    def __flushChannel(self, channel):
+        if channel.rows:
+            self.__write(channel, channel.pending[:channel.rows])
+            channel.rows = 0
+
+    def __write(self, channel, records):
+        "appends whole records, then the index entries of the ones that fall on the stride"
+        if self.mode != 'a':
+            raise IOError("the archive is open for reading")
+        channel.file.write(records.tobytes())
+        channel.file.flush()
+        start = channel.count
+        channel.count += len(records)
+        first = -(-start // self.stride) * self.stride
+        entries = records['timestamp'][first - start:len(records):self.stride]
+        if len(entries):
+            channel.indexFile.write(entries.astype('<i8').tobytes())
+            channel.indexFile.flush()
+
+    def flush(self):
+        "writes the pending records of every channel"
+        for channel in self.__channels.values():
+            self.__flushChannel(channel)
+
+    def close(self):
+        "detaches, writes the pending records and closes the files"
+        self.detach()
+        if self.mode == 'a':
+            self.flush()
+        for channel in self.__channels.values():
+            for f in (channel.file, channel.indexFile):
+                if f is not None:
+                    f.close()
+            channel.file = channel.indexFile = None
+            channel.records = np.zeros(0, channel.dtype)
+            channel.index = np.zeros(0, '<i8')
@@ -0,0 +1,338 @@
+"""Batch processing of recorded sessions: neuroskypy-batch INPUT -o OUTPUT [-j N]
+
+Every session found in INPUT, a raw serial capture (.bin, .raw or .cap file), a SessionRecorder directory or a
+SessionArchive directory, goes through the stages:
+    decode    the values of every variable, with offline.decode_capture for the captures
+    quality   QualityMonitor flags of the raw signal, stored as the quality table
+    features  BandPowerEngine band powers of the windows without rejected samples
+    export    PNG figures with IO.export_session
+The tables are written to OUTPUT/<session>/ in Parquet (or the best format available, see recorder.py) by a
+pool of processes, one session per process. OUTPUT/<session>/progress.json keeps the content hash of the
+session and the stages completed: an unchanged session is skipped, an interrupted one resumes after its last
+completed stage, and a session whose content or options changed is processed again. The time of every stage
+is reported per session and in total.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from .parser import BAND_NAMES
+
+STAGES = ('decode', 'quality', 'features', 'export')
+CAPTURE_EXTENSIONS = ('.bin', '.raw', '.cap')
+PROGRESS = 'progress.json'
+# options that change the tables, a session is processed again when they change
+TABLE_OPTIONS = ('format', 'window', 'hop')
+# changes when the outputs of the stages change, so that every session is processed again
+PIPELINE_VERSION = 1
+RAW_RATE = 512
+
+
+def find_sessions(directory):
+    '''
+    Sessions of a directory: captures, SessionRecorder and SessionArchive directories
+    :param directory: folder with the sessions
+    :return: list of (name, kind, path) in order of name, kind is capture, recording or archive, the name of a
+             capture keeps its extension so that s1.bin, s1.raw and a folder s1 get separate results
+    '''
+    from .archive import ARCHIVE
+    from .recorder import SESSION
+    sessions = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.startswith('.'):
+            continue
+        if os.path.isdir(path):
+            if os.path.exists(os.path.join(path, SESSION)):
+                sessions.append((name, 'recording', path))
+            elif os.path.exists(os.path.join(path, ARCHIVE)):
+                sessions.append((name, 'archive', path))
+        elif os.path.splitext(name)[1].lower() in CAPTURE_EXTENSIONS:
+            sessions.append((name, 'capture', path))
+    return sessions
+
+
+def content_hash(path, options):
+    '''
+    Hash of the content of a session and of the options that change its outputs
+    :param path: capture file or session directory
+    :param options: dict of options, JSON serializable
+    :return: hex digest
+    '''
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([PIPELINE_VERSION, options], sort_keys=True).encode('utf-8'))
+    if os.path.isdir(path):
+        files = sorted(os.path.relpath(os.path.join(root, name), path)
+                       for root, dirs, names in os.walk(path) for name in names if not name.endswith('.tmp'))
+    else:
+        files = ['']
+    for name in files:
+        digest.update(name.replace(os.sep, '/').encode('utf-8') + b'\0')
+        with open(os.path.join(path, name) if name else path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def decode_session(kind, path):
+    '''
+    Values of every variable of a session
+    :param kind: capture, recording or archive
+    :param path: capture file or session directory
+    :return: dict of variable -> (timestamps, values) arrays, timestamps in nanoseconds
+    '''
+    signals = {}
+    if kind == 'capture':
+        from .offline import decode_capture
+        columns = decode_capture(path)
+        # a capture has no times: the raw values are 1/512 s apart and the other packets take the time of the
+        # raw value before them, of the first one when there is none
+        raw = columns['rawValue'][0]
+        period = 10 ** 9 // RAW_RATE
+        for name, (packets, values) in columns.items():
+            if len(packets):
+                index = np.maximum(np.searchsorted(raw, packets, side='right') - 1, 0)
+                signals[name] = (index.astype(np.int64) * period, values)
+    elif kind == 'recording':
+        from .recorder import TABLES, SessionReader
+        reader = SessionReader(path)
+        for table, fields in TABLES:
+            if not reader.rows(table):
+                continue
+            data = reader.read(table, ('timestamp',) + tuple(fields))
+            for name in fields:
+                signals[name] = (data['timestamp'], data[name])
+    else:
+        from .archive import SessionArchive
+        with SessionArchive(path) as archive:
+            for name in archive.channels():
+                count = archive.count(name)
+                if count:
+                    times, values = archive.latest(name, count)
+                    signals[name] = (np.array(times), np.array(values))
+    return signals
+
+
+def check_quality(signals, window=512, reject=None):
+    '''
+    Quality flags of the raw signal of a session, with the poorSignal reported at every moment
+    :param signals: dict of variable -> (timestamps, values)
+    :param window: samples per window
+    :param reject: flags that make a window bad, all by default
+    :return: (rows of QUALITY_DTYPE, boolean array with the good raw samples)
+    '''
+    from .quality import ALL_FLAGS, QUALITY_DTYPE, QualityMonitor, sample_mask
+    times, values = signals.get('rawValue', (np.zeros(0, dtype=np.int64), np.zeros(0)))
+    monitor = QualityMonitor(RAW_RATE, window)
+    blocks = []
+    # the raw values are pushed up to every change of poorSignal, which applies to the windows after it
+    poorTimes, poorValues = signals.get('poorSignal', ((), ()))
+    pos = 0
+    for poorTime, poorValue in zip(np.asarray(poorTimes).tolist(), np.asarray(poorValues).tolist()):
+        end = int(np.searchsorted(times, poorTime, side='right'))
+        if end > pos:
+            blocks.append(monitor.push(times[pos:end], values[pos:end]))
+            pos = end
+        monitor.setPoorSignal(poorValue)
+    blocks.append(monitor.push(times[pos:], values[pos:]))
+    rows = np.zeros(sum(len(block[0]) for block in blocks), QUALITY_DTYPE)
+    rows['timestamp'] = np.concatenate([block[0] for block in blocks])
+    rows['flags'] = np.concatenate([block[1] for block in blocks])
+    # the first sample of every window, window - 1 samples before its last one
+    last = np.searchsorted(times, rows['timestamp'], side='left')
+    rows['start'] = times[np.maximum(last - window + 1, 0)] if len(times) else rows['timestamp']
+    good = sample_mask(times, rows['start'], rows['timestamp'], rows['flags'], ALL_FLAGS if reject is None else reject)
+    return rows, good
+
+
+def compute_features(signals, good, window=512, hop=128):
+    '''
+    Band powers of the windows of the raw signal without rejected samples
+    :param signals: dict of variable -> (timestamps, values)
+    :param good: boolean array with the good raw samples
+    :param window: samples per window
+    :param hop: samples between two windows
+    :return: (structured array with timestamp and one column per band, windows rejected)
+    '''
+    from .features import BandPowerEngine
+    dtype = np.dtype([('timestamp', np.int64)] + [(name, np.float64) for name in BAND_NAMES])
+    times, values = signals.get('rawValue', (np.zeros(0, dtype=np.int64), np.zeros(0)))
+    windowTimes, powers = BandPowerEngine(RAW_RATE, window, hop).push(times, values)
+    # bad samples up to every sample, a window is kept when none of its samples is bad
+    bad = np.concatenate(([0], np.cumsum(~good)))
+    last = np.searchsorted(times, windowTimes, side='left')
+    keep = bad[last + 1] - bad[np.maximum(last + 1 - window, 0)] == 0
+    rows = np.zeros(int(keep.sum()), dtype)
+    rows['timestamp'] = windowTimes[keep]
+    for i, name in enumerate(BAND_NAMES):
+        rows[name] = powers[keep, i]
+    return rows, int(len(keep) - keep.sum())
+
+
+def _signal_rows(times, values):
+    rows = np.zeros(len(times), [('timestamp', np.int64), ('value', np.asarray(values).dtype)])
+    rows['timestamp'] = times
+    rows['value'] = values
+    return rows
+
+
+class _Progress(object):
+    "stages completed of a session, kept in progress.json and replaced atomically after every stage"
+
+    def __init__(self, folder, digest):
+        self.path = os.path.join(folder, PROGRESS)
+        self.digest = digest
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        # a session whose content or options changed starts again
+        self.stages = state.get('stages', {}) if state.get('hash') == digest else {}
+        self.info = state.get('info', {}) if state.get('hash') == digest else {}
+
+    def done(self, stage, seconds, **info):
+        self.stages[stage] = seconds
+        self.info.update(info)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'hash': self.digest, 'stages': self.stages, 'info': self.info}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def process_session(job):
+    '''
+    Runs the stages of a session that are not done yet, in a worker of the pool
+    :param job: (name, kind, path, output folder, options)
+    :return: (name, status, seconds per stage run, info or error message)
+    '''
+    name, kind, path, output, options = job
+    try:
+        from .recorder import EXTENSIONS, _read_part, _write_part
+        folder = os.path.join(output, name)
+        os.makedirs(folder, exist_ok=True)
+        start = time.perf_counter()
+        # the tables depend on the content and on these options, the figures on the variables drawn as well
+        progress = _Progress(folder, content_hash(path, dict((key, options[key]) for key in TABLE_OPTIONS)))
+        if progress.info.get('exclude') != options['exclude']:
+            progress.stages.pop('export', None)
+        timings = {'hash': time.perf_counter() - start}
+        stages = [stage for stage in STAGES if stage != 'export' or options['images']]
+        if all(stage in progress.stages for stage in stages):
+            return name, 'unchanged', timings, progress.info
+        status = 'resumed' if progress.stages else 'processed'
+        fmt = options['format']
+
+        def table(table_name):
+            return os.path.join(folder, table_name + EXTENSIONS[fmt])
+
+        def write(table_name, rows):
+            # written aside and renamed, an interrupted write never looks complete
+            temporary = table(table_name) + '.tmp'
+            _write_part(fmt, temporary, rows)
+            os.replace(temporary, table(table_name))
+
+        def read(table_name, columns):
+            return _read_part(fmt, table(table_name), columns, None, None)
+
+        signals = good = None
+        for stage in stages:
+            if stage in progress.stages:
+                continue
+            start = time.perf_counter()
+            info = {}
+            if signals is None:
+                if 'decode' in progress.stages:
+                    signals = {}
+                    for variable in progress.info['variables']:
+                        data = read(variable, ('timestamp', 'value'))
+                        signals[variable] = (data['timestamp'], data['value'])
+                else:
+                    signals = decode_session(kind, path)
+            if stage == 'decode':
+                for variable, (times, values) in signals.items():
+                    write(variable, _signal_rows(times, values))
+                info['variables'] = sorted(signals)
+                info['rawSamples'] = len(signals.get('rawValue', ((),))[0])
+            elif stage == 'quality':
+                rows, good = check_quality(signals, options['window'])
+                write('quality', rows)
+                info['rejectedSamples'] = int((~good).sum())
+            elif stage == 'features':
+                if good is None:
+                    from .quality import ALL_FLAGS, sample_mask
+                    rows = read('quality', ('timestamp', 'start', 'flags'))
+                    good = sample_mask(signals.get('rawValue', ((),))[0], rows['start'], rows['timestamp'],
+                                       rows['flags'], ALL_FLAGS)
+                rows, rejected = compute_features(signals, good, options['window'], options['hop'])
+                write('features', rows)
+                info['windows'] = len(rows)
+                info['rejectedWindows'] = rejected
+            else:
+                from .IO import export_session
+                config = {'name': name, 'hour_exp': kind, 'root': output, 'folder_exp': name,
+                          'exclude_from_drawing': options['exclude']}
+                info['images'] = len(export_session(signals, config, processes=1))
+                info['exclude'] = options['exclude']
+            timings[stage] = time.perf_counter() - start
+            progress.done(stage, timings[stage], **info)
+        return name, status, timings, progress.info
+    except Exception as error:
+        return name, 'failed', {}, "%s: %s" % (type(error).__name__, error)
+
+
+def main(argv=None):
+    from .recorder import FORMATS, default_format
+    options = argparse.ArgumentParser(prog='neuroskypy-batch', description=__doc__.splitlines()[0])
+    options.add_argument('input', help="folder with the captures and recorded sessions")
+    options.add_argument('-o', '--output', default='neuroskypy-batch', help="folder of the results")
+    options.add_argument('-j', '--processes', type=int, default=None, help="sessions at once, one per cpu by default")
+    options.add_argument('--format', choices=FORMATS, default=None, help="format of the tables, parquet if available")
+    options.add_argument('--window', type=int, default=512, help="raw samples per quality and features window")
+    options.add_argument('--hop', type=int, default=128, help="raw samples between two features windows")
+    options.add_argument('--no-images', dest='images', action='store_false', help="skip the PNG export")
+    options.add_argument('--exclude', nargs='*', default=[], help="variables left out of the figures")
+    options.add_argument('--force', action='store_true', help="process every session again")
+    args = options.parse_args(argv)
+
+    sessions = find_sessions(args.input)
+    if not sessions:
+        print("no sessions found in %s" % args.input)
+        return 0
+    settings = {'format': args.format or default_format(), 'window': args.window, 'hop': args.hop,
+                'images': args.images, 'exclude': sorted(args.exclude)}
+    os.makedirs(args.output, exist_ok=True)
+    if args.force:
+        for name, kind, path in sessions:
+            progress = os.path.join(args.output, name, PROGRESS)
+            if os.path.exists(progress):
+                os.remove(progress)
+    jobs = [(name, kind, path, args.output, settings) for name, kind, path in sessions]
+    processes = max(1, min(args.processes or os.cpu_count() or 1, len(jobs)))
+
+    totals = dict((stage, 0.0) for stage in ('hash',) + STAGES)
+    counts = {}
+    start = time.perf_counter()
+    with multiprocessing.Pool(processes) as pool:
+        for name, status, timings, info in pool.imap_unordered(process_session, jobs):
+            counts[status] = counts.get(status, 0) + 1
+            for stage, seconds in timings.items():
+                totals[stage] += seconds
+            if status == 'failed':
+                print("%-32s failed    %s" % (name, info))
+            else:
+                print("%-32s %-9s %s" % (name, status, " ".join("%s %.2fs" % item for item in timings.items())))
+    elapsed = time.perf_counter() - start
+    print("%d sessions in %.1f s with %d processes: %s" %
+          (len(jobs), elapsed, processes, ", ".join("%d %s" % (n, status) for status, n in sorted(counts.items()))))
+    print("wall time per stage, summed over the sessions: " + ", ".join("%s %.2fs" % item for item in totals.items()))
+    return 1 if counts.get('failed') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+# samples per second sent by the headset for each variable, the ones not listed come once per second
+CHANNEL_RATES = {'rawValue': 512}
+
+
+def _typecodes():
+    "array typecode of every numpy dtype string a RingBuffer can hold, by the item sizes of this platform"
+    codes = {'f4': 'f', 'f8': 'd'}
+    for kind, letters in (('i', 'bhilq'), ('u', 'BHILQ')):
+        for letter in letters:
+            codes.setdefault('%s%d' % (kind, array(letter).itemsize), letter)
+    return codes
+
+
+TYPECODES = _typecodes()
+
+
+class RingBuffer(object):
+    """Preallocated time series of fixed capacity, the oldest samples are overwritten once it is full.
+    Every sample is written twice, at i and i+capacity, so the last `capacity` samples are always
+    contiguous and latest() and window() return views instead of copies.
+    i.e. times, values = buffer.latest(512)
+    The samples are kept in arrays of the standard library, numpy is only imported by latest() and window().
+    The views are read-only and share memory with the buffer, copy them to keep them around"""
+
+    def __init__(self, capacity, dtype='f8'):
+        self.capacity = int(capacity)
+        self.count = 0  # samples appended since the creation, including the overwritten ones
+        self.__head = 0  # index where the next sample is written
+        if dtype not in TYPECODES:
+            import numpy as np
+            dtype = np.dtype(dtype).str[1:]
+        if dtype not in TYPECODES:
+            raise ValueError("dtype not supported by RingBuffer: " + dtype)
+        self.dtype = dtype
+        code = TYPECODES[dtype]
+        self.__times = array('q', bytes(2 * self.capacity * array('q').itemsize))
+        self.__values = array(code, bytes(2 * self.capacity * array(code).itemsize))
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, value):
+        "stores a sample taken at timestamp (time.monotonic_ns())"
+        head = self.__head
+        mirror = head + self.capacity
+        self.__times[head] = self.__times[mirror] = timestamp
+        self.__values[head] = self.__values[mirror] = value
+        self.__head = head + 1 if head + 1 < self.capacity else 0
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+        self.__head = 0
+
+    def last(self):
+        "returns (timestamp, value) of the newest sample, without numpy, or None when it is empty"
+        if not self.count:
+            return None
+        stop = self.__head + self.capacity - 1
+        return self.__times[stop], self.__values[stop]
+
+    def latest(self, n=None):
+        "returns (timestamps, values) views of the last n samples, all the stored ones by default"
+        size = len(self)
+        n = size if n is None else max(0, min(n, size))
+        stop = self.__head + self.capacity
+        return self.__views(stop - n, stop)
+
+    def window(self, t0, t1):
+        "returns (timestamps, values) views of the stored samples taken between t0 and t1, both included"
+        stop = self.__head + self.capacity
+        start = stop - len(self)
+        return self.__views(bisect_left(self.__times, t0, start, stop), bisect_right(self.__times, t1, start, stop))
+
+    def __views(self, start, stop):
+        import numpy as np
+        times = np.frombuffer(self.__times, dtype=np.int64)[start:stop]
+        values = np.frombuffer(self.__values, dtype=self.dtype)[start:stop]
+        times.flags.writeable = values.flags.writeable = False
+        return times, values
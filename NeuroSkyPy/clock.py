@@ -0,0 +1,237 @@
+"""Reconstruction of the sample clock of the headset from the arrival times of the raw values.
+
+The MindWave samples at a nominal 512 Hz but the values reach the host in bursts, when the USB dongle or the
+OS flush their buffers, so the arrival times carry several milliseconds of jitter. A sample never arrives
+before it is taken, so the arrivals lie above the line of the true sample times: SampleClock fits that line to
+the lower envelope of the arrivals, which gives the device's actual rate (its drift from 512 Hz) and times the
+samples with the jitter removed.
+"""
+import math
+
+
+def lower_line(x, y):
+    '''
+    Line below every point that is closest to them on average, the lower envelope fit of Moon et al. (1999):
+    the edge of the lower convex hull of the points that spans their mean abscissa
+    :param x: increasing abscissas
+    :param y: ordinates
+    :return: (slope, intercept)
+    '''
+    hull = []
+    for point in zip(x, y):
+        while len(hull) >= 2:
+            (x1, y1), (x2, y2) = hull[-2], hull[-1]
+            if (x2 - x1) * (point[1] - y1) - (y2 - y1) * (point[0] - x1) > 0:
+                break
+            hull.pop()
+        hull.append(point)
+    if len(hull) == 1:
+        return 0.0, float(hull[0][1])
+    middle = sum(x) / float(len(x))
+    for (x1, y1), (x2, y2) in zip(hull, hull[1:]):
+        if x2 >= middle:
+            break
+    slope = (y2 - y1) / float(x2 - x1)
+    return slope, y1 - slope * x1
+
+
+class SampleClock(object):
+    """Times the raw samples of a headset on a fitted sample clock instead of their arrival.
+    i.e.
+        clock=SampleClock(rate=512)
+        times = clock.stamp(arrival, count)  # the count samples decoded from a read made at arrival
+        times = clock.push(arrivals)  # or an array with the arrival of every sample, i.e. of a recording
+    Every read gives a point (index of its last sample, arrival - nominal time of it). The lowest point of each
+    block of blockSize samples is kept, for the last `blocks` blocks, and a line is fitted below them with
+    lower_line(): its slope is the drift of the device clock, bounded to maxDriftPpm, and the samples are timed
+    on it, the drift is only fitted on blocks spanning fitSeconds. The times always increase, also across
+    segments, and never exceed the arrival unless it is needed to keep them increasing.
+    After a loss of data (lost=True, i.e. the parser discarded bytes) the number of samples lost is the distance
+    of the next block to the fit in periods, since the last sample of every read arrives less than a period after
+    the envelope. The clock starts a new segment, keeping the drift, when losses come too close to count them,
+    after a gap of gapSeconds beyond the fit and on reset(), where the offset is fitted again.
+    The times are the true sample times plus the smallest latency of the link, which is about the same for
+    every headset of a kind, so headsets read by one host line up to a fraction of a millisecond.
+    A source faster than real time (a replay, a recording parsed at once) is detected when the samples of a
+    segment arrive gapSeconds sooner than the nominal rate and the largest drift allow: ahead is set and, until
+    reset(), the samples are spaced by the nominal period instead of being held below their arrival."""
+
+    # reads after a loss of data needed to count the samples lost, the lowest of them is near the envelope
+    MIN_READS = 4
+
+    def __init__(self, rate=512.0, blockSize=64, blocks=128, maxDriftPpm=1000.0, gapSeconds=0.1, fitSeconds=4.0):
+        self.rate = float(rate)
+        self.nominal = 1e9 / rate  # nanoseconds between samples
+        self.blockSize = blockSize
+        self.blocks = blocks
+        self.maxDrift = maxDriftPpm * 1e-6 * self.nominal
+        self.gap = gapSeconds * 1e9
+        self.fitSpan = fitSeconds * rate
+        self.slope = 0.0  # nanoseconds per sample beyond the nominal period, kept across segments
+        self.segments = 0
+        self.samples = 0
+        self.lostSamples = 0  # samples found missing after the losses of data
+        self.__last = None  # time of the last sample, kept across segments so the times always increase
+        self.reset()
+
+    def reset(self):
+        "starts a new segment with the next sample, i.e. after the headset reconnects, its times stay above the last one"
+        self.__origin = None  # arrival of the first read of the segment, times are relative to it
+        self.__count = 0  # samples of the segment
+        self.__points = ([], [])  # lowest (index, residual) of the last blocks
+        self.__blockEnd = self.blockSize
+        self.__best = None  # lowest (index, residual) of the open block
+        self.__lost = False  # there was a loss of data in the open block
+        self.__reads = 0  # reads since the last loss of data
+        self.__intercept = 0.0
+        self.__first = None  # residual of the first read of the segment
+        self.ahead = False  # the samples arrive faster than real time
+
+    @property
+    def driftPpm(self):
+        "deviation of the device clock from the nominal rate, positive when it runs slow"
+        return 1e6 * self.slope / self.nominal
+
+    @property
+    def period(self):
+        "fitted nanoseconds between samples"
+        return self.nominal + self.slope
+
+    def stamp(self, arrival, count, lost=False):
+        "returns the times (list of int) of count samples that arrived together at arrival"
+        if count <= 0:
+            return []
+        if self.ahead:
+            return self.__nominalTimes(arrival, count)
+        if self.__origin is None:
+            self.__newSegment(arrival)
+        elif lost and (not self.__points[0] or (self.__lost and self.__reads < self.MIN_READS)):
+            # too few reads since the previous loss to count the samples lost, the offset is fitted again
+            self.__newSegment(arrival)
+        elif lost:
+            # the block before the loss is closed as it is, the next one tells how many samples were lost
+            if self.__best is not None:
+                self.__closeBlock()
+            self.__blockEnd = self.__count + self.blockSize
+            self.__lost = True
+            self.__reads = 0
+        origin = self.__origin
+        first = self.__count
+        last = first + count - 1
+        residual = arrival - origin - last * self.nominal
+        if residual - (self.__intercept + self.slope * last) > self.gap:
+            self.__newSegment(arrival)
+            origin, first, last, residual = arrival, 0, count - 1, -(count - 1) * self.nominal
+        if self.__first is None:
+            self.__first = residual
+        elif self.__first - residual > self.gap + self.maxDrift * last:
+            # more samples than the headset can take since the first read: not a real time source
+            self.ahead = True
+            return self.__nominalTimes(arrival, count)
+        self.__count = last + 1
+        self.__reads += 1
+        self.samples += count
+
+        best = self.__best
+        if best is None or residual < best[1]:
+            self.__best = best = (last, residual)
+        # samples lost before this read, known for sure when the block closes
+        shift = self.__missing(*best) if self.__lost else 0
+        if self.__count >= self.__blockEnd:
+            self.__closeBlock()
+        elif not self.__points[0]:
+            self.__fit([best[0]], [best[1]])  # no block yet, the open one sets the offset
+
+        period = self.nominal + self.slope
+        t = self.__intercept + (first + shift) * period
+        previous = self.__last
+        times = []
+        for _ in range(count):
+            value = origin + int(t)
+            if value > arrival:  # not taken after it arrived
+                value = arrival
+            if previous is not None and value <= previous:
+                value = previous + 1
+            times.append(value)
+            previous = value
+            t += period
+        self.__last = previous
+        return times
+
+    def __nominalTimes(self, arrival, count):
+        "times of count samples of a source faster than real time, a nominal period after the previous ones"
+        previous = self.__last if self.__last is not None else arrival - int(count * self.nominal)
+        times = [previous + int((i + 1) * self.nominal) for i in range(count)]
+        self.__last = times[-1]
+        self.samples += count
+        return times
+
+    def push(self, arrivals, lost=None):
+        '''
+        Times the samples of an array with the arrival of each, the samples of one read share their arrival
+        :param arrivals: int64 array, time.monotonic_ns() of every sample
+        :param lost: optional boolean array, True anywhere in the reads that came after a loss of data
+        :return: int64 array of the sample times
+        '''
+        import numpy as np
+        arrivals = np.asarray(arrivals, dtype=np.int64)
+        if not len(arrivals):
+            return np.zeros(0, dtype=np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(arrivals)) + 1))
+        bounds = starts.tolist() + [len(arrivals)]
+        losses = np.logical_or.reduceat(np.asarray(lost, dtype=bool), starts).tolist() if lost is not None else \
+            [False] * len(starts)
+        times = []
+        for first, end, loss in zip(bounds, bounds[1:], losses):
+            times.extend(self.stamp(int(arrivals[first]), end - first, loss))
+        return np.array(times, dtype=np.int64)
+
+    def restamp(self, samples, lost=False):
+        "replaces the timestamp of the Samples with a raw value by their sample time, returns them"
+        raw = [sample for sample in samples if sample.rawValue is not None]
+        if raw:
+            for sample, timestamp in zip(raw, self.stamp(raw[-1].timestamp, len(raw), lost)):
+                sample.timestamp = timestamp
+        return samples
+
+    def __newSegment(self, arrival):
+        if self.__origin is not None:
+            self.reset()
+        self.__origin = arrival
+        self.__intercept = 0.0
+        self.segments += 1
+
+    def __closeBlock(self):
+        x, y = self.__points
+        index, residual = self.__best
+        if self.__lost:
+            missing = self.__missing(index, residual)
+            if missing:
+                index += missing
+                residual -= missing * self.nominal
+                self.__count += missing
+                self.lostSamples += missing
+            self.__lost = False
+        x.append(index)
+        y.append(residual)
+        if len(x) > self.blocks:
+            del x[0], y[0]
+        self.__best = None
+        self.__blockEnd = (self.__count // self.blockSize + 1) * self.blockSize
+        self.__fit(x, y)
+
+    def __missing(self, index, residual):
+        "samples lost, the whole periods a point after a loss of data is above the fit"
+        # a quarter of a period of margin for the error of the fit, the point of a block is rarely further
+        return max(0, int(math.floor((residual - self.__intercept - self.slope * index) / self.nominal + 0.25)))
+
+    def __fit(self, x, y):
+        if len(x) >= 2 and x[-1] - x[0] >= self.fitSpan:
+            slope, intercept = lower_line(x, y)
+            if abs(slope) <= self.maxDrift:
+                self.slope = slope
+                self.__intercept = intercept
+                return
+            self.slope = max(-self.maxDrift, min(self.maxDrift, slope))
+        # one point or a slope out of bounds: the drift known so far, as low as the points allow
+        self.__intercept = min(yi - self.slope * xi for xi, yi in zip(x, y))
@@ -0,0 +1,285 @@
+import logging
+import queue
+import threading
+from collections import deque
+from time import monotonic_ns
+
+# delivery policies of a subscription
+SYNC = 'sync'  # called in the thread that publishes, i.e. the parser thread
+EVERY = 'every'  # every value, in order, from a worker
+LATEST = 'latest'  # only the last value published since the previous call, from a worker
+BATCH = 'batch'  # (timestamps, values) arrays of batchSize values or batchMillis milliseconds, from a worker
+POLICIES = (SYNC, EVERY, LATEST, BATCH)
+CLOSE = object()  # queued by close(), one per worker
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription(object):
+    """A callback registered in a CallbackDispatcher with its delivery policy.
+    publish(timestamp, value) queues the value, the dispatcher workers call the callback.
+    Counters: delivered, dropped (oldest values discarded because the queue was full), coalesced (values
+    replaced by a newer one with the latest policy), errors, and latency (publish to call) and callback
+    time in nanoseconds."""
+
+    # number of deliveries a worker makes before letting other subscriptions run
+    SLICE = 64
+
+    def __init__(self, dispatcher, callback, policy=EVERY, queueSize=1024, batchSize=64, batchMillis=None, name=None):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s" % ", ".join(POLICIES))
+        if policy == BATCH:
+            import numpy  # loaded now, not by the worker delivering the first batch, which it would delay
+        self.dispatcher = dispatcher
+        self.callback = callback
+        self.policy = policy
+        self.name = name if name is not None else getattr(callback, '__name__', repr(callback))
+        self.queueSize = queueSize
+        self.batchSize = batchSize
+        self.batchNs = None if batchMillis is None else int(batchMillis * 1e6)
+        self.active = True
+        self.scheduled = False
+        self.lock = threading.Lock()
+        self.pending = deque()  # (timestamp, value, published) or, for batches, (timestamps, values, published)
+        self.latest = None
+        self.batchTimes = []
+        self.batchValues = []
+        self.batchStart = 0
+        self.delivered = self.dropped = self.coalesced = self.errors = 0
+        self.calls = self.latencyTotal = self.latencyMax = self.runTotal = self.runMax = 0
+
+    def __len__(self):
+        "values waiting to be delivered"
+        return len(self.pending) + (self.latest is not None) + len(self.batchTimes)
+
+    def publish(self, timestamp, value):
+        "delivers value, taken at timestamp, to the callback according to the policy"
+        if self.policy == SYNC:
+            self.__call(self.callback, (value,), monotonic_ns(), 1)
+            return
+        now = monotonic_ns()
+        with self.lock:
+            if self.policy == EVERY:
+                if len(self.pending) >= self.queueSize:
+                    self.pending.popleft()
+                    self.dropped += 1
+                self.pending.append((timestamp, value, now))
+            elif self.policy == LATEST:
+                if self.latest is not None:
+                    self.coalesced += 1
+                self.latest = (timestamp, value, now)
+            else:
+                if not self.batchTimes:
+                    self.batchStart = now
+                self.batchTimes.append(timestamp)
+                self.batchValues.append(value)
+                if len(self.batchTimes) < self.batchSize:
+                    return
+                self.__closeBatch()
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.dispatcher.schedule(self)
+
+    def flushDue(self, now):
+        "closes the open batch once batchMillis have passed since its first value, returns True if it did"
+        if self.batchNs is None or not self.batchTimes or now - self.batchStart < self.batchNs:
+            return False
+        with self.lock:
+            if not self.batchTimes:
+                return False
+            self.__closeBatch()
+            if self.scheduled:
+                return True
+            self.scheduled = True
+        self.dispatcher.schedule(self)
+        return True
+
+    def flush(self):
+        "closes the open batch whatever its size and age, i.e. before the dispatcher is closed"
+        with self.lock:
+            if not self.batchTimes:
+                return
+            self.__closeBatch()
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.dispatcher.schedule(self)
+
+    def __closeBatch(self):
+        if len(self.pending) >= self.queueSize:
+            dropped = self.pending.popleft()
+            self.dropped += len(dropped[0])
+        self.pending.append((self.batchTimes, self.batchValues, self.batchStart))
+        self.batchTimes = []
+        self.batchValues = []
+
+    def run(self):
+        "delivers the pending values, called from a dispatcher worker"
+        for _ in range(self.SLICE):
+            with self.lock:
+                if self.policy == LATEST:
+                    item, self.latest = self.latest, None
+                else:
+                    item = self.pending.popleft() if self.pending else None
+                if item is None or not self.active:
+                    self.scheduled = False
+                    return
+            timestamp, value, published = item
+            if self.policy == BATCH:
+                import numpy as np
+                values = np.array(value) if isinstance(value[0], (int, float)) else np.array(value, dtype=object)
+                self.__call(self.callback, (np.array(timestamp, dtype=np.int64), values), published, len(timestamp))
+            else:
+                self.__call(self.callback, (value,), published, 1)
+        # let other subscriptions run before delivering the rest
+        self.dispatcher.schedule(self)
+
+    def __call(self, callback, args, published, count):
+        start = monotonic_ns()
+        try:
+            callback(*args)
+        except Exception:
+            self.errors += 1
+            logger.exception("callback %s failed", self.name)
+        end = monotonic_ns()
+        latency = start - published
+        self.calls += 1
+        self.delivered += count
+        self.latencyTotal += latency
+        self.runTotal += end - start
+        if latency > self.latencyMax:
+            self.latencyMax = latency
+        if end - start > self.runMax:
+            self.runMax = end - start
+
+    def metrics(self):
+        "snapshot of the counters"
+        calls = max(self.calls, 1)
+        return {
+            'policy': self.policy,
+            'queueDepth': len(self),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'errors': self.errors,
+            'calls': self.calls,
+            'latencyMeanNs': self.latencyTotal // calls,
+            'latencyMaxNs': self.latencyMax,
+            'callbackMeanNs': self.runTotal // calls,
+            'callbackMaxNs': self.runMax,
+        }
+
+
+class CallbackDispatcher(object):
+    """Runs callbacks in a pool of worker threads so a slow consumer does not stall the serial reads.
+    i.e.
+        dispatcher=CallbackDispatcher(workers=2)
+        subscription=dispatcher.subscribe(callback_function, policy="latest")
+        subscription.publish(timestamp, value)  # from the parser thread
+    Values of one subscription are always delivered in order by one worker at a time.
+    The workers are started with the first subscription and stopped with close(), start() runs them again."""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.__ready = queue.Queue()
+        self.__subscriptions = []
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__running = False
+
+    def subscribe(self, callback, policy=EVERY, queueSize=1024, batchSize=64, batchMillis=None, name=None):
+        "returns a new Subscription of callback with the given policy (sync, every, latest or batch)"
+        subscription = Subscription(self, callback, policy, queueSize, batchSize, batchMillis, name)
+        with self.__lock:
+            self.__subscriptions.append(subscription)
+        if policy != SYNC:
+            self.start()
+        return subscription
+
+    def start(self):
+        "starts the workers, if they are not running"
+        with self.__lock:
+            if self.__running:
+                return
+            self.__running = True
+            self.__threads = [threading.Thread(target=self.__work, daemon=True) for _ in range(self.workers)]
+            for thread in self.__threads:
+                thread.start()
+
+    def unsubscribe(self, subscription):
+        "stops delivering to a subscription, the values still queued are discarded"
+        subscription.active = False
+        with self.__lock:
+            if subscription in self.__subscriptions:
+                self.__subscriptions.remove(subscription)
+
+    def schedule(self, subscription):
+        "queues a subscription with pending values for the workers"
+        self.__ready.put(subscription)
+
+    def __work(self):
+        ready = self.__ready
+        while True:
+            batches = [subscription for subscription in self.__subscriptions if subscription.batchNs is not None]
+            # wake up often enough to honour batchMillis when there are timed batches
+            timeout = min(subscription.batchNs for subscription in batches) / 2e9 if batches else 0.5
+            try:
+                subscription = ready.get(timeout=timeout)
+            except queue.Empty:
+                subscription = None
+            if subscription is CLOSE:
+                self.__drain(ready)
+                return
+            if batches:
+                now = monotonic_ns()
+                for batch in batches:
+                    batch.flushDue(now)
+            if subscription is not None:
+                subscription.run()
+
+    def __drain(self, ready):
+        "delivers what is still queued after close() and returns once the queue is empty"
+        while True:
+            try:
+                subscription = ready.get_nowait()
+            except queue.Empty:
+                return
+            if subscription is CLOSE:  # of another worker, which delivers what was queued after it
+                ready.put(CLOSE)
+                return
+            subscription.run()
+
+    def queueDepth(self):
+        "values waiting in all the subscriptions"
+        return sum(len(subscription) for subscription in self.__subscriptions)
+
+    def metrics(self):
+        "returns a dict with the total queue depth, drops and deliveries and the counters of every subscription"
+        subscriptions = {}
+        for subscription in list(self.__subscriptions):
+            name = subscription.name
+            while name in subscriptions:
+                name += "'"
+            subscriptions[name] = subscription.metrics()
+        return {
+            'queueDepth': sum(metrics['queueDepth'] for metrics in subscriptions.values()),
+            'dropped': sum(metrics['dropped'] for metrics in subscriptions.values()),
+            'delivered': sum(metrics['delivered'] for metrics in subscriptions.values()),
+            'subscriptions': subscriptions,
+        }
+
+    def close(self):
+        "closes the open batches, waits for the workers to deliver the values queued and stops them"
+        with self.__lock:
+            if not self.__running:
+                return
+            self.__running = False
+            threads, self.__threads = self.__threads, []
+        for subscription in list(self.__subscriptions):
+            subscription.flush()
+        for _ in threads:
+            self.__ready.put(CLOSE)
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join()
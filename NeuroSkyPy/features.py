@@ -0,0 +1,175 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .dispatch import BATCH
+from .parser import BAND_NAMES
+
+# frequency ranges in Hz of the bands of ASIC_EEG_POWER, as NeuroSky documents them
+BAND_EDGES = (
+    ('delta', 0.5, 2.75),
+    ('theta', 3.5, 6.75),
+    ('lowAlpha', 7.5, 9.25),
+    ('highAlpha', 10.0, 11.75),
+    ('lowBeta', 13.0, 16.75),
+    ('highBeta', 18.0, 29.75),
+    ('lowGamma', 31.0, 39.75),
+    ('midGamma', 41.0, 49.75),
+)
+assert tuple(name for name, low, high in BAND_EDGES) == BAND_NAMES
+
+
+class BandPowerEngine(object):
+    """Band powers of the raw signal computed incrementally with Welch's method, i.e. every hop samples the
+    power spectral density of the last `window` samples is estimated as the mean of the periodograms of its
+    Hann windowed segments of `segment` samples, `step` samples apart, and summed over every band of bands.
+    The mean of every segment is removed before the window is applied, as scipy.signal.welch does by default
+    (detrend='constant'), so the offset of the raw signal does not leak into the lowest bins.
+        engine=BandPowerEngine(rate=512, window=512, hop=128)
+        times, powers = engine.push(timestamps, values)  # powers: one row per window, one column per band
+    Consecutive windows share their segments, every segment is transformed once, in batches of one rfft call,
+    and the band sums are one product with a precomputed matrix. Nothing is allocated per sample: the samples
+    wait in a preallocated buffer until they complete a segment.
+    attach(headset) computes them from the raw values of a NeuroSkyPy object, callback(times, powers) gets them."""
+
+    def __init__(self, rate=512, window=512, hop=128, segment=256, step=None, bands=BAND_EDGES, spectrum=False,
+                 callback=None, capacity=4096):
+        step = segment // 2 if step is None else step
+        if segment > window or (window - segment) % step or hop % step:
+            raise ValueError("window - segment and hop must be multiples of step, and segment <= window")
+        self.rate = rate
+        self.window = window
+        self.hop = hop
+        self.segment = segment
+        self.step = step
+        self.spectrum = spectrum
+        self.callback = callback
+        self.bands = tuple(name for name, low, high in bands)
+        self.segmentsPerWindow = (window - segment) // step + 1
+        self.segmentsPerHop = hop // step
+        self.frequencies = np.fft.rfftfreq(segment, 1.0 / rate)
+
+        # one sided power spectral density: |rfft|^2 * 2 / (rate * sum(hann^2)), DC and Nyquist not doubled.
+        # The periodic Hann window, as in spectral analysis (scipy.signal.welch)
+        self.taper = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(segment) / segment)
+        scale = np.full(len(self.frequencies), 2.0 / (rate * np.sum(self.taper ** 2)))
+        scale[0] /= 2
+        if segment % 2 == 0:
+            scale[-1] /= 2
+        self.scale = scale
+        # band power = sum of the density of the band bins times the bin width
+        resolution = float(rate) / segment
+        self.matrix = np.zeros((len(self.frequencies), len(self.bands)))
+        for column, (name, low, high) in enumerate(bands):
+            inside = (self.frequencies >= low) & (self.frequencies <= high)
+            self.matrix[inside, column] = resolution
+
+        self.capacity = max(capacity, window + step)
+        self.__samples = np.zeros(self.capacity)
+        self.__times = np.zeros(self.capacity, dtype=np.int64)
+        self.__filled = 0  # samples in the buffer, the first one starts the next segment
+        # rows (band powers or spectra) of the segments still needed by the next windows
+        width = len(self.frequencies) if spectrum else len(self.bands)
+        self.__rows = np.zeros((self.segmentsPerWindow, width))
+        self.__rowTimes = np.zeros(self.segmentsPerWindow, dtype=np.int64)
+        self.__stored = 0
+        self.__firstRow = 0  # segment number of the first row stored
+        self.__nextWindow = 0
+        self.windows = 0
+        self.latest = None  # band powers of the last window
+        self.subscription = None
+        self.headset = None
+
+    def reset(self):
+        "forgets the samples received, i.e. after a gap in the signal"
+        self.__filled = 0
+        self.__stored = 0
+        self.__firstRow = 0
+        self.__nextWindow = 0
+
+    def attach(self, headset, batchSize=None):
+        "computes the band powers of the raw values of a NeuroSkyPy object, delivered in batches by its dispatcher"
+        self.detach()
+        self.headset = headset
+        self.subscription = headset.subscribe("rawValue", self.push, policy=BATCH, batchSize=batchSize or self.hop)
+
+    def detach(self):
+        "stops following the raw values of the NeuroSkyPy object attached, the samples received are kept"
+        if self.subscription is not None:
+            self.headset.unsubscribe(self.subscription)
+            self.subscription = self.headset = None
+
+    def push(self, timestamps, values):
+        """adds raw samples and returns (times, powers) of the windows they complete: the timestamps of the
+           last sample of every window and an array of one row of band powers per window.
+           With spectrum (times, powers, psd) is returned, psd has one row of density per window"""
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        results = []
+        pos = 0
+        while pos < len(values):
+            size = min(len(values) - pos, self.capacity - self.__filled)
+            self.__samples[self.__filled:self.__filled + size] = values[pos:pos + size]
+            self.__times[self.__filled:self.__filled + size] = timestamps[pos:pos + size]
+            self.__filled += size
+            pos += size
+            produced = self.__process()
+            if produced is not None:
+                results.append(produced)
+        if not results:
+            width = len(self.frequencies)
+            empty = (np.zeros(0, dtype=np.int64), np.zeros((0, len(self.bands))))
+            return empty + (np.zeros((0, width)),) if self.spectrum else empty
+        if len(results) == 1:
+            return results[0]
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+
+    def __process(self):
+        "transforms the complete segments of the buffer and averages them into windows"
+        filled = self.__filled
+        if filled < self.segment:
+            return None
+        count = (filled - self.segment) // self.step + 1
+        segments = sliding_window_view(self.__samples[:filled], self.segment)[::self.step][:count]
+        transformed = np.fft.rfft((segments - segments.mean(axis=1)[:, None]) * self.taper, axis=1)
+        density = (transformed.real ** 2 + transformed.imag ** 2) * self.scale
+        rows = density if self.spectrum else density @ self.matrix
+        rowTimes = self.__times[np.arange(count) * self.step + self.segment - 1]
+        # the samples before the next segment are not needed any more
+        consumed = count * self.step
+        self.__samples[:filled - consumed] = self.__samples[consumed:filled]
+        self.__times[:filled - consumed] = self.__times[consumed:filled]
+        self.__filled = filled - consumed
+        return self.__windows(rows, rowTimes)
+
+    def __windows(self, rows, rowTimes):
+        "windows completed by new segment rows, window k is the mean of the rows k*segmentsPerHop onwards"
+        stored = self.__stored
+        if stored:
+            rows = np.concatenate((self.__rows[:stored], rows))
+            rowTimes = np.concatenate((self.__rowTimes[:stored], rowTimes))
+        first = self.__firstRow  # segment number of rows[0]
+        total = first + len(rows)
+        perHop, perWindow = self.segmentsPerHop, self.segmentsPerWindow
+        # segment numbers of the last segment of every window completed
+        ends = np.arange(self.__nextWindow * perHop + perWindow - 1, total, perHop)
+        result = None
+        if len(ends):
+            ends -= first
+            cumulative = np.zeros((len(rows) + 1, rows.shape[1]))
+            np.cumsum(rows, axis=0, out=cumulative[1:])
+            means = (cumulative[ends + 1] - cumulative[ends + 1 - perWindow]) / perWindow
+            times = rowTimes[ends]
+            powers = means @ self.matrix if self.spectrum else means
+            self.__nextWindow += len(ends)
+            self.windows += len(ends)
+            self.latest = powers[-1]
+            result = (times, powers, means) if self.spectrum else (times, powers)
+            if self.callback is not None:
+                self.callback(times, powers)
+        # keep the rows from the first segment of the next window on, fewer than perWindow
+        keep = max(0, total - max(first, self.__nextWindow * perHop))
+        self.__rows[:keep] = rows[len(rows) - keep:]
+        self.__rowTimes[:keep] = rowTimes[len(rows) - keep:]
+        self.__stored = keep
+        self.__firstRow = total - keep
+        return result
@@ -0,0 +1,240 @@
+import collections
+import logging
+import os
+import selectors
+import threading
+import time
+from time import monotonic_ns
+
+import serial
+
+from .NeuroSkyPy import NeuroSkyPy
+from .dispatch import CallbackDispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class _Device(object):
+    "state of a headset registered in a hub"
+    __slots__ = ('name', 'headset', 'source', 'fd', 'ownsSource', 'connected', 'packets', 'bytes', 'reads',
+                 'startTime', 'disconnects', 'reconnects', 'errors', 'lastError', 'retryAt', 'delay')
+
+    def __init__(self, name, headset, source, ownsSource):
+        self.name = name
+        self.headset = headset
+        self.source = source
+        self.fd = source.fileno()
+        self.ownsSource = ownsSource
+        self.connected = True
+        self.packets = self.bytes = self.reads = 0
+        self.startTime = monotonic_ns()
+        self.disconnects = self.reconnects = 0
+        self.errors = 0  # exceptions raised while decoding or publishing the data read
+        self.lastError = None
+        self.retryAt = 0  # monotonic_ns() of the next attempt to open the port again
+        self.delay = 0.0
+
+
+class NeuroSkyHub(object):
+    """Reads many headsets from a single thread, waiting on all their ports at once with selectors (epoll on Linux).
+    Initialising: hub=NeuroSkyHub()
+    Every headset is registered with a name and gets its own NeuroSkyPy object, with isolated values,
+    buffers and callbacks:
+        headset1=hub.register("lab1","/dev/ttyUSB0",57600)
+        headset1.setCallBack("attention",callback_function)
+    hub.start() reads them in a separate thread and hub.stop() ends it, poll() can be called instead from
+    an existing loop. The packets of all the headsets are merged, in order of arrival, in a bounded stream:
+        for timestamp, name, sample in hub.read(): ...
+    The ports must be selectable (POSIX), any object with fileno() can be registered instead of a port name.
+    The ports opened by the hub are opened again after a failure, reconnectDelay seconds later and then doubling
+    the wait up to maxReconnectDelay, the objects registered are left disconnected."""
+    reconnectDelay = 0.5
+    maxReconnectDelay = 30.0
+
+    def __init__(self, streamSize=65536, readSize=65536, dispatcher=None):
+        self.readSize = readSize
+        # the callbacks of all the headsets share the workers of one dispatcher
+        self.__ownsDispatcher = dispatcher is None  # closed by close()
+        self.dispatcher = dispatcher if dispatcher is not None else CallbackDispatcher()
+        self.__selector = selectors.DefaultSelector()
+        self.__devices = collections.OrderedDict()
+        self.__stream = collections.deque(maxlen=streamSize)  # oldest packets are dropped when it is full
+        self.__thread = None
+        self.__lock = threading.Lock()  # guards the registrations against a running poll
+        self.running = False
+
+    def __len__(self):
+        return len(self.__devices)
+
+    def __getitem__(self, name):
+        return self.__devices[name].headset
+
+    def register(self, name, port, baudRate=57600, bufferSeconds=600):
+        "adds a headset read from port (name of a serial port or object with fileno()), returns its NeuroSkyPy"
+        if name in self.__devices:
+            raise ValueError("a headset named %r is already registered" % name)
+        ownsSource = isinstance(port, str)
+        source = serial.Serial(port, baudRate, timeout=0) if ownsSource else port
+        headset = NeuroSkyPy(port if ownsSource else name, baudRate, bufferSeconds, self.dispatcher)
+        device = _Device(name, headset, source, ownsSource)
+        with self.__lock:
+            self.__devices[name] = device
+            self.__selector.register(device.fd, selectors.EVENT_READ, device)
+        return headset
+
+    def unregister(self, name):
+        "removes a headset, closing its port if the hub opened it"
+        with self.__lock:
+            device = self.__devices.pop(name)
+            if device.connected:
+                self.__selector.unregister(device.fd)
+        if device.ownsSource:
+            device.source.close()
+
+    def __disconnect(self, device, error):
+        "stops waiting on a failed port, the hub opens its own ports again later"
+        self.__selector.unregister(device.fd)
+        device.connected = False
+        device.disconnects += 1
+        device.lastError = error
+        logger.warning("%s: disconnected, %s", device.name, error)
+        if device.ownsSource:
+            try:
+                device.source.close()
+            except Exception:
+                pass
+            device.delay = self.reconnectDelay
+            device.retryAt = monotonic_ns() + int(device.delay * 1e9)
+
+    def __reconnect(self, now):
+        "tries to open again the ports of the hub whose wait is over, returns seconds to the next attempt or None"
+        following = None
+        for device in self.__devices.values():
+            if device.connected or not device.ownsSource:
+                continue
+            if device.retryAt <= now:
+                source = device.source
+                try:
+                    source.open()
+                    device.fd = source.fileno()
+                except (OSError, ValueError) as error:
+                    device.lastError = error
+                    device.delay = min(device.delay * 2, self.maxReconnectDelay)
+                    device.retryAt = now + int(device.delay * 1e9)
+                    logger.debug("%s: reconnection failed, %s", device.name, error)
+                else:
+                    self.__selector.register(device.fd, selectors.EVENT_READ, device)
+                    device.connected = True
+                    device.reconnects += 1
+                    # drops the partial packet read before the failure and starts a new clock segment
+                    device.headset._sourceReopened(source)
+                    continue
+            wait = (device.retryAt - now) / 1e9
+            following = wait if following is None else min(following, wait)
+        return following
+
+    def poll(self, timeout=None):
+        "waits up to timeout seconds for data from any headset, parses what arrived and returns the number of packets"
+        packets = 0
+        stream = self.__stream
+        with self.__lock:
+            following = self.__reconnect(monotonic_ns())
+            if following is not None and (timeout is None or following < timeout):
+                timeout = max(following, 0)  # wake up for the next reconnection
+            if not self.__selector.get_map():  # nothing to wait on, select() may refuse it
+                time.sleep(timeout or 0)
+                return 0
+            for key, events in self.__selector.select(timeout):
+                device = key.data
+                try:
+                    data = os.read(device.fd, self.readSize)
+                except BlockingIOError:
+                    continue
+                except OSError as error:  # i.e. EIO when a USB dongle is unplugged
+                    self.__disconnect(device, error)
+                    continue
+                if not data:  # readable without data: the port was closed or the device unplugged
+                    self.__disconnect(device, "end of file")
+                    continue
+                timestamp = monotonic_ns()
+                device.reads += 1
+                device.bytes += len(data)
+                try:
+                    samples = device.headset.feed(data, timestamp)
+                except Exception as error:
+                    # a failing callback, recorder... of one headset must not stop the reading of the others
+                    device.errors += 1
+                    device.lastError = error
+                    logger.exception("%s: error handling the data read", device.name)
+                    continue
+                device.packets += len(samples)
+                packets += len(samples)
+                name = device.name
+                for sample in samples:
+                    stream.append((timestamp, name, sample))
+        return packets
+
+    def headsets(self):
+        "returns a dict of name -> NeuroSkyPy of the headsets registered"
+        return collections.OrderedDict((name, device.headset) for name, device in list(self.__devices.items()))
+
+    def connected(self):
+        "returns the names of the headsets whose port is still open"
+        return [name for name, device in self.__devices.items() if device.connected]
+
+    def read(self):
+        "returns and removes the (timestamp, name, Sample) tuples of the merged stream"
+        stream = self.__stream
+        return [stream.popleft() for _ in range(len(stream))]
+
+    def start(self):
+        "starts reading all the headsets in a separate thread"
+        self.running = True
+        for device in self.__devices.values():
+            device.packets = device.bytes = device.reads = 0
+            device.startTime = monotonic_ns()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        while self.running:
+            # the timeout lets the thread check running when no headset sends anything
+            self.poll(0.5)
+
+    def stop(self):
+        "stops the thread and waits for it"
+        self.running = False
+        if self.__thread is not None and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+
+    def close(self):
+        "stops reading, unregisters every headset and closes the dispatcher if the hub created it"
+        self.stop()
+        for name in list(self.__devices):
+            self.unregister(name)
+        self.__selector.close()
+        if self.__ownsDispatcher:
+            self.dispatcher.close()
+
+    def stats(self):
+        """returns a dict of name -> counters of packets, bytes and reads, their rates since start, connection state
+           and the corruption counters of the headset's parser"""
+        now = monotonic_ns()
+        stats = {}
+        for name, device in self.__devices.items():
+            seconds = max(now - device.startTime, 1) / 1e9
+            # the counters of the parser first, the connection is the hub's and not of the headset's thread
+            stats[name] = device.headset.getStats()
+            stats[name].update({
+                'packets': device.packets,
+                'bytes': device.bytes,
+                'reads': device.reads,
+                'connected': device.connected,
+                'disconnects': device.disconnects,
+                'reconnects': device.reconnects,
+                'errors': device.errors,
+                'packetsPerSecond': device.packets / seconds,
+                'bytesPerSecond': device.bytes / seconds,
+            })
+        return stats
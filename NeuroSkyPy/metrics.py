@@ -0,0 +1,224 @@
+"""Counters of the reader of a headset and their export in the Prometheus text format.
+
+NeuroSkyPy.getMetrics() returns a snapshot dict, MetricsServer serves the snapshots of one or more headsets at
+http://host:port/metrics for Prometheus or any scraper of its text format.
+"""
+import math
+import threading
+from time import monotonic_ns
+
+from .parser import CODES
+
+# upper edges in bytes of the buckets of the read sizes, the last bucket holds the larger reads
+READ_SIZE_EDGES = tuple(2 ** i for i in range(13))
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class ReaderMetrics(object):
+    """Timing of the reads parsed by a NeuroSkyPy object, measured on one read in every `interval`.
+    i.e. headset.getMetrics()['parseNsPerPacket']
+    Timing every read would cost more than the parsing of a small one, so a countdown picks the reads measured:
+    their sizes (histogram over READ_SIZE_EDGES), the packets they completed and the time spent decoding them
+    (parseNs) and storing/publishing them (publishNs). The other counters are exact and kept elsewhere: reads
+    from the countdown, bytes and packets by the parser, values received by the buffers, inWaitingMax (most
+    bytes found waiting in the port) by the reader thread."""
+
+    def __init__(self, interval=64):
+        self.interval = interval
+        self.countdown = interval  # reads left until the next one measured
+        self.started = monotonic_ns()
+        self.measured = 0  # reads measured
+        self.readSizes = [0] * (len(READ_SIZE_EDGES) + 1)
+        self.bytes = self.packets = 0  # of the reads measured
+        self.parseNs = self.publishNs = 0
+        self.inWaitingMax = 0
+
+    @property
+    def reads(self):
+        return self.measured * self.interval + self.interval - self.countdown
+
+    def record(self, size, packets, start, parsed, end):
+        "accounts a measured read of size bytes that completed packets, parsed until parsed and published until end"
+        self.countdown = self.interval
+        self.measured += 1
+        self.readSizes[min((size - 1).bit_length() if size > 1 else 0, len(READ_SIZE_EDGES))] += 1
+        self.bytes += size
+        self.packets += packets
+        self.parseNs += parsed - start
+        self.publishNs += end - parsed
+
+    def snapshot(self, now=None):
+        "returns a dict with the counters and the means of the reads measured"
+        now = monotonic_ns() if now is None else now
+        reads = self.reads
+        packets = max(self.packets, 1)
+        return {
+            'uptimeSeconds': (now - self.started) / 1e9,
+            'reads': reads,
+            'readsMeasured': self.measured,
+            'readSizes': dict(zip(READ_SIZE_EDGES + (math.inf,), self.readSizes)),
+            'readSizeMean': self.bytes / max(self.measured, 1),
+            'parseNsPerPacket': self.parseNs / packets,
+            'publishNsPerPacket': self.publishNs / packets,
+            'inWaitingMax': self.inWaitingMax,
+        }
+
+
+def code_counts(buffers):
+    '''
+    Packets received of every data row code, from the values appended to the buffers of a headset
+    :param buffers: dict of variable name -> RingBuffer
+    :return: dict of code -> count
+    '''
+    return dict((code, buffers[fields[0]].count) for code, (length, decoder, fields, dtype) in CODES.items())
+
+
+def _labels(**labels):
+    return "{%s}" % ",".join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels.items())
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+# counters and gauges exported from a snapshot: name, type, help and key of the snapshot
+_SERIES = (
+    ('neuroskypy_reads_total', 'counter', "Reads of the port parsed", 'reads'),
+    ('neuroskypy_bytes_read_total', 'counter', "Bytes read from the port", 'bytes'),
+    ('neuroskypy_packets_decoded_total', 'counter', "Valid packets decoded", 'packets'),
+    ('neuroskypy_parse_seconds_per_packet', 'gauge', "Mean time decoding a packet", 'parseNsPerPacket'),
+    ('neuroskypy_publish_seconds_per_packet', 'gauge', "Mean time storing and publishing a packet",
+     'publishNsPerPacket'),
+    ('neuroskypy_in_waiting_max_bytes', 'gauge', "Most bytes found waiting in the port", 'inWaitingMax'),
+    ('neuroskypy_seconds_since_last_packet', 'gauge', "Time since the last valid packet", 'secondsSinceLastPacket'),
+    ('neuroskypy_checksum_errors_total', 'counter', "Packets with a bad checksum", 'checksumErrors'),
+    ('neuroskypy_invalid_lengths_total', 'counter', "Length bytes over the protocol maximum", 'invalidLengths'),
+    ('neuroskypy_sync_losses_total', 'counter', "Times the stream lost the packet boundaries", 'syncLosses'),
+    ('neuroskypy_bytes_discarded_total', 'counter', "Bytes outside valid packets", 'bytesDiscarded'),
+    ('neuroskypy_disconnects_total', 'counter', "Failures of the port", 'disconnects'),
+    ('neuroskypy_reconnects_total', 'counter', "Times the port was opened again", 'reconnects'),
+    ('neuroskypy_errors_total', 'counter', "Exceptions handling the data read", 'errors'),
+    ('neuroskypy_connected', 'gauge', "1 while the reader has an open port", 'connected'),
+)
+
+# series of every callback: name, type, help and key of the subscription metrics
+_CALLBACK_SERIES = (
+    ('neuroskypy_callback_queue_depth', 'gauge', "Values waiting for the callback", 'queueDepth'),
+    ('neuroskypy_callback_delivered_total', 'counter', "Values delivered to the callback", 'delivered'),
+    ('neuroskypy_callback_dropped_total', 'counter', "Values dropped because the queue was full", 'dropped'),
+    ('neuroskypy_callback_calls_total', 'counter', "Calls of the callback", 'calls'),
+    ('neuroskypy_callback_mean_seconds', 'gauge', "Mean execution time of the callback", 'callbackMeanNs'),
+    ('neuroskypy_callback_max_seconds', 'gauge', "Longest execution time of the callback", 'callbackMaxNs'),
+)
+
+
+def prometheus_text(snapshots):
+    '''
+    Formats the metrics of several headsets in the Prometheus text exposition format
+    :param snapshots: dict of headset name -> NeuroSkyPy.getMetrics()
+    :return: str
+    '''
+    lines = []
+
+    def header(name, kind, text):
+        lines.append("# HELP %s %s" % (name, text))
+        lines.append("# TYPE %s %s" % (name, kind))
+
+    header('neuroskypy_packets_total', 'counter', "Packets received with each data row code")
+    for headset, snapshot in snapshots.items():
+        for code, count in snapshot['codes'].items():
+            lines.append("neuroskypy_packets_total%s %d" % (_labels(headset=headset, code="0x%02x" % code), count))
+
+    header('neuroskypy_read_size_bytes', 'histogram', "Bytes returned by the reads of the port measured")
+    for headset, snapshot in snapshots.items():
+        total = 0
+        for edge, count in snapshot['readSizes'].items():
+            total += count
+            lines.append("neuroskypy_read_size_bytes_bucket%s %d" % (_labels(headset=headset, le=_number(edge)), total))
+        lines.append("neuroskypy_read_size_bytes_sum%s %s" % (_labels(headset=headset),
+                                                                 _number(snapshot['readSizeMean'] * total)))
+        lines.append("neuroskypy_read_size_bytes_count%s %d" % (_labels(headset=headset), total))
+
+    for name, kind, text, key in _SERIES:
+        header(name, kind, text)
+        for headset, snapshot in snapshots.items():
+            value = snapshot[key]
+            if name.endswith('_seconds_per_packet'):
+                value = value / 1e9
+            lines.append("%s%s %s" % (name, _labels(headset=headset), _number(value)))
+
+    for name, kind, text, key in _CALLBACK_SERIES:
+        header(name, kind, text)
+        for headset, snapshot in snapshots.items():
+            for variable, metrics in snapshot['callbacks'].items():
+                value = metrics[key]
+                if name.endswith('_seconds'):
+                    value = value / 1e9
+                lines.append("%s%s %s" % (name, _labels(headset=headset, variable=variable), _number(value)))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    """Serves the metrics of headsets over HTTP for Prometheus, in a daemon thread.
+    i.e.
+        server=MetricsServer(headset, port=9108)  # or {"lab1": headset1, ...} or a NeuroSkyHub
+        ...  # curl http://127.0.0.1:9108/metrics
+        server.close()
+    The snapshots are taken when the page is requested, nothing runs in between. It listens on localhost by
+    default, port=0 picks a free port, see server.port."""
+
+    def __init__(self, headsets, host='127.0.0.1', port=9108):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.headsets = headsets
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = server.text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__http = ThreadingHTTPServer((host, port), Handler)
+        self.__http.daemon_threads = True
+        self.host, self.port = self.__http.server_address[:2]
+        self.__thread = threading.Thread(target=self.__http.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def snapshots(self):
+        "returns a dict of headset name -> getMetrics() of the headsets served"
+        headsets = self.headsets
+        if hasattr(headsets, 'getMetrics'):
+            headsets = {headsets.port: headsets}
+        elif hasattr(headsets, 'headsets'):  # a NeuroSkyHub, whose headsets come and go
+            headsets = headsets.headsets()
+        return dict((str(name), headset.getMetrics()) for name, headset in list(headsets.items()))
+
+    def text(self):
+        "the page served at /metrics"
+        return prometheus_text(self.snapshots())
+
+    def close(self):
+        "stops serving and releases the port"
+        self.__http.shutdown()
+        self.__http.server_close()
+        self.__thread.join()
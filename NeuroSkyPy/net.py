@@ -0,0 +1,556 @@
+"""Streaming of the packets decoded from headsets to remote consumers, over TCP or WebSocket.
+
+StreamServer publishes the packets of one or more NeuroSkyPy objects from an asyncio server, on one port for
+both protocols: TCP clients start with the 4 bytes PREAMBLE, browsers open a WebSocket (GET with Upgrade).
+Every message is a frame, one WebSocket binary message each, little-endian:
+    [TYPE u8] [HEADSET u8] [COUNT u16] [LENGTH u32] [BODY ... LENGTH bytes]
+    HELLO      body JSON {"version", "headsets": [names, HEADSET is their index], "channels": {name: dtype},
+               "rate", "frameSamples"}, sent by the server on connection
+    RAW        COUNT raw samples of a headset: [t0 i64 ns] [COUNT x i32, ns since t0] [COUNT x i16 values]
+    VALUES     the other variables of a packet, COUNT is the mask of the ones present (bit i for FIELDS[i]):
+               [timestamp i64 ns] [the values present, in FIELDS order, with the dtype of each]
+    SUBSCRIBE  body JSON {"headsets": [names], "channels": [names], "decimate": n}, from the client, null or
+               missing keys for all of them (the default of every client), WebSocket clients can send the JSON
+               as a text message
+The raw samples are batched in frames of frameSamples, or of the samples of maxLatency seconds when they come
+slower, i.e. decimated. Decimation averages blocks of n samples, so a client asking decimate=8 gets 64 Hz. Every
+frame is encoded once, in the parser thread, and written to all the clients that want it. The frames for a
+client whose socket buffers more than maxBuffer bytes are dropped and counted, a slow client never stalls the
+headsets or the other clients.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import sys
+import threading
+from array import array
+
+from .dispatch import SYNC
+from .parser import FIELD_DTYPES, FIELDS, Sample
+
+PROTOCOL_VERSION = 1
+PREAMBLE = b'NSPY'
+FRAME = struct.Struct('<BBHI')  # type, headset, count, body length
+HELLO, RAW, VALUES, SUBSCRIBE = 0, 1, 2, 16
+RAW_NAME = 'rawValue'
+RAW_RATE = 512
+
+_TIME = struct.Struct('<q')
+_MAX_DELTA = 2 ** 31 - 1  # largest ns offset of a sample from the first one of its frame
+_STRUCT_CODES = {'u1': 'B', 'i1': 'b', 'u2': 'H', 'i2': 'h', 'u4': 'I', 'i4': 'i', 'f4': 'f', 'f8': 'd'}
+_FORMATS = dict((name, _STRUCT_CODES[dtype]) for name, dtype in FIELD_DTYPES.items())
+_BITS = dict((name, 1 << i) for i, name in enumerate(FIELDS))
+_SWAP = sys.byteorder != 'little'
+_WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+logger = logging.getLogger(__name__)
+
+
+def encode_frame(kind, headset, count, body):
+    '''
+    Frame of the protocol
+    :param kind: HELLO, RAW, VALUES or SUBSCRIBE
+    :param headset: index of the headset in the HELLO list
+    :param count: samples of a RAW frame, mask of a VALUES frame
+    :param body: bytes
+    :return: bytes
+    '''
+    return FRAME.pack(kind, headset, count, len(body)) + body
+
+
+def _little(values):
+    "bytes of an array, little-endian"
+    if _SWAP:
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_raw(headset, times, values):
+    '''
+    RAW frame of raw samples
+    :param headset: index of the headset
+    :param times: array('q') of timestamps in ns, less than 2.1 s after the first
+    :param values: array('h') of values
+    :return: bytes
+    '''
+    t0 = times[0]
+    deltas = array('i', [t - t0 for t in times])
+    return encode_frame(RAW, headset, len(values), _TIME.pack(t0) + _little(deltas) + _little(values))
+
+
+def encode_values(headset, timestamp, fields):
+    '''
+    VALUES frame with the variables of a packet other than the raw value
+    :param headset: index of the headset
+    :param timestamp: arrival of the packet in ns
+    :param fields: list of (name, value) in FIELDS order
+    :return: bytes
+    '''
+    mask = 0
+    for name, value in fields:
+        mask |= _BITS[name]
+    body = struct.pack('<q' + ''.join(_FORMATS[name] for name, value in fields), timestamp,
+                       *[value for name, value in fields])
+    return encode_frame(VALUES, headset, mask, body)
+
+
+def decode_frame(kind, headset, count, body):
+    '''
+    Decodes the body of a RAW or VALUES frame, numpy is imported for the RAW ones
+    :return: (times int64 array, values int16 array) for RAW, a Sample for VALUES
+    '''
+    if kind == RAW:
+        import numpy as np
+        t0 = _TIME.unpack_from(body)[0]
+        times = np.frombuffer(body, '<i4', count, _TIME.size).astype(np.int64) + t0
+        values = np.frombuffer(body, '<i2', count, _TIME.size + 4 * count).astype(np.int16)
+        return times, values
+    if kind == VALUES:
+        names = [name for name in FIELDS if count & _BITS[name]]
+        values = struct.unpack('<q' + ''.join(_FORMATS[name] for name in names), body)
+        sample = Sample(values[0])
+        for name, value in zip(names, values[1:]):
+            setattr(sample, name, value)
+            sample.names.append(name)
+        return sample
+    raise ValueError("frame type %d has no samples" % kind)
+
+
+async def read_frame(reader):
+    "reads the next frame of a TCP stream, returns (type, headset, count, body)"
+    kind, headset, count, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return kind, headset, count, await reader.readexactly(length)
+
+
+def _websocket_frame(payload, opcode=2):
+    "server frame of the WebSocket protocol, not masked"
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class _RawFrame(object):
+    """Raw samples of a headset for one decimation, batched in a frame, filled from the parser thread"""
+
+    def __init__(self, headset, decimate, size, maxLatency):
+        self.headset = headset
+        self.decimate = decimate
+        self.size = size
+        self.maxLatency = min(int(maxLatency * 1e9), _MAX_DELTA)
+        self.times = array('q')
+        self.values = array('h')
+        self.total = self.count = self.first = 0  # block being averaged
+
+    def push(self, timestamp, value):
+        "adds a raw sample, returns a frame to send or None"
+        if self.decimate > 1:
+            if not self.count:
+                self.first = timestamp
+            self.total += value
+            self.count += 1
+            if self.count < self.decimate:
+                return None
+            timestamp = (self.first + timestamp) // 2
+            value = int(round(self.total / float(self.count)))
+            self.total = self.count = 0
+        times = self.times
+        frame = None
+        if times and timestamp - times[0] > _MAX_DELTA:
+            frame = self.flush()  # a gap in the data, the sample starts the next frame
+        times.append(timestamp)
+        self.values.append(value)
+        if frame is None and (len(times) >= self.size or timestamp - times[0] >= self.maxLatency):
+            frame = self.flush()
+        return frame
+
+    def flush(self):
+        frame = encode_raw(self.headset, self.times, self.values)
+        self.times = array('q')
+        self.values = array('h')
+        return frame
+
+
+class _Feed(object):
+    """Packets of one headset: encodes the frames in the parser thread and hands them to the event loop"""
+
+    def __init__(self, server, index, name, headset):
+        self.server = server
+        self.index = index
+        self.name = name
+        self.headset = headset
+        self.decimations = ()  # decimations asked by the clients, replaced by the event loop
+        self.values = False  # some client wants the other variables
+        self.frames = {}  # decimation -> _RawFrame, only used by the parser thread
+        self.subscription = None
+
+    def publish(self, sample):
+        "the 'packet' callback of the headset"
+        decimations = self.decimations
+        raw = sample.rawValue
+        if raw is not None and decimations:
+            frames = self.frames
+            for decimate in decimations:
+                stream = frames.get(decimate)
+                if stream is None:
+                    stream = frames[decimate] = _RawFrame(self.index, decimate, self.server.frameSamples,
+                                                          self.server.maxLatency)
+                frame = stream.push(sample.timestamp, raw)
+                if frame is not None:
+                    self.server.loop.call_soon_threadsafe(self.server._broadcast, (self.index, decimate), frame)
+        if self.values and len(sample.names) > (raw is not None):
+            fields = [(name, getattr(sample, name)) for name in FIELDS if name != RAW_NAME and name in sample.names]
+            self.server.loop.call_soon_threadsafe(self.server._values, self.index, sample.timestamp, fields)
+
+
+class _Client(object):
+    """A connection and its subscription"""
+
+    def __init__(self, writer, websocket, maxBuffer):
+        self.writer = writer
+        self.websocket = websocket
+        self.maxBuffer = maxBuffer
+        self.peer = writer.get_extra_info('peername')
+        self.headsets = set()  # indexes of the headsets subscribed
+        self.channels = None  # names of the variables subscribed, None for all
+        self.decimate = 1
+        self.raw = set()  # (headset, decimate) of the raw frames it gets
+        self.frames = self.bytes = self.dropped = 0
+
+    def write(self, data):
+        transport = self.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.maxBuffer:
+            self.dropped += 1
+            return
+        transport.write(data)
+        self.frames += 1
+        self.bytes += len(data)
+
+    def send(self, frame):
+        self.write(_websocket_frame(frame) if self.websocket else frame)
+
+
+class StreamServer(object):
+    """Publishes the packets of headsets to TCP and WebSocket clients, see the frame format above.
+    i.e.
+        server=StreamServer(headset, port=9109)  # or {"lab1": headset1, ...} or a NeuroSkyHub
+        await server.start()  # in an event loop
+        ...
+        await server.stop()
+    or, from a program without event loop, server.startThread() ... server.close(). The headsets are the ones
+    given when it starts, for a NeuroSkyHub the ones registered then. It listens on localhost by default,
+    port=0 picks a free port, see server.port."""
+
+    def __init__(self, headsets, host='127.0.0.1', port=9109, frameSamples=64, maxLatency=0.25, maxBuffer=1 << 20):
+        self.headsets = headsets
+        self.host = host
+        self.port = port
+        self.frameSamples = frameSamples
+        self.maxLatency = maxLatency
+        self.maxBuffer = maxBuffer
+        self.loop = None
+        self.__server = None
+        self.__feeds = []
+        self.__clients = []
+        self.__closed = {'frames': 0, 'bytes': 0, 'dropped': 0}  # counters of the clients gone
+        self.__thread = None
+
+    def __named(self):
+        headsets = self.headsets
+        if hasattr(headsets, 'getMetrics'):
+            return [(str(headsets.port), headsets)]
+        if hasattr(headsets, 'headsets'):  # a NeuroSkyHub
+            headsets = headsets.headsets()
+        return [(str(name), headset) for name, headset in headsets.items()]
+
+    async def start(self):
+        "subscribes to the packets of the headsets and starts listening"
+        self.loop = asyncio.get_running_loop()
+        named = self.__named()
+        if len(named) > 255:
+            raise ValueError("at most 255 headsets per server")
+        self.__feeds = [_Feed(self, index, name, headset) for index, (name, headset) in enumerate(named)]
+        for feed in self.__feeds:
+            feed.subscription = feed.headset.subscribe("packet", feed.publish, policy=SYNC)
+        self.__server = await asyncio.start_server(self.__serve, self.host, self.port)
+        self.port = self.__server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        "stops listening and publishing and closes the connections"
+        for feed in self.__feeds:
+            if feed.subscription is not None:
+                feed.headset.unsubscribe(feed.subscription)
+                feed.subscription = None
+        if self.__server is not None:
+            self.__server.close()
+            for client in list(self.__clients):
+                client.writer.close()
+            await self.__server.wait_closed()
+            self.__server = None
+
+    async def serve_forever(self):
+        "starts and serves until cancelled"
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    def startThread(self):
+        "runs the server in an event loop of its own, in a daemon thread, returns once it listens"
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as error:
+                errors.append(error)
+                ready.set()
+                loop.close()
+                return
+            ready.set()
+            try:
+                loop.run_forever()
+            finally:
+                loop.close()
+
+        self.__thread = threading.Thread(target=run, name="StreamServer", daemon=True)
+        self.__thread.start()
+        ready.wait()
+        if errors:
+            self.__thread = None
+            raise errors[0]
+
+    def close(self):
+        "stops the server started with startThread()"
+        if self.__thread is None:
+            return
+        loop = self.loop
+        asyncio.run_coroutine_threadsafe(self.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        self.__thread.join()
+        self.__thread = None
+
+    def __enter__(self):
+        self.startThread()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def stats(self):
+        "returns a dict with the clients connected and the frames, bytes and frames dropped sent to all of them"
+        clients = list(self.__clients)
+        stats = {'clients': len(clients)}
+        for key in ('frames', 'bytes', 'dropped'):
+            stats[key] = self.__closed[key] + sum(getattr(client, key) for client in clients)
+        return stats
+
+    async def __serve(self, reader, writer):
+        client = None
+        try:
+            preamble = await reader.readexactly(len(PREAMBLE))
+            websocket = preamble == b'GET '
+            if websocket:
+                if not await self.__handshake(reader, writer):
+                    return
+            elif preamble != PREAMBLE:
+                return
+            client = _Client(writer, websocket, self.maxBuffer)
+            hello = {'version': PROTOCOL_VERSION, 'headsets': [feed.name for feed in self.__feeds],
+                     'channels': FIELD_DTYPES, 'rate': RAW_RATE, 'frameSamples': self.frameSamples}
+            client.send(encode_frame(HELLO, 0, 0, json.dumps(hello).encode('utf-8')))
+            self.__clients.append(client)
+            self.__subscribe(client, {})
+            while True:
+                if websocket:
+                    opcode, payload = await self.__readWebSocket(reader, client)
+                    if opcode is None:
+                        break
+                    if opcode == 1:  # text, the JSON of a subscription
+                        self.__subscribe(client, json.loads(payload.decode('utf-8')))
+                        continue
+                    kind, headset, count, length = FRAME.unpack_from(payload)
+                    body = payload[FRAME.size:FRAME.size + length]
+                else:
+                    kind, headset, count, body = await read_frame(reader)
+                if kind == SUBSCRIBE:
+                    self.__subscribe(client, json.loads(body.decode('utf-8')))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, struct.error) as error:
+            logger.debug("connection of %s ended: %s", client.peer if client else None, error)
+        finally:
+            if client is not None and client in self.__clients:
+                self.__clients.remove(client)
+                for key in self.__closed:
+                    self.__closed[key] += getattr(client, key)
+                self.__refresh()
+            writer.close()
+
+    async def __handshake(self, reader, writer):
+        "answers the upgrade request of a WebSocket, returns False when it is not one"
+        request = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+        headers = dict((name.strip().lower(), value.strip()) for name, _, value in
+                       (line.partition(':') for line in request.split('\r\n')[1:] if ':' in line))
+        key = headers.get('sec-websocket-key')
+        if key is None or 'websocket' not in headers.get('upgrade', '').lower():
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1(key.encode('ascii') + _WS_GUID).digest()).decode('ascii')
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: %s\r\n\r\n' % accept).encode('ascii'))
+        return True
+
+    async def __readWebSocket(self, reader, client):
+        "returns (opcode, payload) of the next data message, (None, None) when the client closes"
+        while True:
+            first, second = await reader.readexactly(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+            elif length == 127:
+                length = struct.unpack('!Q', await reader.readexactly(8))[0]
+            if length > 65536:
+                raise ValueError("message of %d bytes" % length)
+            mask = await reader.readexactly(4) if second & 0x80 else b'\0\0\0\0'
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(await reader.readexactly(length)))
+            if opcode == 8:
+                client.write(_websocket_frame(b'', 8))
+                return None, None
+            if opcode == 9:
+                client.write(_websocket_frame(payload, 10))
+            elif opcode in (1, 2):
+                return opcode, payload
+
+    def __subscribe(self, client, request):
+        "applies a subscription request of a client"
+        names = request.get('headsets')
+        client.headsets = set(feed.index for feed in self.__feeds if names is None or feed.name in names)
+        channels = request.get('channels')
+        client.channels = None if channels is None else set(channels)
+        client.decimate = max(1, min(int(request.get('decimate') or 1), 65535))
+        raw = client.channels is None or RAW_NAME in client.channels
+        client.raw = set((index, client.decimate) for index in client.headsets) if raw else set()
+        self.__refresh()
+
+    def __refresh(self):
+        "tells every feed the decimations and variables its clients want"
+        for feed in self.__feeds:
+            clients = [client for client in self.__clients if feed.index in client.headsets]
+            feed.decimations = tuple(sorted(set(decimate for index, decimate in
+                                                set().union(*[client.raw for client in clients])
+                                                if index == feed.index)))
+            feed.values = any(client.channels is None or client.channels - {RAW_NAME} for client in clients)
+
+    def _broadcast(self, key, frame):
+        "writes a raw frame to the clients that want it, in the event loop"
+        websocket = None
+        for client in self.__clients:
+            if key in client.raw:
+                if client.websocket:
+                    if websocket is None:
+                        websocket = _websocket_frame(frame)
+                    client.write(websocket)
+                else:
+                    client.write(frame)
+
+    def _values(self, index, timestamp, fields):
+        "writes the values of a packet to the clients that want them, in the event loop"
+        frames = {}
+        for client in self.__clients:
+            if index not in client.headsets:
+                continue
+            channels = client.channels
+            key = None if channels is None else frozenset(channels)
+            if key not in frames:
+                wanted = fields if channels is None else [(name, value) for name, value in fields if name in channels]
+                frames[key] = encode_values(index, timestamp, wanted) if wanted else None
+            if frames[key] is not None:
+                client.send(frames[key])
+
+
+class StreamClient(object):
+    """Reads the frames of a StreamServer over TCP.
+    i.e.
+        async with StreamClient("192.168.1.20", 9109) as client:
+            await client.subscribe(channels=["rawValue", "attention"], decimate=4)
+            async for kind, headset, data in client:
+                ...  # "raw", name, (times, values) numpy arrays or "values", name, Sample
+    client.headsets lists the names of the headsets of the server, client.frames and client.bytes count what
+    it has received."""
+
+    def __init__(self, host='127.0.0.1', port=9109):
+        self.host = host
+        self.port = port
+        self.hello = None
+        self.headsets = []
+        self.frames = self.bytes = 0
+        self.__reader = self.__writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __aiter__(self):
+        return self.messages()
+
+    async def connect(self):
+        "connects and reads the HELLO of the server"
+        self.__reader, self.__writer = await asyncio.open_connection(self.host, self.port)
+        self.__writer.write(PREAMBLE)
+        kind, headset, count, body = await read_frame(self.__reader)
+        if kind != HELLO:
+            raise ValueError("the server did not start with HELLO")
+        self.hello = json.loads(body.decode('utf-8'))
+        self.headsets = self.hello['headsets']
+
+    async def subscribe(self, headsets=None, channels=None, decimate=1):
+        "chooses the headsets (names), variables and decimation of the raw values, None for all"
+        request = {'headsets': headsets, 'channels': channels, 'decimate': decimate}
+        self.__writer.write(encode_frame(SUBSCRIBE, 0, 0, json.dumps(request).encode('utf-8')))
+        await self.__writer.drain()
+
+    async def read(self):
+        "returns the next frame as (type, headset, count, body), None when the server closes"
+        try:
+            frame = await read_frame(self.__reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        self.frames += 1
+        self.bytes += FRAME.size + len(frame[3])
+        return frame
+
+    async def messages(self):
+        "async iterator of the decoded frames: ('raw', headset name, (times, values)) or ('values', name, Sample)"
+        while True:
+            frame = await self.read()
+            if frame is None:
+                return
+            kind, headset = frame[:2]
+            if kind in (RAW, VALUES):
+                yield ('raw' if kind == RAW else 'values'), self.headsets[headset], decode_frame(*frame)
+
+    async def close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+            try:
+                await self.__writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.__writer = None
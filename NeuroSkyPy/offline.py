@@ -0,0 +1,139 @@
+import bisect
+
+import numpy as np
+
+from .parser import CODES, EXCODE, FIELD_DTYPES as _FIELD_DTYPES, MAX_PAYLOAD, SYNC_BYTE
+
+FIELD_DTYPES = dict((name, np.dtype(dtype)) for name, dtype in _FIELD_DTYPES.items())
+
+
+def load_capture(source):
+    '''
+    Gives a uint8 view of a raw serial capture without reading it into memory
+    :param source: path of the capture, np.memmap / ndarray or bytes-like object
+    :return: 1-d uint8 array
+    '''
+    if isinstance(source, np.ndarray):
+        return source.reshape(-1).view(np.uint8)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return np.frombuffer(source, dtype=np.uint8)
+    with open(source, 'rb') as capture:
+        if not capture.seek(0, 2):
+            return np.zeros(0, dtype=np.uint8)
+    return np.memmap(source, dtype=np.uint8, mode='r')
+
+
+def find_packets(data):
+    '''
+    Locates the valid packets of a capture, exactly as ThinkGearParser would walk it
+    :param data: uint8 array with the capture
+    :return: (start, stop) arrays with the first payload byte and the checksum byte of every valid packet
+    '''
+    n = len(data)
+    empty = np.zeros(0, dtype=np.int64)
+    if n < 4:
+        return empty, empty
+    sync = data == SYNC_BYTE
+    candidates = np.flatnonzero(sync[:-1] & sync[1:])
+    # candidates whose length byte has not been captured end the walk
+    candidates = candidates[candidates + 2 < n]
+    if not len(candidates):
+        return empty, empty
+
+    length = data[candidates + 2].astype(np.int64)
+    stop = candidates + 3 + length
+    complete = stop < n
+    # checksums of every candidate at once, an uint8 cumulative sum wraps like the checksum does
+    cumulative = np.zeros(n + 1, dtype=np.uint8)
+    np.cumsum(data, dtype=np.uint8, out=cumulative[1:])
+    safe_stop = np.where(complete, stop, n - 1)
+    total = cumulative[safe_stop] - cumulative[np.minimum(candidates + 3, safe_stop)]
+    allowed = length <= MAX_PAYLOAD
+    valid = complete & allowed & ((~total & 0xFF) == data[safe_stop])
+
+    # where the parser searches the next sync from after each candidate
+    resume = np.where(valid, stop + 1, candidates + 2)
+    resume[length == SYNC_BYTE] = candidates[length == SYNC_BYTE] + 1
+    following = np.searchsorted(candidates, resume, side='left')
+    # an incomplete packet stops the parser until more data arrives, which never happens here
+    following[~complete & allowed] = len(candidates)
+
+    # the walk itself is sequential: a sync inside an accepted packet is never looked at.
+    # Runs of candidates that lead to the next one are crossed at once, only the jumps are walked.
+    last = len(candidates)
+    jumps = np.flatnonzero(following != np.arange(1, last + 1)).tolist()
+    reached = np.zeros(last + 1, dtype=np.int64)
+    i = 0
+    while i < last:
+        k = bisect.bisect_left(jumps, i)
+        k = jumps[k] if k < len(jumps) else last - 1
+        reached[i] += 1
+        reached[k + 1] -= 1
+        i = int(following[k])
+    accepted = np.flatnonzero(np.cumsum(reached[:-1]) > 0)
+    accepted = accepted[valid[accepted]]
+    return candidates[accepted] + 3, stop[accepted]
+
+
+def decode_capture(source):
+    '''
+    Vectorized decoder of a recorded ThinkGear byte stream, its output matches the streaming parser
+    :param source: path of the capture, np.memmap / ndarray or bytes-like object
+    :return: dict of variable name -> (packet indices, values) arrays
+    '''
+    data = load_capture(source)
+    start, stop = find_packets(data)
+    count = len(start)
+    values = dict((name, np.zeros(count, dtype=dtype)) for name, dtype in FIELD_DTYPES.items())
+    present = dict((name, np.zeros(count, dtype=bool)) for name in FIELD_DTYPES)
+
+    # walk the data rows of every packet in lock-step, one row per iteration
+    packet = np.flatnonzero(start < stop)
+    cursor = start[packet]
+    while len(packet):
+        end = stop[packet]
+        code = data[cursor]
+        excode = code == EXCODE
+        multi = (code >= 0x80) & ~excode
+        has_next = cursor + 1 < end
+        length = np.where(multi & has_next, data[np.minimum(cursor + 1, end - 1)], 1).astype(np.int64)
+        complete = np.where(multi, has_next & (cursor + 2 + length <= end), has_next)
+
+        for row_code, (row_length, decoder, fields, dtype) in CODES.items():
+            hit = complete & (code == row_code) & (length == row_length)
+            if not hit.any():
+                continue
+            rows = cursor[hit] + (2 if row_code >= 0x80 else 1)
+            width = row_length // len(fields)
+            for name in fields:
+                # big-endian integer of width bytes, two's complement for signed fields
+                value = np.zeros(len(rows), dtype=np.int64)
+                for k in range(width):
+                    value = (value << 8) | data[rows + k]
+                if FIELD_DTYPES[name].kind == 'i':
+                    value -= (value >> (8 * width - 1)) << (8 * width)
+                values[name][packet[hit]] = value
+                present[name][packet[hit]] = True
+                rows = rows + width
+
+        cursor = np.where(excode, cursor + 1, np.where(multi, cursor + 2 + length, cursor + 1 + length))
+        alive = (excode | complete) & (cursor < end)
+        packet = packet[alive]
+        cursor = cursor[alive]
+
+    return dict((name, (np.flatnonzero(present[name]), values[name][present[name]])) for name in FIELD_DTYPES)
+
+
+def collect_packets(packets):
+    '''
+    Columnar version of a list of packets returned by ThinkGearParser, in the same format as decode_capture
+    :param packets: list of Samples
+    :return: dict of variable name -> (packet indices, values) arrays
+    '''
+    columns = dict((name, ([], [])) for name in FIELD_DTYPES)
+    for index, packet in enumerate(packets):
+        for name, value in packet.items():
+            columns[name][0].append(index)
+            columns[name][1].append(value)
+    return dict((name, (np.array(index, dtype=np.int64), np.array(value, dtype=FIELD_DTYPES[name])))
+                for name, (index, value) in columns.items())
@@ -0,0 +1,197 @@
+"""Incremental ThinkGear packet parser.
+
+A ThinkGear packet is laid out as:
+    [SYNC 0xAA] [SYNC 0xAA] [PLENGTH] [PAYLOAD ... PLENGTH bytes] [CHECKSUM]
+where CHECKSUM is the inverted low byte of the sum of the payload bytes.
+"""
+from time import monotonic_ns
+
+SYNC = b'\xaa\xaa'
+SYNC_BYTE = 0xAA
+EXCODE = 0x55
+# longest payload the protocol allows, a longer length byte is corruption
+MAX_PAYLOAD = 169
+
+# names of the 8 bands of the ASIC_EEG_POWER row (code 0x83), in wire order
+BAND_NAMES = ('delta', 'theta', 'lowAlpha', 'highAlpha', 'lowBeta', 'highBeta', 'lowGamma', 'midGamma')
+
+
+def _unsigned8(payload, i):
+    return (payload[i],)
+
+
+def _signed16(payload, i):
+    return (int.from_bytes(payload[i:i + 2], 'big', signed=True),)
+
+
+def _unsigned24x8(payload, i):
+    return tuple(int.from_bytes(payload[j:j + 3], 'big') for j in range(i, i + 24, 3))
+
+
+# data rows: code -> (value length, decoder, fields, dtype of the fields).
+# Codes below 0x80 carry a single byte value, the rest ([CODE] [VLENGTH] [VALUE ...]) carry their
+# own length and rows whose length does not match the table are skipped, as well as unknown codes.
+CODES = {
+    0x02: (1, _unsigned8, ('poorSignal',), 'u1'),
+    0x04: (1, _unsigned8, ('attention',), 'u1'),
+    0x05: (1, _unsigned8, ('meditation',), 'u1'),
+    0x16: (1, _unsigned8, ('blinkStrength',), 'u1'),
+    0x80: (2, _signed16, ('rawValue',), 'i2'),  # raw value, big-endian signed 16 bits
+    0x83: (24, _unsigned24x8, BAND_NAMES, 'u4'),  # ASIC_EEG_POWER, 8 big-endian unsigned 24 bits
+}
+
+# every variable decoded from the rows and its dtype
+FIELD_DTYPES = dict((name, dtype) for length, decoder, fields, dtype in CODES.values() for name in fields)
+FIELDS = tuple(FIELD_DTYPES)
+
+
+class Sample(object):
+    """Values decoded from one packet, with the timestamp of its arrival (time.monotonic_ns()).
+    Variables that were not in the packet read as None, names lists the ones that were."""
+    __slots__ = ('timestamp', 'names') + FIELDS
+
+    def __init__(self, timestamp=0):
+        self.timestamp = timestamp
+        self.names = []
+
+    def __getattr__(self, name):
+        # only reached for the slots of the variables not sent in this packet
+        if name in FIELD_DTYPES:
+            return None
+        raise AttributeError(name)
+
+    def __repr__(self):
+        return "Sample(%d, %s)" % (self.timestamp, ", ".join("%s=%s" % item for item in self.items()))
+
+    def items(self):
+        "(name, value) pairs of the variables sent in the packet"
+        return [(name, getattr(self, name)) for name in self.names]
+
+
+def decode_payload(payload, timestamp=0):
+    "decodes the data rows of a payload into a Sample"
+    sample = Sample(timestamp)
+    names = sample.names
+    i = 0
+    n = len(payload)
+    while i < n:
+        code = payload[i]
+        if code == EXCODE:
+            i += 1
+            continue
+        if code >= 0x80:
+            if i + 1 >= n:
+                break
+            length = payload[i + 1]
+            i += 2
+        else:
+            length = 1
+            i += 1
+        if i + length > n:  # truncated row
+            break
+        row = CODES.get(code)
+        if row is not None and row[0] == length:
+            fields = row[2]
+            for name, value in zip(fields, row[1](payload, i)):
+                setattr(sample, name, value)
+            if fields[0] not in names:  # the fields of a row always come together
+                names += fields
+        i += length
+    return sample
+
+
+class ThinkGearParser(object):
+    """Incremental parser of a ThinkGear byte stream.
+    It is fed chunks of any size as they are read from the serial port and returns the packets completed by them
+    i.e. packets = parser.feed(srl.read(srl.in_waiting or 1))
+    Bytes of an incomplete packet are kept until the next chunk arrives.
+    After corruption it resyncs on the next sync right away: a bad checksum or a length over MAX_PAYLOAD never
+    makes it wait for more bytes. Counters: bytes fed, packets decoded, checksumErrors, invalidLengths, syncLosses (times the
+    stream stopped being a sequence of valid packets) and bytesDiscarded (bytes outside valid packets)."""
+
+    def __init__(self):
+        self.__buffer = bytearray()
+        self.__inSync = True  # no byte discarded since the last valid packet
+        self.bytes = 0  # bytes fed
+        self.packets = 0  # number of valid packets decoded
+        self.checksumErrors = 0
+        self.invalidLengths = 0
+        self.syncLosses = 0
+        self.bytesDiscarded = 0
+
+    def reset(self):
+        "drops any partial packet kept from previous chunks"
+        self.__discard(len(self.__buffer))
+        del self.__buffer[:]
+
+    def stats(self):
+        "returns a dict with the counters"
+        return {
+            'bytes': self.bytes,
+            'packets': self.packets,
+            'checksumErrors': self.checksumErrors,
+            'invalidLengths': self.invalidLengths,
+            'syncLosses': self.syncLosses,
+            'bytesDiscarded': self.bytesDiscarded,
+        }
+
+    def __discard(self, count):
+        if count > 0:
+            self.bytesDiscarded += count
+            if self.__inSync:
+                self.__inSync = False
+                self.syncLosses += 1
+
+    def feed(self, data, timestamp=None):
+        """appends data (bytes, bytearray or memoryview) to the stream and returns the list of Samples decoded.
+        The packets are stamped with timestamp, the time of the read by default"""
+        if timestamp is None:
+            timestamp = monotonic_ns()
+        self.bytes += len(data)
+        buf = self.__buffer
+        buf += data
+        end = len(buf)
+        packets = []
+        pos = 0
+        clean = 0  # end of the last valid packet, the bytes from there to a sync are discarded
+        while True:
+            pos = buf.find(SYNC, pos)
+            if pos < 0:
+                # nothing to sync on, only a trailing 0xAA may be the start of the next packet
+                pos = end - 1 if end and buf[-1] == SYNC_BYTE else end
+                break
+            if pos + 2 >= end:
+                break
+            length = buf[pos + 2]
+            if length > MAX_PAYLOAD:
+                if length == SYNC_BYTE:  # 0xAA 0xAA 0xAA, the sync starts one byte later
+                    pos += 1
+                else:
+                    # corrupt length, resync right after this sync instead of waiting for its payload
+                    self.invalidLengths += 1
+                    pos += 2
+                continue
+            stop = pos + 3 + length
+            if stop >= end:  # the payload or the checksum has not arrived yet
+                break
+            payload = buf[pos + 3:stop]
+            if (~sum(payload)) & 0xFF == buf[stop]:
+                if pos != clean:
+                    self.__discard(pos - clean)
+                self.__inSync = True
+                packets.append(decode_payload(payload, timestamp))
+                pos = clean = stop + 1
+            else:
+                # bad checksum, look for the next sync right after this one
+                self.checksumErrors += 1
+                pos += 2
+        if pos != clean:
+            self.__discard(pos - clean)
+        del buf[:pos]
+        self.packets += len(packets)
+        return packets
+
+    def parse(self, data):
+        "generator version of feed, yields the packets one by one"
+        for packet in self.feed(data):
+            yield packet
@@ -0,0 +1,195 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .dispatch import BATCH, SYNC
+
+# bits of the quality mask of a window
+SATURATED = 1  # samples at the limit of the converter
+FLATLINE = 2  # (almost) constant signal, electrode off or disconnected
+HIGH_AMPLITUDE = 4  # peak to peak beyond what EEG can be, movement or electrode pops
+BLINK = 8  # large slow deflection of an eye blink
+EMG = 16  # most of the power at high frequencies, muscle activity
+POOR_SIGNAL = 32  # the headset reported poor contact
+FLAGS = (
+    ('saturated', SATURATED),
+    ('flatline', FLATLINE),
+    ('highAmplitude', HIGH_AMPLITUDE),
+    ('blink', BLINK),
+    ('emg', EMG),
+    ('poorSignal', POOR_SIGNAL),
+)
+ALL_FLAGS = SATURATED | FLATLINE | HIGH_AMPLITUDE | BLINK | EMG | POOR_SIGNAL
+
+# rows of the quality table: the first and last timestamps of the window and its mask
+QUALITY_DTYPE = np.dtype([('timestamp', np.int64), ('start', np.int64), ('flags', np.uint8)])
+
+
+def describe(flags):
+    '''
+    Names of the flags set in a quality mask
+    :param flags: mask of a window
+    :return: list of names
+    '''
+    return [name for name, bit in FLAGS if flags & bit]
+
+
+def sample_mask(timestamps, starts, ends, flags, reject=ALL_FLAGS):
+    '''
+    Marks the samples that fall in no rejected window, without looking at the signal again
+    :param timestamps: sorted timestamps of the samples
+    :param starts: first timestamp of every window
+    :param ends: last timestamp of every window
+    :param flags: quality mask of every window
+    :param reject: flags that make a window bad
+    :return: boolean array, True for the good samples
+    '''
+    timestamps = np.asarray(timestamps)
+    bad = (np.asarray(flags) & reject) != 0
+    # +1 where a bad window starts and -1 after it ends, their sum is positive inside bad windows
+    change = np.zeros(len(timestamps) + 1, dtype=np.int64)
+    np.add.at(change, np.searchsorted(timestamps, np.asarray(starts)[bad], side='left'), 1)
+    np.add.at(change, np.searchsorted(timestamps, np.asarray(ends)[bad], side='right'), -1)
+    return np.cumsum(change[:-1]) == 0
+
+
+class QualityMonitor(object):
+    """Flags the artifacts of the raw signal per window, on whole blocks of samples at once.
+    i.e.
+        monitor=QualityMonitor(rate=512, window=512)
+        times, flags = monitor.push(timestamps, values)  # one uint8 mask per window, see FLAGS
+    Every window of `window` samples, `hop` apart (hop <= window), gets the bits of:
+        SATURATED       at least saturationSamples samples with |value| >= saturation
+        FLATLINE        peak to peak below flatRange
+        HIGH_AMPLITUDE  peak to peak above amplitudeRange
+        BLINK           the signal smoothed over blinkSeconds moves more than blinkRange
+        EMG             more than emgRatio of the power (above 1 Hz) is above emgFrequency
+        POOR_SIGNAL     the last poorSignal received is at least poorSignalLimit
+    With a SessionRecorder every window is stored as a row of its 'quality' table (QUALITY_DTYPE) so the
+    analysis can skip the bad segments with sample_mask() without scanning the raw signal again."""
+
+    def __init__(self, rate=512, window=512, hop=None, saturation=2047, saturationSamples=4, flatRange=5,
+                 amplitudeRange=2000, blinkRange=400, blinkSeconds=0.1, emgFrequency=30.0, emgRatio=0.5,
+                 poorSignalLimit=50, recorder=None, table='quality', capacity=8192):
+        if (hop or window) > window:
+            raise ValueError("hop must not exceed window, the windows would leave samples unchecked")
+        self.rate = rate
+        self.window = window
+        self.hop = hop or window
+        self.saturation = saturation
+        self.saturationSamples = saturationSamples
+        self.flatRange = flatRange
+        self.amplitudeRange = amplitudeRange
+        self.blinkRange = blinkRange
+        self.smoothing = max(1, int(blinkSeconds * rate))
+        self.emgRatio = emgRatio
+        self.poorSignalLimit = poorSignalLimit
+        self.poorSignal = 0
+        frequencies = np.fft.rfftfreq(window, 1.0 / rate)
+        self.__total = frequencies >= 1.0
+        self.__high = frequencies >= emgFrequency
+        self.recorder = recorder
+        self.table = table
+        if recorder is not None:
+            recorder.addTable(table, QUALITY_DTYPE)
+        self.capacity = max(capacity, window + self.hop)
+        self.__samples = np.zeros(self.capacity)
+        self.__times = np.zeros(self.capacity, dtype=np.int64)
+        self.__filled = 0
+        self.windows = 0
+        self.counts = dict((name, 0) for name, bit in FLAGS)  # windows flagged with each bit
+        self.subscriptions = []  # of rawValue and poorSignal to the headset attached
+        self.headset = None
+
+    def reset(self):
+        "forgets the samples received, i.e. after a gap in the signal"
+        self.__filled = 0
+
+    def attach(self, headset, batchSize=64):
+        "checks the raw values of a NeuroSkyPy object, delivered in batches by its dispatcher, and its poorSignal"
+        self.detach()
+        self.headset = headset
+        self.subscriptions = [headset.subscribe("rawValue", self.push, policy=BATCH, batchSize=batchSize),
+                              headset.subscribe("poorSignal", self.setPoorSignal, policy=SYNC)]
+
+    def detach(self):
+        "stops following the NeuroSkyPy object attached, the samples received are kept"
+        for subscription in self.subscriptions:
+            self.headset.unsubscribe(subscription)
+        self.subscriptions = []
+        self.headset = None
+
+    def setPoorSignal(self, value):
+        "poorSignal reported by the headset, applied to the windows completed from now on"
+        self.poorSignal = value
+
+    def push(self, timestamps, values):
+        "adds raw samples and returns (times, flags) of the windows they complete, times of their last sample"
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        times, flags = [], []
+        pos = 0
+        while pos < len(values):
+            size = min(len(values) - pos, self.capacity - self.__filled)
+            self.__samples[self.__filled:self.__filled + size] = values[pos:pos + size]
+            self.__times[self.__filled:self.__filled + size] = timestamps[pos:pos + size]
+            self.__filled += size
+            pos += size
+            if self.__filled >= self.window:
+                blockTimes, blockFlags = self.__check()
+                times.append(blockTimes)
+                flags.append(blockFlags)
+        if not times:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8)
+        return np.concatenate(times), np.concatenate(flags)
+
+    def __check(self):
+        "flags every complete window of the buffer at once"
+        filled, window, hop = self.__filled, self.window, self.hop
+        count = (filled - window) // hop + 1
+        signal = self.__samples[:filled]
+        windows = sliding_window_view(signal, window)[::hop][:count]
+        flags = np.zeros(count, dtype=np.uint8)
+
+        saturated = np.count_nonzero(np.abs(windows) >= self.saturation, axis=1) >= self.saturationSamples
+        flags[saturated] |= SATURATED
+        peakToPeak = windows.max(axis=1) - windows.min(axis=1)
+        flags[peakToPeak < self.flatRange] |= FLATLINE
+        flags[peakToPeak > self.amplitudeRange] |= HIGH_AMPLITUDE
+
+        # moving average of the whole block, then the range of every window of it
+        k = self.smoothing
+        if k > 1 and filled >= k:
+            cumulative = np.concatenate(([0.0], np.cumsum(signal)))
+            smooth = (cumulative[k:] - cumulative[:-k]) / k
+            smoothWindows = sliding_window_view(smooth, window - k + 1)[::hop][:count]
+            slow = smoothWindows.max(axis=1) - smoothWindows.min(axis=1)
+        else:
+            slow = peakToPeak
+        flags[slow > self.blinkRange] |= BLINK
+
+        spectrum = np.fft.rfft(windows - windows.mean(axis=1)[:, None], axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        total = power[:, self.__total].sum(axis=1)
+        high = power[:, self.__high].sum(axis=1)
+        flags[high > self.emgRatio * np.maximum(total, 1e-12)] |= EMG
+        if self.poorSignal >= self.poorSignalLimit:
+            flags |= POOR_SIGNAL
+
+        index = np.arange(count) * hop
+        starts = self.__times[index]
+        times = self.__times[index + window - 1]
+        consumed = count * hop
+        self.__samples[:filled - consumed] = self.__samples[consumed:filled]
+        self.__times[:filled - consumed] = self.__times[consumed:filled]
+        self.__filled = filled - consumed
+
+        self.windows += count
+        for name, bit in FLAGS:
+            self.counts[name] += int(np.count_nonzero(flags & bit))
+        if self.recorder is not None:
+            rows = np.zeros(count, QUALITY_DTYPE)
+            rows['timestamp'] = times
+            rows['start'] = starts
+            rows['flags'] = flags
+            self.recorder.appendRows(self.table, rows)
+        return times, flags
@@ -0,0 +1,399 @@
+import json
+import logging
+import os
+import threading
+import time
+from time import monotonic_ns
+
+import numpy as np
+
+from .dispatch import SYNC
+from .parser import BAND_NAMES, FIELD_DTYPES
+
+# tables of the decoded samples and their columns, every table also has an int64 'timestamp' column
+TABLES = (
+    ('raw', ('rawValue',)),
+    ('bands', BAND_NAMES),
+    ('esense', ('poorSignal', 'attention', 'meditation')),
+    ('blink', ('blinkStrength',)),
+)
+# formats of the part files, in order of preference
+FORMATS = ('parquet', 'hdf5', 'npz')
+EXTENSIONS = {'parquet': '.parquet', 'hdf5': '.h5', 'npz': '.npz'}
+INDEX = 'index.jsonl'
+SESSION = 'session.json'
+
+logger = logging.getLogger(__name__)
+
+
+def default_format():
+    '''
+    Picks the best format available: parquet with pyarrow, hdf5 with h5py, npz otherwise
+    :return: name of the format
+    '''
+    for format, module in (('parquet', 'pyarrow.parquet'), ('hdf5', 'h5py')):
+        try:
+            __import__(module)
+            return format
+        except ImportError:
+            pass
+    return 'npz'
+
+
+def table_dtype(fields):
+    '''
+    Row type of a table of decoded samples
+    :param fields: names of the variables in the table
+    :return: numpy structured dtype with the timestamp and the fields
+    '''
+    return np.dtype([('timestamp', np.int64)] + [(name, FIELD_DTYPES[name]) for name in fields])
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_part(format, path, rows):
+    '''
+    Writes the rows of a chunk in one file and makes it durable
+    :param format: parquet, hdf5 or npz
+    :param path: file to write
+    :param rows: structured array
+    :return: nothing
+    '''
+    columns = dict((name, np.ascontiguousarray(rows[name])) for name in rows.dtype.names)
+    if format == 'parquet':
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.table(columns)
+        pyarrow.parquet.write_table(table, path, compression='zstd')
+    elif format == 'hdf5':
+        import h5py
+        with h5py.File(path, 'w') as f:
+            for name, values in columns.items():
+                f.create_dataset(name, data=values, compression='gzip', shuffle=True)
+    else:
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **columns)
+    _fsync(path)
+
+
+def _read_part(format, path, columns, start, end):
+    '''
+    Reads some columns of a part file, only the rows with start <= timestamp <= end
+    :param format: parquet, hdf5 or npz
+    :param path: file to read
+    :param columns: names of the columns
+    :param start: first timestamp or None
+    :param end: last timestamp or None
+    :return: dict of name -> array
+    '''
+    if format == 'parquet':
+        import pyarrow.parquet
+        wanted = list(columns) if start is None and end is None else list(set(columns) | {'timestamp'})
+        table = pyarrow.parquet.read_table(path, columns=wanted)
+        data = dict((name, table.column(name).to_numpy()) for name in wanted)
+        get = data.__getitem__
+        f = None
+    elif format == 'hdf5':
+        import h5py
+        f = h5py.File(path, 'r')
+        get = f.__getitem__
+    else:
+        f = np.load(path)  # columns are decompressed when they are accessed
+        get = f.__getitem__
+    try:
+        first, last = 0, None
+        if start is not None or end is not None:
+            timestamps = get('timestamp')[...]
+            first = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+            last = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, side='right'))
+        return dict((name, np.asarray(get(name)[first:last])) for name in columns)
+    finally:
+        if f is not None:
+            f.close()
+
+
+class _Table(object):
+    "rows of a table waiting to be written, in a preallocated chunk, and the one the writer is writing"
+
+    def __init__(self, name, dtype, chunkRows, parts):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.chunkRows = chunkRows
+        self.chunk = np.zeros(chunkRows, self.dtype)
+        self.spare = np.zeros(chunkRows, self.dtype)  # swapped with chunk by the writer
+        self.rows = 0
+        self.parts = parts  # part files written so far
+        self.dropped = 0  # rows discarded because the chunk was full while the writer was busy
+
+
+class SessionRecorder(object):
+    """Records the decoded samples of a session in a directory, while it runs, as compressed column files.
+    i.e.
+        recorder=SessionRecorder("./session1")
+        recorder.attach(headset)  # or recorder.record(sample) from your own "packet" callback
+        ...
+        recorder.close()
+    Every flushSeconds, or as soon as a table holds chunkRows rows, a separate thread takes the rows gathered
+    by all the tables at once, the chunk, and writes one part per table: Parquet with pyarrow, HDF5 with h5py or
+    compressed npz otherwise. A part is written to a temporary file, synced and renamed, then listed in
+    index.jsonl, so a crash loses at most the chunk being written and the rows gathered since it was taken.
+    Memory stays constant, two preallocated chunks of chunkRows rows per table, and record() never waits for
+    the disk: the rows that do not fit while the writer is busy are discarded and counted in dropped.
+    Read the sessions with SessionReader."""
+
+    def __init__(self, directory, format=None, chunkRows=65536, flushSeconds=10.0):
+        format = format or default_format()
+        if format not in FORMATS:
+            raise ValueError("format must be one of %s" % ", ".join(FORMATS))
+        self.directory = directory
+        self.format = format
+        self.chunkRows = chunkRows
+        self.flushSeconds = flushSeconds
+        self.error = None  # exception of the writer thread, raised again by close()
+        self.dropped = 0  # rows discarded, see _Table.dropped
+        self.subscription = None
+        self.headset = None
+        os.makedirs(directory, exist_ok=True)
+        self.__parts = self.__existingParts()
+        self.__tables = {}
+        self.__fields = {}  # variable -> table of the decoded samples
+        self.__lock = threading.Lock()
+        self.__index = open(os.path.join(directory, INDEX), 'a')
+        if not os.path.exists(os.path.join(directory, SESSION)):
+            self.__writeSession()
+        for name, fields in TABLES:
+            self.addTable(name, table_dtype(fields))
+            for field in fields:
+                self.__fields[field] = self.__tables[name]
+        self.__due = threading.Event()  # a chunk is full, flush() or close() was called
+        self.__closing = False
+        self.__writer = threading.Thread(target=self.__write, daemon=True)
+        self.__writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __existingParts(self):
+        "number of part files of every table already in the directory, when a session is resumed"
+        parts = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                files = os.listdir(path)
+                for tmp in [f for f in files if f.endswith('.tmp')]:  # left by a crash
+                    os.remove(os.path.join(path, tmp))
+                parts[name] = len([f for f in files if f.startswith('part-') and not f.endswith('.tmp')])
+        return parts
+
+    def __writeSession(self):
+        "session.json relates the monotonic timestamps of the samples with the wall clock"
+        session = {
+            'format': self.format,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'wallOffsetNs': time.time_ns() - monotonic_ns(),
+        }
+        path = os.path.join(self.directory, SESSION)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(session, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def addTable(self, name, dtype):
+        "adds a table of rows of dtype, a numpy structured type whose first field is an int64 'timestamp'"
+        dtype = np.dtype(dtype)
+        if dtype.names is None or dtype.names[0] != 'timestamp':
+            raise ValueError("the first field of a table must be its timestamp")
+        if name in self.__tables:
+            if self.__tables[name].dtype != dtype:
+                raise ValueError("table %r already exists with other columns" % name)
+            return
+        os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+        self.__tables[name] = _Table(name, dtype, self.chunkRows, self.__parts.get(name, 0))
+
+    def attach(self, headset):
+        "records every packet of a NeuroSkyPy object, through a subscription to its 'packet' variable"
+        self.detach()
+        self.headset = headset
+        self.subscription = headset.subscribe("packet", self.record, policy=SYNC)
+
+    def detach(self):
+        "stops recording the packets of the NeuroSkyPy object attached"
+        if self.subscription is not None:
+            self.headset.unsubscribe(self.subscription)
+            self.subscription = self.headset = None
+
+    def record(self, sample):
+        "stores a decoded Sample in the tables of its variables, the missing ones of a table are stored as 0"
+        fields = self.__fields
+        done = []
+        for name in sample.names:
+            table = fields.get(name)
+            if table is not None and table not in done:
+                done.append(table)
+                self.append(table.name, (sample.timestamp,) + tuple(
+                    getattr(sample, field) or 0 for field in table.dtype.names[1:]))
+
+    def append(self, name, row):
+        "stores a row, a tuple with the timestamp and the values of the other columns, in a table"
+        with self.__lock:
+            table = self.__tables[name]
+            if table.rows == table.chunkRows:
+                self.__full(table, 1)
+                return
+            table.chunk[table.rows] = row
+            table.rows += 1
+            if table.rows == table.chunkRows:
+                self.__due.set()
+
+    def appendRows(self, name, rows):
+        "stores the rows of a structured array with the columns of the table"
+        with self.__lock:
+            table = self.__tables[name]
+            size = min(len(rows), table.chunkRows - table.rows)
+            table.chunk[table.rows:table.rows + size] = rows[:size]
+            table.rows += size
+            if size < len(rows):
+                self.__full(table, len(rows) - size)
+            elif table.rows == table.chunkRows:
+                self.__due.set()
+
+    def __full(self, table, rows):
+        "counts the rows that did not fit in the chunk of a table, the writer has not taken the previous one yet"
+        if not table.dropped:
+            logger.warning("table %s is full, the writer falls behind and rows are dropped", table.name)
+        table.dropped += rows
+        self.dropped += rows
+        self.__due.set()
+
+    def flush(self):
+        "has the writer write the rows of every table gathered so far, without waiting for it"
+        self.__due.set()
+
+    def __take(self):
+        "swaps the chunks of the tables with their spares, returns [(name, part number, rows)] of the ones with rows"
+        parts = []
+        with self.__lock:
+            for table in self.__tables.values():
+                if table.rows:
+                    rows = table.chunk[:table.rows]
+                    table.chunk, table.spare = table.spare, table.chunk
+                    table.rows = 0
+                    table.parts += 1
+                    parts.append((table.name, table.parts, rows))
+        return parts
+
+    def __write(self):
+        "writer thread: writes the chunk every flushSeconds or when it is due, its rows stay in the spares meanwhile"
+        while True:
+            self.__due.wait(self.flushSeconds)
+            self.__due.clear()
+            closing = self.__closing
+            for name, number, rows in self.__take():
+                try:
+                    self.__writePart(name, number, rows)
+                except Exception as error:
+                    self.error = error
+                    logger.exception("part %d of table %s could not be written", number, name)
+            if closing:
+                return
+
+    def __writePart(self, name, number, rows):
+        relative = os.path.join(name, "part-%06d%s" % (number, EXTENSIONS[self.format]))
+        path = os.path.join(self.directory, relative)
+        _write_part(self.format, path + '.tmp', rows)
+        os.replace(path + '.tmp', path)
+        if hasattr(os, 'O_DIRECTORY'):  # makes the rename durable (POSIX)
+            _fsync(os.path.dirname(path))
+        entry = {
+            'table': name,
+            'file': relative.replace(os.sep, '/'),
+            'format': self.format,
+            'rows': len(rows),
+            'start': int(rows['timestamp'][0]),
+            'end': int(rows['timestamp'][-1]),
+            'columns': list(rows.dtype.names),
+        }
+        self.__index.write(json.dumps(entry) + '\n')
+        self.__index.flush()
+        os.fsync(self.__index.fileno())
+
+    def close(self):
+        "detaches, writes the pending rows, waits for the writer and closes the index"
+        self.detach()
+        self.__closing = True
+        self.__due.set()
+        self.__writer.join()
+        self.__index.close()
+        if self.error is not None:
+            raise self.error
+
+
+class SessionReader(object):
+    """Reads a session written by SessionRecorder, only the parts and columns asked for are loaded.
+    i.e.
+        reader=SessionReader("./session1")
+        raw=reader.read("raw", start=reader.start("raw")+60e9)  # from the first minute on
+        alpha=reader.read("bands", ["lowAlpha", "highAlpha"])
+    Timestamps are time.monotonic_ns() values of the recording, wallclock() converts them to epoch nanoseconds."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.parts = {}  # table -> index entries, in order
+        with open(os.path.join(directory, INDEX)) as index:
+            for line in index:
+                try:
+                    entry = json.loads(line)
+                except ValueError:  # a line cut by a crash
+                    continue
+                self.parts.setdefault(entry['table'], []).append(entry)
+        try:
+            with open(os.path.join(directory, SESSION)) as f:
+                self.session = json.load(f)
+        except (OSError, ValueError):
+            self.session = {}
+
+    def tables(self):
+        "names of the tables with data"
+        return list(self.parts)
+
+    def columns(self, table):
+        return list(self.parts[table][0]['columns']) if table in self.parts else []
+
+    def rows(self, table):
+        return sum(entry['rows'] for entry in self.parts.get(table, ()))
+
+    def start(self, table):
+        "timestamp of the first row of a table"
+        return self.parts[table][0]['start']
+
+    def end(self, table):
+        "timestamp of the last row of a table"
+        return self.parts[table][-1]['end']
+
+    def wallclock(self, timestamps):
+        "converts monotonic timestamps of the session to nanoseconds since the epoch"
+        return np.asarray(timestamps, dtype=np.int64) + self.session.get('wallOffsetNs', 0)
+
+    def read(self, table, columns=None, start=None, end=None):
+        "returns a dict of column -> array with the rows of a table with start <= timestamp <= end"
+        columns = list(columns) if columns is not None else self.columns(table)
+        chunks = dict((name, []) for name in columns)
+        for entry in self.parts.get(table, ()):
+            if (start is not None and entry['end'] < start) or (end is not None and entry['start'] > end):
+                continue
+            path = os.path.join(self.directory, *entry['file'].split('/'))
+            inside = (start is None or entry['start'] >= start) and (end is None or entry['end'] <= end)
+            data = _read_part(entry['format'], path, columns, None if inside else start, None if inside else end)
+            for name in columns:
+                chunks[name].append(data[name])
+        return dict((name, np.concatenate(values) if values else np.zeros(0)) for name, values in chunks.items())
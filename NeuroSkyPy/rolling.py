@@ -0,0 +1,349 @@
+"""Rolling aggregates of a variable of the headset, kept up to date with every value it sends.
+
+Every aggregate is updated incrementally, in O(1) per value (mean, EMA, min, max, variance) or O(log n)
+(percentile), and its value can be read at any time from any thread without going over the window again.
+The window is the last `window` values or the values of the last `seconds` before the newest one.
+i.e.
+    mean = headset.rolling("meditation", "mean", window=5)
+    low = headset.rolling("rawValue", "percentile", q=5, seconds=2)
+    mean.value, low.value
+"""
+import heapq
+import math
+import threading
+from collections import deque
+
+from .dispatch import SYNC
+
+
+class _Rolling(object):
+    """Base of the aggregates: a value from the headset, or given to push(timestamp, value), at a time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscription = None
+        self.headset = None
+
+    def push(self, timestamp, value):
+        "adds a value taken at timestamp (time.monotonic_ns())"
+        raise NotImplementedError
+
+    def extend(self, timestamps, values):
+        "adds several values in order, i.e. the arrays returned by RingBuffer.latest()"
+        for timestamp, value in zip(timestamps, values):
+            self.push(int(timestamp), value)
+
+    def attach(self, headset, variable_name):
+        "updates the aggregate with every value of a variable of a NeuroSkyPy, from its parser thread, returns it"
+        self.detach()
+        last = headset.getBuffer(variable_name).last
+        push = self.push
+
+        def update(value):
+            # the value was appended to the buffer just before the callbacks, with its timestamp
+            push(last()[0], value)
+
+        self.headset = headset
+        self.subscription = headset.subscribe(variable_name, update, policy=SYNC)
+        return self
+
+    def detach(self):
+        "stops following the headset, the value is kept"
+        if self.subscription is not None:
+            self.headset.unsubscribe(self.subscription)
+            self.subscription = self.headset = None
+
+
+class _Window(_Rolling):
+    """Aggregate over a window of the last `window` values or of `seconds` seconds before the newest value.
+    Subclasses get every value entering the window in _add() and leaving it in _remove(), oldest first, and
+    _refresh() is called once every len(window) removals to compute the sums again and bound the rounding."""
+
+    def __init__(self, window=None, seconds=None):
+        _Rolling.__init__(self)
+        if (window is None) == (seconds is None):
+            raise ValueError("give either window (values) or seconds")
+        if (window is not None and window < 1) or (seconds is not None and seconds <= 0):
+            raise ValueError("the window must hold at least one value")
+        self.window = window
+        self.seconds = seconds
+        self.__span = None if seconds is None else int(seconds * 1e9)
+        self.entries = deque()  # (timestamp, value) of the window, oldest first
+        self.added = 0  # values added since the creation
+        self.removed = 0  # values that left the window
+        self.__refresh = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, timestamp, value):
+        "adds a value taken at timestamp (time.monotonic_ns())"
+        entries = self.entries
+        with self.lock:
+            entries.append((timestamp, value))
+            self._add(value)
+            self.added += 1
+            if self.__span is None:
+                while len(entries) > self.window:
+                    self.__evict()
+            else:
+                oldest = timestamp - self.__span
+                while entries[0][0] <= oldest:
+                    self.__evict()
+
+    def __evict(self):
+        self._remove(self.entries.popleft()[1])
+        self.removed += 1
+        self.__refresh += 1
+        if self.__refresh >= len(self.entries):
+            self.__refresh = 0
+            self._refresh()
+
+    @property
+    def value(self):
+        "the aggregate of the values in the window, None while it is empty"
+        with self.lock:
+            return self._value() if self.entries else None
+
+    def _add(self, value):
+        pass
+
+    def _remove(self, value):
+        pass
+
+    def _refresh(self):
+        pass
+
+    def _value(self):
+        raise NotImplementedError
+
+
+class RollingMean(_Window):
+    """Mean of the window, from a running sum.
+    i.e. RollingMean(window=5).attach(headset, "meditation").value"""
+
+    def __init__(self, window=None, seconds=None):
+        _Window.__init__(self, window, seconds)
+        self.total = 0
+
+    def _add(self, value):
+        self.total += value
+
+    def _remove(self, value):
+        self.total -= value
+
+    def _refresh(self):
+        self.total = math.fsum(value for timestamp, value in self.entries)
+
+    def _value(self):
+        return self.total / float(len(self.entries))
+
+
+class RollingVariance(_Window):
+    """Variance of the window, with Welford's update to add a value and its inverse to remove one.
+    ddof=1 gives the sample variance, std the standard deviation"""
+
+    def __init__(self, window=None, seconds=None, ddof=0):
+        _Window.__init__(self, window, seconds)
+        self.ddof = ddof
+        self.mean = 0.0
+        self.__m2 = 0.0  # sum of the squared distances to the mean
+
+    def _add(self, value):
+        count = len(self.entries)
+        delta = value - self.mean
+        self.mean += delta / count
+        self.__m2 += delta * (value - self.mean)
+
+    def _remove(self, value):
+        count = len(self.entries)
+        if not count:
+            self.mean = self.__m2 = 0.0
+            return
+        delta = value - self.mean
+        self.mean -= delta / count
+        self.__m2 -= delta * (value - self.mean)
+
+    def _refresh(self):
+        values = [value for timestamp, value in self.entries]
+        self.mean = math.fsum(values) / len(values) if values else 0.0
+        self.__m2 = math.fsum((value - self.mean) ** 2 for value in values)
+
+    def _value(self):
+        count = len(self.entries) - self.ddof
+        return max(self.__m2, 0.0) / count if count > 0 else float('nan')
+
+    @property
+    def std(self):
+        "standard deviation of the window, None while it is empty"
+        variance = self.value
+        return None if variance is None else math.sqrt(variance)
+
+
+class RollingStd(RollingVariance):
+    """Standard deviation of the window, see RollingVariance"""
+
+    def _value(self):
+        return math.sqrt(RollingVariance._value(self))
+
+
+class RollingMax(_Window):
+    """Maximum of the window, from a monotonic queue of the values that can still become the maximum"""
+    sign = 1
+
+    def __init__(self, window=None, seconds=None):
+        _Window.__init__(self, window, seconds)
+        self.__queue = deque()  # (index, value * sign) decreasing
+
+    def _add(self, value):
+        queue = self.__queue
+        key = value * self.sign
+        while queue and queue[-1][1] <= key:
+            queue.pop()
+        queue.append((self.added, key))
+
+    def _remove(self, value):
+        if self.__queue[0][0] == self.removed:
+            self.__queue.popleft()
+
+    def _value(self):
+        return self.__queue[0][1] * self.sign
+
+
+class RollingMin(RollingMax):
+    """Minimum of the window, see RollingMax"""
+    sign = -1
+
+
+class RollingPercentile(_Window):
+    """Percentile q (0 to 100) of the window, interpolated linearly between the two closest values as
+    numpy.percentile does. The lower values are kept in a max-heap and the higher ones in a min-heap, sized so
+    that the tops are the two closest values, and the values leaving the window are removed when they reach
+    the top of their heap, so every update costs O(log n)."""
+
+    def __init__(self, q=50, window=None, seconds=None):
+        _Window.__init__(self, window, seconds)
+        if not 0 <= q <= 100:
+            raise ValueError("q must be between 0 and 100")
+        self.q = q
+        self.__low = []  # max-heap of the lower values, negated
+        self.__high = []  # min-heap of the higher values
+        self.__lowSize = self.__highSize = 0  # values of each heap still in the window
+        self.__removed = {}  # value -> copies left in the heaps that are no longer in the window
+
+    def _add(self, value):
+        if self.__lowSize and value <= -self.__low[0]:
+            heapq.heappush(self.__low, -value)
+            self.__lowSize += 1
+        else:
+            heapq.heappush(self.__high, value)
+            self.__highSize += 1
+        self.__balance()
+
+    def _remove(self, value):
+        removed = self.__removed
+        removed[value] = removed.get(value, 0) + 1
+        if self.__lowSize and value <= -self.__low[0]:
+            self.__lowSize -= 1
+        else:
+            self.__highSize -= 1
+        self.__prune()
+        self.__balance()
+
+    def __prune(self):
+        "drops the removed values from the tops of the heaps"
+        removed = self.__removed
+        for heap, sign in ((self.__low, -1), (self.__high, 1)):
+            while heap and sign * heap[0] in removed:
+                value = sign * heapq.heappop(heap)
+                if removed[value] == 1:
+                    del removed[value]
+                else:
+                    removed[value] -= 1
+
+    def __balance(self):
+        "moves values between the heaps until the low one holds the values up to the percentile"
+        count = self.__lowSize + self.__highSize
+        target = int(math.floor((count - 1) * self.q / 100.0)) + 1 if count else 0
+        while self.__lowSize > target:
+            heapq.heappush(self.__high, -heapq.heappop(self.__low))
+            self.__lowSize -= 1
+            self.__highSize += 1
+            self.__prune()
+        while self.__lowSize < target:
+            heapq.heappush(self.__low, -heapq.heappop(self.__high))
+            self.__highSize -= 1
+            self.__lowSize += 1
+            self.__prune()
+
+    def _value(self):
+        position = (len(self.entries) - 1) * self.q / 100.0
+        fraction = position - math.floor(position)
+        low = -self.__low[0]
+        if fraction and self.__highSize:
+            return low + (self.__high[0] - low) * fraction
+        return low
+
+
+class Ema(_Rolling):
+    """Exponential moving average, with a weight alpha for every new value, alpha=2/(span+1) or, for values
+    that do not come at a fixed pace, a weight that halves every halfLife seconds between values"""
+
+    def __init__(self, alpha=None, span=None, halfLife=None):
+        _Rolling.__init__(self)
+        if sum(option is not None for option in (alpha, span, halfLife)) != 1:
+            raise ValueError("give one of alpha, span or halfLife")
+        if span is not None:
+            alpha = 2.0 / (span + 1)
+        if alpha is not None and not 0 < alpha <= 1:
+            raise ValueError("alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.halfLife = halfLife
+        self.count = 0
+        self.__value = None
+        self.__last = None  # timestamp of the last value
+
+    def __len__(self):
+        return self.count
+
+    def push(self, timestamp, value):
+        "adds a value taken at timestamp (time.monotonic_ns())"
+        with self.lock:
+            if self.__value is None:
+                self.__value = float(value)
+            else:
+                alpha = self.alpha
+                if alpha is None:
+                    alpha = 1.0 - 0.5 ** (max(timestamp - self.__last, 0) / (self.halfLife * 1e9))
+                self.__value += alpha * (value - self.__value)
+            self.__last = timestamp
+            self.count += 1
+
+    @property
+    def value(self):
+        "the average, None before the first value"
+        return self.__value
+
+
+# names of the aggregates for NeuroSkyPy.rolling() and rolling()
+AGGREGATES = {
+    'mean': RollingMean,
+    'ema': Ema,
+    'min': RollingMin,
+    'max': RollingMax,
+    'variance': RollingVariance,
+    'std': RollingStd,
+    'percentile': RollingPercentile,
+}
+
+
+def rolling(aggregate, **options):
+    '''
+    Creates a rolling aggregate by its name
+    :param aggregate: mean, ema, min, max, variance, std or percentile
+    :param options: the arguments of its class, i.e. window=512 or seconds=1.0, q for percentile, span for ema
+    :return: the aggregate, not attached to a headset
+    '''
+    if aggregate not in AGGREGATES:
+        raise ValueError("aggregate must be one of %s" % ", ".join(AGGREGATES))
+    return AGGREGATES[aggregate](**options)
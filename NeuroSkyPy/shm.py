@@ -0,0 +1,225 @@
+import os
+import time
+
+import numpy as np
+
+from .dispatch import SYNC
+from .parser import FIELD_DTYPES, FIELDS, Sample
+
+MAGIC = 0x4e53505952494e47  # "NSPYRING"
+# header of the shared memory: magic, capacity, record size and records written, as uint64
+HEADER = 4
+_WRITTEN = 3
+# one record per packet: its sequence number (1 for the first one), arrival time, bit i of present set when
+# FIELDS[i] was in the packet, and the values (0 for the absent ones)
+RECORD_DTYPE = np.dtype([('seq', '<u8'), ('timestamp', '<i8'), ('present', '<u2')] +
+                        [(name, '<' + dtype) for name, dtype in FIELD_DTYPES.items()])
+BITS = dict((name, 1 << i) for i, name in enumerate(FIELDS))
+_POSITIONS = dict((name, i) for i, name in enumerate(FIELDS))
+
+
+_published = set()  # names of the blocks created in this process, registered by their publisher
+
+
+def _shared_memory(name=None, size=0):
+    "creates (size) or attaches (name) a block of shared memory, readers do not take its ownership"
+    from multiprocessing import shared_memory  # Python 3.8+
+    if size:
+        memory = shared_memory.SharedMemory(name, create=True, size=size)
+        _published.add(memory.name)
+        return memory
+    try:
+        return shared_memory.SharedMemory(name, track=False)  # Python 3.13+
+    except TypeError:
+        pass
+    # before 3.13 attaching registers the block in the resource tracker, which would remove it when this process
+    # ends, so the registration is withdrawn, unless the block was created in this process (or the one it was
+    # forked from) and the registration, one per name in the tracker, is the publisher's. A reader spawned by
+    # the publisher's process shares its tracker and withdraws it too: the publisher registers again to unlink
+    memory = shared_memory.SharedMemory(name)
+    if os.name == 'posix' and memory.name not in _published:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+def column(records, name):
+    '''
+    Values of a variable in the records read from a SharedRingReader
+    :param records: structured array of RECORD_DTYPE
+    :param name: name of the variable
+    :return: (timestamps, values) of the records that have it
+    '''
+    present = (records['present'] & BITS[name]) != 0
+    return records['timestamp'][present], records[name][present]
+
+
+def samples(records):
+    '''
+    Converts records read from a SharedRingReader to Samples
+    :param records: structured array of RECORD_DTYPE
+    :return: list of Sample
+    '''
+    result = []
+    for record in records.tolist():
+        sample = Sample(record[1])
+        present = record[2]
+        for i, name in enumerate(FIELDS):
+            if present & (1 << i):
+                setattr(sample, name, record[3 + i])
+                sample.names.append(name)
+        result.append(sample)
+    return result
+
+
+class SharedRingPublisher(object):
+    """Publishes the decoded packets in a ring of fixed size records in shared memory, for other processes.
+    i.e.
+        publisher=SharedRingPublisher(capacity=65536)
+        publisher.attach(headset)  # or publisher.publish(sample) from the parser thread
+        print(publisher.name)  # readers attach with SharedRingReader(name)
+    There is a single writer and no lock: every slot carries the sequence number of its record, written after
+    the values, and the header the number of records written, so the readers check what they copied and
+    detect when the writer has lapped them. Any number of readers can follow the ring at their own pace.
+    Needs Python 3.8 or later (multiprocessing.shared_memory)."""
+
+    def __init__(self, capacity=65536, name=None):
+        self.capacity = capacity
+        self.__memory = _shared_memory(name, HEADER * 8 + capacity * RECORD_DTYPE.itemsize)
+        self.name = self.__memory.name
+        self.__header = np.ndarray(HEADER, '<u8', self.__memory.buf)
+        self.__slots = np.ndarray(capacity, RECORD_DTYPE, self.__memory.buf, HEADER * 8)
+        self.__slots['seq'] = 0
+        self.__header[:] = (MAGIC, capacity, RECORD_DTYPE.itemsize, 0)
+        self.written = 0
+        self.subscription = None
+        self.headset = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def attach(self, headset):
+        "publishes every packet of a NeuroSkyPy object, through a subscription to its 'packet' variable"
+        self.detach()
+        self.headset = headset
+        self.subscription = headset.subscribe("packet", self.publish, policy=SYNC)
+
+    def detach(self):
+        "stops publishing the packets of the NeuroSkyPy object attached"
+        if self.subscription is not None:
+            self.headset.unsubscribe(self.subscription)
+            self.subscription = self.headset = None
+
+    def publish(self, sample):
+        "writes the record of a Sample in the next slot"
+        present = 0
+        values = [0] * len(FIELDS)
+        for name in sample.names:
+            i = _POSITIONS[name]
+            present |= 1 << i
+            values[i] = getattr(sample, name)
+        seq = self.written + 1
+        slot = (seq - 1) % self.capacity
+        slots = self.__slots
+        slots['seq'][slot] = 0  # being written, the readers that copy it now discard it
+        slots[slot] = tuple([0, sample.timestamp, present] + values)
+        slots['seq'][slot] = seq
+        self.written = seq
+        self.__header[_WRITTEN] = seq
+
+    def close(self):
+        "detaches and removes the shared memory, the readers attached keep their mapping until they close"
+        self.detach()
+        self.__header = self.__slots = None
+        self.__memory.close()
+        if os.name == 'posix':
+            # unlink() withdraws the registration, which a reader sharing the resource tracker may have withdrawn
+            from multiprocessing import resource_tracker
+            resource_tracker.register(self.__memory._name, 'shared_memory')
+        self.__memory.unlink()
+
+
+class SharedRingReader(object):
+    """Follows the ring of a SharedRingPublisher from another process.
+    i.e.
+        reader=SharedRingReader(name)
+        records = reader.read(timeout=0.1)  # structured array of RECORD_DTYPE, a copy
+        times, raw = column(records, "rawValue")
+    The reader starts with the records published from now on, or with the oldest still in the ring with
+    oldest=True. When it falls more than capacity records behind the writer the records overwritten are
+    lost: lost counts them and laps the times it happened."""
+
+    def __init__(self, name, oldest=False):
+        self.name = name
+        self.__memory = _shared_memory(name)
+        header = np.ndarray(HEADER, '<u8', self.__memory.buf)
+        if header[0] != MAGIC or header[2] != RECORD_DTYPE.itemsize:
+            self.__memory.close()
+            raise ValueError("%s is not a ring of NeuroSkyPy records" % name)
+        self.capacity = int(header[1])
+        self.__header = header
+        self.__slots = np.ndarray(self.capacity, RECORD_DTYPE, self.__memory.buf, HEADER * 8)
+        written = int(header[_WRITTEN])
+        self.next = max(written - self.capacity, 0) if oldest else written  # sequence number - 1 of the next record
+        self.lost = 0
+        self.laps = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def available(self):
+        "records published and not read yet, lost ones included"
+        return int(self.__header[_WRITTEN]) - self.next
+
+    def read(self, maxRecords=None, timeout=0.0, interval=0.001):
+        "returns a copy of the records published since the last read, waiting up to timeout seconds for one"
+        deadline = time.monotonic() + timeout
+        written = int(self.__header[_WRITTEN])
+        while written == self.next and time.monotonic() < deadline:
+            time.sleep(interval)
+            written = int(self.__header[_WRITTEN])
+        if written - self.next > self.capacity:
+            self.__lapped(written - self.capacity)
+        count = written - self.next
+        if maxRecords is not None:
+            count = min(count, maxRecords)
+        if count <= 0:
+            return np.zeros(0, RECORD_DTYPE)
+        first = self.next % self.capacity
+        records = self.__copy(self.__slots, first, count)
+        # seqlock: a record is valid when its sequence number is the expected one in the copy and still is after
+        # it, the writer sets it to 0 before writing the values of a slot and to the new number after them
+        expected = np.arange(self.next + 1, self.next + count + 1, dtype=np.uint64)
+        after = self.__copy(self.__slots['seq'], first, count)
+        torn = np.flatnonzero((records['seq'] != expected) | (after != expected))
+        if len(torn):
+            records = records[:torn[0]]
+            self.next += len(records)
+            # the slot of the first torn record was overwritten, with the next record of the writer at the latest
+            self.__lapped(int(self.__header[_WRITTEN]) + 1 - self.capacity)
+            return records
+        self.next += count
+        return records
+
+    def __copy(self, array, first, count):
+        "copy of count items of a ring array from index first"
+        if first + count <= self.capacity:
+            return array[first:first + count].copy()
+        return np.concatenate((array[first:], array[:first + count - self.capacity]))
+
+    def __lapped(self, restart):
+        "the writer overwrote the records before restart, the reading goes on from there"
+        if restart > self.next:
+            self.laps += 1
+            self.lost += restart - self.next
+            self.next = restart
+
+    def close(self):
+        self.__header = self.__slots = None
+        self.__memory.close()
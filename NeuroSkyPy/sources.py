@@ -0,0 +1,212 @@
+"""Byte sources the reader thread can run on instead of a real headset.
+
+Anything with read(size), in_waiting and close() can be given to NeuroSkyPy.start(source=...):
+    serial_source(port, baudRate)  the real headset, a pyserial port
+    VirtualMindWave()              a pty that behaves like a MindWave, open its .port as a serial port (POSIX)
+    ReplaySource(capture)          a recorded byte stream, paced in real time or as fast as possible
+PacketGenerator builds the ThinkGear packets, optionally corrupted, of VirtualMindWave and of synthetic captures.
+"""
+import math
+import os
+import random
+import threading
+import time
+
+import serial
+
+from .parser import BAND_NAMES
+
+# bytes per second a MindWave sends: 512 raw packets of 8 bytes and one eSense/ASIC_EEG_POWER packet of 36
+NOMINAL_BYTE_RATE = 512 * 8 + 36
+
+
+def make_packet(payload):
+    "wraps a payload in a ThinkGear packet: sync, length, payload and checksum"
+    payload = bytes(payload)
+    return b'\xaa\xaa' + bytes([len(payload)]) + payload + bytes([(~sum(payload)) & 0xFF])
+
+
+def serial_source(port, baudRate=57600, timeout=0.5):
+    "the real headset, timeout bounds every read so the reader thread can stop"
+    return serial.Serial(port, baudRate, timeout=timeout)
+
+
+class PacketGenerator(object):
+    """Generates the packets of a MindWave: raw values at rawRate and eSense/ASIC_EEG_POWER at esenseRate,
+    i.e. PacketGenerator().packets(60) is one minute of output.
+    The raw signal is a 10 Hz alpha wave plus noise, attention and meditation are random walks.
+    Corruption is injected with the probabilities given per packet:
+        badChecksum the checksum is wrong
+        truncated   the packet is cut at a random byte and the next one follows
+        lostSync    random bytes are inserted before the packet
+    injected counts the packets of each kind generated so far."""
+
+    def __init__(self, rawRate=512, esenseRate=1, badChecksum=0.0, truncated=0.0, lostSync=0.0, seed=None):
+        self.rawRate = rawRate
+        self.esenseRate = esenseRate
+        self.badChecksum = badChecksum
+        self.truncated = truncated
+        self.lostSync = lostSync
+        self.random = random.Random(seed)
+        self.injected = dict.fromkeys(('packets', 'badChecksum', 'truncated', 'lostSync'), 0)
+        self.__clock = 0.0  # seconds generated
+        self.__raw = 0  # raw samples generated
+        self.__esense = 0
+        self.__attention = 50
+        self.__meditation = 50
+
+    def rawPacket(self):
+        t = self.__raw / float(self.rawRate)
+        self.__raw += 1
+        value = int(400 * math.sin(2 * math.pi * 10 * t) + self.random.gauss(0, 150))
+        value = max(-2048, min(2047, value))
+        return self.__wrap(b'\x80\x02' + value.to_bytes(2, 'big', signed=True))
+
+    def esensePacket(self):
+        self.__esense += 1
+        rnd = self.random
+        self.__attention = max(1, min(100, self.__attention + rnd.randint(-5, 5)))
+        self.__meditation = max(1, min(100, self.__meditation + rnd.randint(-5, 5)))
+        bands = b''.join(rnd.randint(0, 0xFFFFFF >> (2 * i)).to_bytes(3, 'big') for i in range(len(BAND_NAMES)))
+        return self.__wrap(bytes([0x02, 0, 0x83, 24]) + bands + bytes([0x04, self.__attention, 0x05, self.__meditation]))
+
+    def blinkPacket(self, strength=None):
+        return self.__wrap(bytes([0x16, self.random.randint(1, 255) if strength is None else strength]))
+
+    def __wrap(self, payload):
+        packet = make_packet(payload)
+        rnd = self.random
+        self.injected['packets'] += 1
+        if self.badChecksum and rnd.random() < self.badChecksum:
+            packet = packet[:-1] + bytes([packet[-1] ^ 0xFF])
+            self.injected['badChecksum'] += 1
+        if self.truncated and rnd.random() < self.truncated:
+            packet = packet[:rnd.randrange(1, len(packet))]
+            self.injected['truncated'] += 1
+        if self.lostSync and rnd.random() < self.lostSync:
+            packet = bytes(rnd.randrange(256) for _ in range(rnd.randint(1, 16))) + packet
+            self.injected['lostSync'] += 1
+        return packet
+
+    def packets(self, seconds):
+        "bytes of the packets sent during the next seconds, in the order the headset sends them"
+        self.__clock += seconds
+        rawDue = int(self.__clock * self.rawRate + 1e-9)
+        esenseDue = int(self.__clock * self.esenseRate + 1e-9)
+        out = bytearray()
+        while self.__raw < rawDue or self.__esense < esenseDue:
+            # raw sample i is taken at i/rawRate, eSense packet k is sent at (k+1)/esenseRate
+            if self.__raw < rawDue and (self.__esense >= esenseDue or
+                                        self.__raw * self.esenseRate <= (self.__esense + 1) * self.rawRate):
+                out += self.rawPacket()
+            else:
+                out += self.esensePacket()
+        return bytes(out)
+
+
+class VirtualMindWave(object):
+    """A pseudo terminal fed by a PacketGenerator in real time, it looks like the serial port of a MindWave.
+    i.e.
+        with VirtualMindWave(badChecksum=0.01) as device:
+            headset=NeuroSkyPy(device.port)
+            headset.start()
+    The packets are written every interval seconds, like the bursts of a USB serial adapter. POSIX only."""
+
+    def __init__(self, rawRate=512, esenseRate=1, interval=1 / 64.0, badChecksum=0.0, truncated=0.0,
+                 lostSync=0.0, seed=None):
+        import tty  # POSIX only
+        self.generator = PacketGenerator(rawRate, esenseRate, badChecksum, truncated, lostSync, seed)
+        self.interval = interval
+        self.__master, self.__slave = os.openpty()
+        tty.setraw(self.__slave)
+        self.port = os.ttyname(self.__slave)
+        self.__thread = None
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        "starts sending packets"
+        self.running = True
+        self.__thread = threading.Thread(target=self.__send, daemon=True)
+        self.__thread.start()
+
+    def __send(self):
+        start = time.monotonic()
+        ticks = 0
+        while self.running:
+            ticks += 1
+            os.write(self.__master, self.generator.packets(self.interval))
+            time.sleep(max(0.0, start + ticks * self.interval - time.monotonic()))
+
+    def stop(self):
+        "stops sending packets"
+        self.running = False
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.__master)
+        os.close(self.__slave)
+
+
+class ReplaySource(object):
+    """Replays a recorded byte stream (path or bytes) with the interface of a serial port.
+    With realtime the bytes are released at bytesPerSecond times speed, like the headset sent them,
+    otherwise every read returns what was asked for. exhausted is True once everything was read."""
+
+    def __init__(self, capture, realtime=True, speed=1.0, bytesPerSecond=NOMINAL_BYTE_RATE, timeout=0.5):
+        if not isinstance(capture, (bytes, bytearray, memoryview)):
+            with open(capture, 'rb') as f:
+                capture = f.read()
+        self.__data = memoryview(bytes(capture))
+        self.__position = 0
+        self.realtime = realtime
+        self.rate = bytesPerSecond * speed
+        self.timeout = timeout
+        self.__start = None
+
+    @property
+    def exhausted(self):
+        return self.__position >= len(self.__data)
+
+    def __available(self):
+        "bytes released so far and not read"
+        if not self.realtime:
+            return len(self.__data) - self.__position
+        if self.__start is None:
+            self.__start = time.monotonic()
+        released = int((time.monotonic() - self.__start) * self.rate)
+        return min(released, len(self.__data)) - self.__position
+
+    @property
+    def in_waiting(self):
+        return max(0, self.__available())
+
+    def read(self, size=1):
+        "returns up to size bytes, waiting up to timeout for the first one like a serial port"
+        deadline = time.monotonic() + self.timeout
+        available = self.__available()
+        while available <= 0 and not self.exhausted:
+            wait = min(deadline - time.monotonic(), (1 - available) / self.rate)
+            if wait <= 0:
+                return b''
+            time.sleep(wait)
+            available = self.__available()
+        if available <= 0:
+            time.sleep(self.timeout)  # nothing left, behave like a silent port
+            return b''
+        size = min(size, available)
+        data = self.__data[self.__position:self.__position + size].tobytes()
+        self.__position += size
+        return data
+
+    def close(self):
+        self.__position = len(self.__data)
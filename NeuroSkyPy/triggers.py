@@ -0,0 +1,317 @@
+"""Capture of the data around events: blinks, thresholds crossed by a variable or external markers.
+
+TriggerEngine keeps the last seconds of the channels of a headset in ring buffers (the pre-trigger buffer) and
+evaluates its conditions on every value as it arrives. When one fires, the epoch from `pre` seconds before to
+`post` seconds after it is cut from the buffers as soon as the post-trigger samples are in and handed to a sink:
+a function, a SessionRecorder (see EpochRecorder) or the list engine.epochs. Only the epochs are kept, instead of
+the whole session.
+"""
+import heapq
+import json
+import math
+import os
+import threading
+from time import monotonic_ns
+
+import numpy as np
+
+from .buffer import CHANNEL_RATES, RingBuffer
+from .dispatch import SYNC
+from .parser import FIELD_DTYPES
+
+# rows of the epochs table of EpochRecorder: trigger time, number of the epoch, index of its label in
+# triggers.json, value that fired it (NaN for markers) and first and last timestamps of its samples
+EPOCH_DTYPE = np.dtype([('timestamp', np.int64), ('epoch', np.uint32), ('label', np.uint16), ('value', np.float64),
+                        ('start', np.int64), ('end', np.int64)])
+LABELS = 'triggers.json'
+# seconds a marker can be given after the time it refers to, the buffers keep them on top of the epoch
+MARKER_DELAY = 2.0
+
+
+class Condition(object):
+    """Fires when predicate(timestamp, value) is true for a value of a variable.
+    offset moves the trigger from the arrival of the value, i.e. to the estimated time of the event"""
+
+    def __init__(self, variable, predicate=None, label=None, offset=0.0):
+        if variable not in FIELD_DTYPES:
+            raise ValueError("unknown variable %r" % variable)
+        self.variable = variable
+        self.predicate = predicate
+        self.label = label if label is not None else variable
+        self.offset = int(offset * 1e9)
+
+    def check(self, timestamp, value):
+        "returns True when the value fires the condition"
+        return bool(self.predicate(timestamp, value))
+
+
+class Threshold(Condition):
+    """Fires when a variable crosses level, upwards (rising=True) or downwards, and arms again once it has
+    gone back beyond level by hysteresis. A value already beyond level when it starts does not fire it.
+    i.e. Threshold("attention", 70, hysteresis=10)"""
+
+    def __init__(self, variable, level, rising=True, hysteresis=0.0, label=None, offset=0.0):
+        Condition.__init__(self, variable, None,
+                           label if label is not None else "%s%s%g" % (variable, '>' if rising else '<', level),
+                           offset)
+        self.level = level
+        self.rising = rising
+        self.hysteresis = hysteresis
+        self.armed = None  # unknown until the first value
+
+    def check(self, timestamp, value):
+        beyond = value >= self.level if self.rising else value <= self.level
+        if self.armed is None:
+            self.armed = not beyond
+            return False
+        if self.armed:
+            if beyond:
+                self.armed = False
+                return True
+        elif (value < self.level - self.hysteresis) if self.rising else (value > self.level + self.hysteresis):
+            self.armed = True
+        return False
+
+
+class Blink(Condition):
+    """Fires for every blink reported by the headset (blinkStrength) at least minStrength strong"""
+
+    def __init__(self, minStrength=0, label='blink', offset=0.0):
+        Condition.__init__(self, 'blinkStrength', None, label, offset)
+        self.minStrength = minStrength
+
+    def check(self, timestamp, value):
+        return value >= self.minStrength
+
+
+class Epoch(object):
+    """Data around a trigger: channels is a dict name -> (timestamps, values) arrays, contiguous copies.
+    The first channel, the raw signal by default, always has round(pre * rate) samples before the trigger and
+    round(post * rate) from it on, so the epochs of a session stack in one array; the others have the values
+    taken between time - pre and time + post."""
+    __slots__ = ('number', 'label', 'time', 'value', 'channels')
+
+    def __init__(self, number, label, time, value, channels):
+        self.number = number
+        self.label = label
+        self.time = time
+        self.value = value
+        self.channels = channels
+
+    @property
+    def times(self):
+        "timestamps of the first channel"
+        return next(iter(self.channels.values()))[0]
+
+    @property
+    def values(self):
+        "values of the first channel"
+        return next(iter(self.channels.values()))[1]
+
+
+class TriggerEngine(object):
+    """Cuts epochs of the channels of a headset around the triggers of its conditions.
+    i.e.
+        engine=TriggerEngine(pre=0.5, post=1.0, sink=recorder)  # a function, a SessionRecorder or None
+        engine.add(Blink(minStrength=60))
+        engine.add(Threshold("attention", 70, hysteresis=10))
+        engine.attach(headset)  # or engine.push(sample) from your own "packet" callback
+        engine.mark("stimulus")  # external marker, now or at a given timestamp
+    The conditions are evaluated on every value of their variable, in the parser thread, and so is the sink,
+    which must return quickly. A condition fires again at least holdoff seconds after its previous trigger.
+    An epoch is emitted once the first channel has its post-trigger samples; the epochs without enough samples
+    before the trigger (the first seconds) or after it (the headset stopped, see flush()) are only counted in
+    incomplete. Markers may come up to MARKER_DELAY seconds after their timestamp."""
+
+    def __init__(self, pre=0.5, post=1.0, channels=('rawValue',), holdoff=0.0, sink=None):
+        if pre < 0 or post <= 0:
+            raise ValueError("pre must be >= 0 and post > 0")
+        self.pre = pre
+        self.post = post
+        self.channels = tuple(channels)
+        self.holdoff = int(holdoff * 1e9)
+        rate = CHANNEL_RATES.get(self.channels[0], 1)
+        self.before = int(round(pre * rate))  # samples of the first channel before the trigger
+        self.after = int(round(post * rate))
+        self.__preNs = int(pre * 1e9)
+        self.__postNs = int(post * 1e9)
+        self.__buffers = [(name, RingBuffer(int(math.ceil((pre + post + MARKER_DELAY) * CHANNEL_RATES.get(name, 1)))
+                                            + 64, FIELD_DTYPES[name]))
+                          for name in self.channels]
+        self.__clock = self.__buffers[0][1]
+        self.__conditions = {}  # variable -> conditions
+        self.__last = {}  # condition -> time of its last trigger
+        self.__pending = []  # heap of (end, number, label, time, value)
+        self.__lock = threading.Lock()
+        self.sink = sink if sink is None or callable(sink) else EpochRecorder(sink, self.channels)
+        self.epochs = []  # the epochs, when there is no sink
+        self.subscription = None
+        self.headset = None
+        self.triggers = 0
+        self.emitted = 0
+        self.incomplete = 0
+
+    def add(self, condition):
+        "adds a Condition, returns it"
+        self.__conditions.setdefault(condition.variable, []).append(condition)
+        return condition
+
+    def remove(self, condition):
+        self.__conditions[condition.variable].remove(condition)
+
+    def attach(self, headset):
+        "follows every packet of a NeuroSkyPy object, next to its other callbacks"
+        self.detach()
+        self.headset = headset
+        self.subscription = headset.subscribe("packet", self.push, policy=SYNC)
+
+    def detach(self):
+        if self.subscription is not None:
+            self.headset.unsubscribe(self.subscription)
+            self.subscription = self.headset = None
+
+    def push(self, sample):
+        "stores the values of a Sample, evaluates the conditions and emits the epochs whose data is complete"
+        timestamp = sample.timestamp
+        for name, buffer in self.__buffers:
+            value = getattr(sample, name)
+            if value is not None:
+                buffer.append(timestamp, value)
+        conditions = self.__conditions
+        for name in sample.names:
+            if name in conditions:
+                value = getattr(sample, name)
+                for condition in conditions[name]:
+                    if condition.check(timestamp, value):
+                        self.__trigger(condition, condition.label, timestamp + condition.offset, value)
+        pending = self.__pending
+        if pending and self.__clock.count and pending[0][0] <= self.__clock.last()[0]:
+            self.__emitReady()
+
+    def mark(self, label, timestamp=None, value=None):
+        "adds a trigger from outside, i.e. a stimulus, at timestamp (time.monotonic_ns(), now by default)"
+        self.__trigger(None, label, monotonic_ns() if timestamp is None else timestamp, value)
+
+    def __trigger(self, condition, label, time, value):
+        with self.__lock:
+            if condition is not None and self.holdoff:
+                last = self.__last.get(condition)
+                if last is not None and time - last < self.holdoff:
+                    return
+                self.__last[condition] = time
+            self.triggers += 1
+            heapq.heappush(self.__pending, (time + self.__postNs, self.triggers, label, time, value))
+
+    def __emitReady(self):
+        "emits the pending epochs that end before the newest sample of the first channel"
+        newest = self.__clock.last()[0]
+        while True:
+            with self.__lock:
+                if not self.__pending or self.__pending[0][0] > newest:
+                    return
+                end, number, label, time, value = heapq.heappop(self.__pending)
+            epoch = self.__cut(number, label, time, value)
+            if epoch is None:
+                # samples lost after the trigger, retried until the buffer has them or they can no longer come
+                if newest - end < int(MARKER_DELAY * 1e9):
+                    with self.__lock:
+                        heapq.heappush(self.__pending, (end + int(0.1e9), number, label, time, value))
+                    return
+                self.incomplete += 1
+                continue
+            if epoch is not False:
+                self.__emit(epoch)
+
+    def __cut(self, number, label, time, value):
+        "the Epoch of a trigger, None while the samples after it are not in, False if those before it are gone"
+        channels = {}
+        name, buffer = self.__buffers[0]
+        times, values = buffer.latest()
+        first = int(np.searchsorted(times, time, side='left'))
+        if first + self.after > len(times):
+            return None
+        if first < self.before:
+            self.incomplete += 1
+            return False
+        channels[name] = (times[first - self.before:first + self.after].copy(),
+                          values[first - self.before:first + self.after].copy())
+        for name, buffer in self.__buffers[1:]:
+            times, values = buffer.window(time - self.__preNs, time + self.__postNs)
+            channels[name] = (times.copy(), values.copy())
+        return Epoch(number, label, time, value, channels)
+
+    def __emit(self, epoch):
+        self.emitted += 1
+        if self.sink is None:
+            self.epochs.append(epoch)
+        else:
+            self.sink(epoch)
+
+    def flush(self):
+        "emits the pending epochs that have their data, i.e. at the end of a session, counts the others"
+        with self.__lock:
+            pending, self.__pending = sorted(self.__pending), []
+        for end, number, label, time, value in pending:
+            epoch = self.__cut(number, label, time, value)
+            if epoch is None:
+                self.incomplete += 1
+            elif epoch is not False:
+                self.__emit(epoch)
+
+    def stats(self):
+        "returns a dict with the triggers, epochs emitted, incomplete and pending"
+        return {'triggers': self.triggers, 'emitted': self.emitted, 'incomplete': self.incomplete,
+                'pending': len(self.__pending)}
+
+    def stack(self, epochs=None):
+        '''
+        The values of the first channel of epochs in one array, one row per epoch
+        :param epochs: list of Epoch, engine.epochs by default
+        :return: (labels, 2d array of epochs x samples, times of the samples relative to the trigger in seconds)
+        '''
+        epochs = self.epochs if epochs is None else epochs
+        values = np.stack([epoch.values for epoch in epochs]) if epochs else \
+            np.zeros((0, self.before + self.after), FIELD_DTYPES[self.channels[0]])
+        rate = CHANNEL_RATES.get(self.channels[0], 1)
+        return [epoch.label for epoch in epochs], values, np.arange(-self.before, self.after) / float(rate)
+
+
+class EpochRecorder(object):
+    """Sink of a TriggerEngine that writes the epochs to a SessionRecorder.
+    The table 'epochs' gets a row per epoch (EPOCH_DTYPE) and 'epoch_<channel>' the samples of every channel
+    with the number of their epoch, the labels are listed in triggers.json of the session, their index is the
+    label column. Read them back with SessionReader, i.e. reader.read("epoch_rawValue")"""
+
+    def __init__(self, recorder, channels=('rawValue',)):
+        self.recorder = recorder
+        self.channels = tuple(channels)
+        self.labels = []
+        self.__path = os.path.join(recorder.directory, LABELS)
+        if os.path.exists(self.__path):  # a session resumed
+            with open(self.__path) as f:
+                self.labels = json.load(f)
+        recorder.addTable('epochs', EPOCH_DTYPE)
+        for name in self.channels:
+            recorder.addTable('epoch_' + name, [('timestamp', np.int64), ('epoch', np.uint32),
+                                                (name, FIELD_DTYPES[name])])
+
+    def __call__(self, epoch):
+        label = str(epoch.label)
+        if label not in self.labels:
+            self.labels.append(label)
+            with open(self.__path + '.tmp', 'w') as f:
+                json.dump(self.labels, f)
+            os.replace(self.__path + '.tmp', self.__path)
+        start = min(times[0] for times, values in epoch.channels.values() if len(times))
+        end = max(times[-1] for times, values in epoch.channels.values() if len(times))
+        value = float('nan') if epoch.value is None else epoch.value
+        self.recorder.append('epochs', (epoch.time, epoch.number, self.labels.index(label), value, start, end))
+        for name in self.channels:
+            times, values = epoch.channels[name]
+            if len(times):
+                rows = np.zeros(len(times), [('timestamp', np.int64), ('epoch', np.uint32),
+                                             (name, FIELD_DTYPES[name])])
+                rows['timestamp'] = times
+                rows['epoch'] = epoch.number
+                rows[name] = values
+                self.recorder.appendRows('epoch_' + name, rows)
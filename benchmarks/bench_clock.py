@@ -0,0 +1,73 @@
+"""Accuracy of the sample times reconstructed by NeuroSkyPy.clock.SampleClock on simulated bursty arrivals.
+
+Every headset samples at 512 Hz with its own clock error (drift in ppm). Its samples reach the host a minimum
+latency after they are taken, in reads every --burst milliseconds plus a random delay, and a few packets are
+lost. The error of a time is its distance to the true sample time plus the minimum latency, which is the same
+for every headset, so two headsets are aligned as well as their errors allow.
+
+Usage: python -m benchmarks.bench_clock [--minutes 10] [--burst 16] [--jitter 4] [--drift 40 -60]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from NeuroSkyPy.clock import SampleClock
+
+LATENCY_NS = 1000000  # smallest delay of the link
+
+
+def simulate(seconds, driftPpm, burstMs, jitterMs, loss, seed):
+    "returns (true sample times, arrivals, lost flags) of the samples received"
+    rng = np.random.default_rng(seed)
+    period = 1e9 / 512 * (1 + driftPpm * 1e-6)
+    start = int(rng.integers(0, 1e9))
+    count = int(seconds * 512)
+    true = (start + np.arange(count) * period).astype(np.int64)
+    # reads at a fixed pace plus a random delay, each one gets the samples that reached the host before it
+    reads = start + np.arange(0, seconds * 1e9 + 1e9, burstMs * 1e6) + rng.exponential(jitterMs * 1e6, size=1)[0]
+    reads = np.sort(reads + rng.exponential(jitterMs * 1e6, size=len(reads))).astype(np.int64)
+    arrivals = reads[np.searchsorted(reads, true + LATENCY_NS)]
+    kept = rng.random(count) >= loss
+    lost = np.zeros(count, dtype=bool)
+    lost[1:] = ~kept[:-1]  # the sample after a lost one
+    return true[kept], arrivals[kept], lost[kept]
+
+
+def report(name, errors):
+    errors = np.abs(errors) / 1e6
+    print("%-34s error ms: median %.3f  p99 %.3f  max %.3f" %
+          (name, np.median(errors), np.percentile(errors, 99), errors.max()))
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--minutes', type=float, default=10)
+    options.add_argument('--burst', type=float, default=16, help="milliseconds between reads")
+    options.add_argument('--jitter', type=float, default=4, help="mean random delay of a read in milliseconds")
+    options.add_argument('--loss', type=float, default=0.0005, help="probability of losing a packet")
+    options.add_argument('--drift', type=float, nargs='+', default=[40, -60], help="ppm of every headset")
+    args = options.parse_args()
+
+    seconds = args.minutes * 60
+    errors = []
+    for seed, drift in enumerate(args.drift):
+        true, arrivals, lost = simulate(seconds, drift, args.burst, args.jitter, args.loss, seed)
+        clock = SampleClock()
+        start = time.process_time()
+        times = clock.push(arrivals, lost)
+        cpu = time.process_time() - start
+        print("headset %d: drift %+.0f ppm, estimated %+.1f ppm, %d segments, %.2f us CPU per sample" %
+              (seed, drift, clock.driftPpm, clock.segments, 1e6 * cpu / len(times)))
+        report("  arrival time", arrivals - true - LATENCY_NS)
+        report("  reconstructed", times - true - LATENCY_NS)
+        # skip the first seconds of every segment, while the offset is still being fitted
+        errors.append(times - true - LATENCY_NS)
+    if len(errors) > 1:
+        worst = max(np.percentile(np.abs(error[512 * 10:]), 99) for error in errors) / 1e6
+        print("after 10 s, p99 error of every headset below %.3f ms: headsets aligned within %.3f ms" %
+              (worst, 2 * worst))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Time to export the figures of a long session.
+
+A synthetic session (raw values at 512 Hz, the other variables once per second) is exported with
+IO.export_session, then the raw signal alone is drawn with every point through pyplot, as plot_graphics does.
+
+Usage: python -m benchmarks.bench_export [--hours 2] [--processes N] [--full]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from NeuroSkyPy.IO import export_session
+from NeuroSkyPy.parser import FIELDS
+
+
+def synthetic_session(hours, seed=0):
+    "dict of variable -> (timestamps, values) like getTimeTaken returns after a session of hours"
+    rnd = np.random.default_rng(seed)
+    seconds = int(hours * 3600)
+    session = {}
+    for name in FIELDS:
+        rate = 512 if name == 'rawValue' else 1
+        times = np.arange(seconds * rate, dtype=np.int64) * (10 ** 9 // rate)
+        if name == 'rawValue':
+            values = (400 * np.sin(2 * np.pi * 10 * times / 1e9) + rnd.normal(0, 150, len(times))).astype(np.int16)
+        else:
+            values = rnd.integers(0, 100, len(times))
+        session[name] = (times, values)
+    return session
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--hours', type=float, default=2)
+    options.add_argument('--processes', type=int, default=None, help="size of the pool, one per cpu by default")
+    options.add_argument('--full', action='store_true', help="also draw the raw signal with every point")
+    args = options.parse_args()
+
+    session = synthetic_session(args.hours)
+    points = sum(len(values) for times, values in session.values())
+    folder = tempfile.mkdtemp()
+    config = {'name': 'bench', 'hour_exp': 'session', 'folder_exp': os.path.relpath(folder)}
+    try:
+        start = time.perf_counter()
+        images = export_session(session, config, processes=args.processes)
+        elapsed = time.perf_counter() - start
+        print("export_session: %d images of %d points in %.2f s (%d cpus)" %
+              (len(images), points, elapsed, os.cpu_count() or 1))
+
+        if args.full:
+            times, values = session['rawValue']
+            start = time.perf_counter()
+            plt.plot(times / 1e9, values, 'b')
+            plt.savefig(os.path.join(folder, "raw_full.png"))
+            plt.clf()
+            print("pyplot, every raw point: 1 image of %d points in %.2f s" % (len(values), time.perf_counter() - start))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Cost of the streaming band powers of BandPowerEngine for many headsets on one core.
+
+Every headset gets its own synthetic stream, parser and engine. The raw values are pushed in batches of 64,
+as the "batch" callback policy delivers them, and the CPU time is compared with the duration of the signal.
+
+Usage: python -m benchmarks.bench_features [--headsets 16] [--seconds 60] [--hop 128]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from NeuroSkyPy.features import BandPowerEngine
+from NeuroSkyPy.parser import ThinkGearParser
+from NeuroSkyPy.sources import PacketGenerator
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--headsets', type=int, default=16)
+    options.add_argument('--seconds', type=int, default=60, help="seconds of signal per headset")
+    options.add_argument('--hop', type=int, default=128, help="samples between two windows")
+    options.add_argument('--batch', type=int, default=64, help="raw values per push")
+    args = options.parse_args()
+
+    streams = [PacketGenerator(seed=seed).packets(args.seconds) for seed in range(args.headsets)]
+    rate = 512.0
+    budget = args.seconds  # seconds of signal of every headset, all of them arrive in that time
+
+    # band powers alone, on the raw values already extracted
+    raws = []
+    for stream in streams:
+        samples = ThinkGearParser().feed(stream, 0)
+        raws.append(np.array([sample.rawValue for sample in samples if sample.rawValue is not None]))
+    engines = [BandPowerEngine(hop=args.hop) for _ in streams]
+    timestamps = (np.arange(int(args.seconds * rate)) * (1e9 / rate)).astype(np.int64)
+    cpu = time.process_time()
+    windows = 0
+    for pos in range(0, len(timestamps), args.batch):
+        for engine, raw in zip(engines, raws):
+            windows += len(engine.push(timestamps[pos:pos + args.batch], raw[pos:pos + args.batch])[0])
+    cpu = time.process_time() - cpu
+    print("BandPowerEngine: %d headsets, %d windows, %.3f s CPU for %d s of signal: %.2f%% of one core" %
+          (args.headsets, windows, cpu, budget, 100 * cpu / budget))
+
+    # bytes to band powers: parser, raw values and engine, in chunks of 1/64 s per headset
+    parsers = [ThinkGearParser() for _ in streams]
+    engines = [BandPowerEngine(hop=args.hop) for _ in streams]
+    pending = [([], []) for _ in streams]
+    chunk = len(streams[0]) // (args.seconds * 64)
+    cpu = time.process_time()
+    windows = 0
+    for pos in range(0, len(streams[0]), chunk):
+        for stream, parser, engine, (times, values) in zip(streams, parsers, engines, pending):
+            for sample in parser.feed(stream[pos:pos + chunk]):
+                if sample.rawValue is not None:
+                    times.append(sample.timestamp)
+                    values.append(sample.rawValue)
+            if len(values) >= args.batch:
+                windows += len(engine.push(times, values)[0])
+                del times[:], values[:]
+    cpu = time.process_time() - cpu
+    print("parser + BandPowerEngine: %d headsets, %d windows, %.3f s CPU for %d s of signal: %.2f%% of one core" %
+          (args.headsets, windows, cpu, budget, 100 * cpu / budget))
+
+
+if __name__ == '__main__':
+    main()
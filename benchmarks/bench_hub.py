@@ -0,0 +1,81 @@
+"""Aggregate rate of NeuroSkyHub with many simulated headsets.
+
+Another process writes a synthetic MindWave stream to one pipe per headset, either as fast as the
+pipes accept it or paced in real time, while the hub reads all of them from a single thread.
+
+Usage: python -m benchmarks.bench_hub [--devices 16] [--seconds 60] [--realtime]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+
+from NeuroSkyPy.hub import NeuroSkyHub
+from benchmarks.bench_parser import synthetic_stream
+
+
+def writer(fds, stream, seconds, realtime):
+    "writes stream to every fd, one second of data per round"
+    second = len(stream) // seconds
+    start = time.perf_counter()
+    for rnd, pos in enumerate(range(0, len(stream), second)):
+        if realtime:
+            time.sleep(max(0.0, start + rnd - time.perf_counter()))
+        for fd in fds:
+            os.write(fd, stream[pos:pos + second])
+    for fd in fds:
+        os.close(fd)
+
+
+def run(devices, seconds, realtime=False):
+    "reads seconds of data of every headset with one hub, returns the aggregate rates and the stats of the hub"
+    stream = synthetic_stream(seconds)
+    hub = NeuroSkyHub()
+    pipes = [os.pipe() for _ in range(devices)]
+    for index, (rfd, wfd) in enumerate(pipes):
+        hub.register("headset%02d" % index, os.fdopen(rfd, 'rb', buffering=0))
+    process = multiprocessing.get_context('fork').Process(
+        target=writer, args=([wfd for rfd, wfd in pipes], stream, seconds, realtime))
+    process.start()
+    for rfd, wfd in pipes:
+        os.close(wfd)
+
+    expected = devices * seconds * 513  # 512 raw packets and an eSense one per second
+    packets = 0
+    cpu = time.process_time()
+    start = time.perf_counter()
+    while packets < expected and hub.connected():
+        packets += hub.poll(0.5)
+        hub.read()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    process.join()
+    stats = hub.stats()
+    hub.close()
+    return {
+        'devices': devices,
+        'packets': packets,
+        'seconds': elapsed,
+        'packetsPerSecond': packets / elapsed,
+        'megabytesPerSecond': sum(device['bytes'] for device in stats.values()) / elapsed / 1e6,
+        'cpuPercent': 100 * cpu / elapsed,
+    }, stats
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--devices', type=int, default=16)
+    options.add_argument('--seconds', type=int, default=60, help="seconds of data per headset")
+    options.add_argument('--realtime', action='store_true', help="pace the headsets at 512 packets/s")
+    args = options.parse_args()
+
+    result, stats = run(args.devices, args.seconds, args.realtime)
+    print("%d headsets, %d packets in %.2f s: %.0f packets/s, %.2f MB/s, hub CPU %.0f%%" %
+          (result['devices'], result['packets'], result['seconds'], result['packetsPerSecond'],
+           result['megabytesPerSecond'], result['cpuPercent']))
+    for name, device in sorted(stats.items()):
+        print("  %s %8d packets %9d bytes %6d reads" % (name, device['packets'], device['bytes'], device['reads']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Time and memory to import NeuroSkyPy, each case in a fresh interpreter.
+
+The package only imports the acquisition path (NeuroSkyPy, parser, buffers) with the standard library and
+pyserial, IO and the analysis modules are imported on first use. The last case imports what the package used to
+import, IO with matplotlib and numpy plus scikit-learn for its normalize, which is skipped when scikit-learn is
+not installed. Memory is the peak resident size of the interpreter (POSIX).
+
+Usage: python -m benchmarks.bench_import [--repeats 7]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CASES = [
+    ("import NeuroSkyPy", "import NeuroSkyPy"),
+    ("NeuroSkyPy('COM3') reading", "from NeuroSkyPy import NeuroSkyPy\nNeuroSkyPy('COM3')"),
+    ("import NeuroSkyPy.IO", "import NeuroSkyPy.IO"),
+    ("previous import (IO + scikit-learn)", "import NeuroSkyPy.IO\nimport sklearn.preprocessing"),
+]
+
+HEAVY = ('numpy', 'matplotlib', 'sklearn', 'scipy')
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+exec(compile(sys.argv[1], 'case', 'exec'))
+seconds = time.perf_counter() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+except ImportError:
+    rss = None
+print(json.dumps({'seconds': seconds, 'modules': len(sys.modules), 'rss': rss,
+                  'heavy': [name for name in %r if name in sys.modules]}))
+""" % (HEAVY,)
+
+
+def measure(code, repeats):
+    "median of the runs of code in fresh interpreters, None when it fails, i.e. a package is missing"
+    runs = []
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    for _ in range(repeats):
+        done = subprocess.run([sys.executable, '-c', PROBE, code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              env=env, universal_newlines=True)
+        if done.returncode:
+            return None
+        runs.append(json.loads(done.stdout))
+    rss = [run['rss'] for run in runs if run['rss']]
+    return {'seconds': statistics.median(run['seconds'] for run in runs), 'modules': runs[-1]['modules'],
+            'rss': statistics.median(rss) if rss else None, 'heavy': runs[-1]['heavy']}
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--repeats', type=int, default=7)
+    args = options.parse_args()
+
+    # one run first so that every case finds the files in the page cache and the bytecode compiled
+    measure("import NeuroSkyPy.IO", 1)
+    results = []
+    for name, code in CASES:
+        result = measure(code, args.repeats)
+        if result is None:
+            print("%-38s skipped, it failed to import" % name)
+            continue
+        results.append((name, result))
+        print("%-38s %7.1f ms  %4d modules  %s  loads: %s" %
+              (name, 1e3 * result['seconds'], result['modules'],
+               "%6.1f MB RSS" % (result['rss'] / 2 ** 20) if result['rss'] else "RSS n/a",
+               ", ".join(result['heavy']) or "standard library and pyserial only"))
+    if len(results) > 1:
+        first, last = results[0][1], results[-1][1]
+        print("import NeuroSkyPy is %.1fx faster than %s" % (last['seconds'] / first['seconds'], results[-1][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Cost of the reader metrics of NeuroSkyPy (metrics=True, the default) against metrics=False.
+
+A synthetic stream is fed to NeuroSkyPy.feed in reads of a given size, as the reader thread does, by two headsets
+with and without metrics, block by block. The fastest run of every block is compared: the metrics cost a countdown per
+read and the timing of one read in 64, so the worst case is one packet per read (8 bytes), the usual one at
+57600 baud. The machine must be otherwise idle, the difference is a few percent of a few seconds.
+
+Usage: python -m benchmarks.bench_metrics [--seconds 20] [--repeats 15] [--reads 8 64 512]
+"""
+import argparse
+import time
+
+from NeuroSkyPy import NeuroSkyPy
+from NeuroSkyPy.sources import PacketGenerator
+
+
+def run(stream, size, repeats, blockBytes=4096):
+    """CPU seconds to feed the stream in reads of size bytes, (without metrics, with metrics).
+    Both headsets are fed every block of the stream one after the other, in alternate order, and the fastest
+    of the repeats is kept per block, so that the changes of speed of the machine affect both the same"""
+    view = memoryview(stream)
+    blockBytes = max(blockBytes // size, 1) * size
+    blocks = range(0, len(stream), blockBytes)
+    best = [[float('inf')] * len(blocks), [float('inf')] * len(blocks)]
+    for _ in range(repeats):
+        headsets = [NeuroSkyPy("bench", bufferSeconds=60, metrics=metrics) for metrics in (False, True)]
+        for block, first in enumerate(blocks):
+            last = min(first + blockBytes, len(stream))
+            for i in ((0, 1) if block % 2 else (1, 0)):
+                feed = headsets[i].feed
+                start = time.process_time()
+                for pos in range(first, last, size):
+                    feed(view[pos:pos + size])
+                best[i][block] = min(best[i][block], time.process_time() - start)
+    return sum(best[0]), sum(best[1])
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--seconds', type=int, default=20, help="seconds of headset output")
+    options.add_argument('--repeats', type=int, default=15)
+    options.add_argument('--reads', type=int, nargs='+', default=[8, 64, 512], help="bytes per read")
+    args = options.parse_args()
+
+    stream = PacketGenerator(seed=0).packets(args.seconds)
+    for size in args.reads:
+        plain, measured = run(stream, size, args.repeats)
+        print("reads of %4d B: without metrics %.3f s, with metrics %.3f s CPU, overhead %+.2f%%" %
+              (size, plain, measured, 100 * (measured - plain) / plain))
+
+
+if __name__ == '__main__':
+    main()
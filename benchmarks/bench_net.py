@@ -0,0 +1,114 @@
+"""Loopback load of NeuroSkyPy.net.StreamServer: one acquisition process serving many TCP clients.
+
+A NeuroSkyPy object is fed a synthetic stream at --speed times real time from a thread, as its reader thread
+would, and a StreamServer publishes it on localhost. Another process opens --clients StreamClient connections,
+half of them at full rate and half with --decimate, and counts the raw samples every one receives. Every client
+should get all the samples of its rate but those of its last frame, never completed, and the frames dropped are
+those of clients that fell behind. The CPU of the acquisition process is measured without server first, the
+difference is the cost of the server.
+
+Usage: python -m benchmarks.bench_net [--clients 32] [--seconds 10] [--speed 1] [--decimate 8]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import time
+
+from NeuroSkyPy import NeuroSkyPy
+from NeuroSkyPy.net import RAW, StreamClient, StreamServer
+from NeuroSkyPy.sources import PacketGenerator
+
+
+def feed(headset, stream, seconds, speed):
+    "feeds the stream in reads of 1/64 s of data at speed times real time, returns the seconds it took"
+    chunk = len(stream) // int(seconds * 64)
+    start = time.perf_counter()
+    for i, pos in enumerate(range(0, len(stream), chunk)):
+        headset.feed(stream[pos:pos + chunk])
+        delay = start + (i + 1) / (64.0 * speed) - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return time.perf_counter() - start
+
+
+async def _clients(port, clients, decimate, ready):
+    counts = []
+
+    async def client(rate):
+        samples = 0
+        async with StreamClient(port=port) as connection:
+            await connection.subscribe(channels=["rawValue"], decimate=rate)
+            ready.release()
+            while True:
+                frame = await connection.read()
+                if frame is None:
+                    break
+                if frame[0] == RAW:
+                    samples += frame[2]
+        counts.append((rate, samples))
+
+    await asyncio.gather(*[client(1 if i % 2 == 0 else decimate) for i in range(clients)])
+    return counts
+
+
+def run_clients(port, clients, decimate, ready, results):
+    "child process: the clients, until the server closes, puts (rate, samples) of every one and its CPU seconds"
+    start = time.process_time()
+    counts = asyncio.run(_clients(port, clients, decimate, ready))
+    results.put((counts, time.process_time() - start))
+
+
+def measure(headset, stream, seconds, speed):
+    "CPU seconds of this process and wall seconds to feed the stream"
+    cpu = time.process_time()
+    wall = feed(headset, stream, seconds, speed)
+    return time.process_time() - cpu, wall
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--clients', type=int, default=32)
+    options.add_argument('--seconds', type=float, default=10, help="seconds of headset output")
+    options.add_argument('--speed', type=float, default=1, help="times real time")
+    options.add_argument('--decimate', type=int, default=8, help="decimation of half of the clients")
+    args = options.parse_args()
+
+    stream = PacketGenerator(seed=0).packets(int(args.seconds))
+    headset = NeuroSkyPy("bench", bufferSeconds=60)
+    idle, wall = measure(headset, stream, args.seconds, args.speed)
+    print("without server: %.1f%% CPU to read %.0f s of data in %.1f s" % (100 * idle / wall, args.seconds, wall))
+
+    server = StreamServer({"bench": headset}, port=0)
+    server.startThread()
+    context = multiprocessing.get_context('spawn')
+    ready = context.Semaphore(0)
+    results = context.Queue()
+    child = context.Process(target=run_clients,
+                            args=(server.port, args.clients, args.decimate, ready, results))
+    child.start()
+    for _ in range(args.clients):
+        ready.acquire()
+    time.sleep(0.2)  # the last subscriptions reach the server
+    busy, wall = measure(headset, stream, args.seconds, args.speed)
+    time.sleep(0.5)  # the frames in flight
+    stats = server.stats()
+    server.close()
+    counts, clientCpu = results.get()
+    child.join()
+
+    print("with %d clients: %.1f%% CPU (server %+.1f%%), %.1f MB/s sent, %d frames dropped" %
+          (args.clients, 100 * busy / wall, 100 * (busy - idle) / wall, stats['bytes'] / wall / 1e6,
+           stats['dropped']))
+    raw = 512 * args.seconds
+    for rate in sorted(set(rate for rate, samples in counts)):
+        received = [samples for r, samples in counts if r == rate]
+        expected = raw // rate
+        print("  decimate %-3d %2d clients: samples received min %d, median %d of %d (%.2f%%)" %
+              (rate, len(received), min(received), statistics.median(received), expected,
+               100.0 * min(received) / expected))
+    print("clients process: %.1f%% CPU" % (100 * clientCpu / wall))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Offline decoding of recorded captures.
+
+Decodes captures with the vectorized decoder and with the streaming parser, checks that both
+outputs are identical and reports the speed of each. Without captures a synthetic stream,
+with some corrupted bytes, is used.
+
+Usage: python -m benchmarks.bench_offline [--minutes N] [capture.bin ...]
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+
+from NeuroSkyPy.offline import collect_packets, decode_capture, load_capture
+from NeuroSkyPy.parser import ThinkGearParser
+from benchmarks.bench_parser import synthetic_stream
+
+
+def corrupt(stream, ratio=1e-4, seed=0):
+    "flips random bytes so that checksums fail, lengths break and syncs appear or vanish"
+    rnd = random.Random(seed)
+    out = bytearray(stream)
+    for _ in range(int(len(out) * ratio)):
+        out[rnd.randrange(len(out))] = rnd.choice((0xAA, 0x00, rnd.randrange(256)))
+    return bytes(out)
+
+
+def compare(name, source):
+    data = load_capture(source)
+    start = time.perf_counter()
+    offline = decode_capture(data)
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    streaming = collect_packets(ThinkGearParser().feed(data.tobytes()))
+    parsed = time.perf_counter() - start
+
+    for field, (index, values) in streaming.items():
+        assert np.array_equal(index, offline[field][0]), field
+        assert np.array_equal(values, offline[field][1]), field
+        assert values.dtype == offline[field][1].dtype, field
+    packets = max(len(index) and index[-1] + 1 for index, values in offline.values())
+    print("%-20s %10d bytes %9d packets  streaming %7.3f s  vectorized %7.3f s  x%.1f" %
+          (name, len(data), packets, parsed, vectorized, parsed / vectorized))
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--minutes', type=int, default=10, help="length of the synthetic stream")
+    options.add_argument('captures', nargs='*')
+    args = options.parse_args()
+    for path in args.captures:
+        compare(path, path)
+    if not args.captures:
+        stream = synthetic_stream(args.minutes * 60)
+        compare("synthetic", stream)
+        compare("synthetic corrupted", corrupt(stream))
+
+
+if __name__ == '__main__':
+    main()
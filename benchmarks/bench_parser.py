@@ -0,0 +1,153 @@
+"""Throughput of the ThinkGear parser.
+
+Replays captured byte streams (raw serial dumps) through an OS pipe, read by the per-byte loop the library
+used to run and by the chunked loop on top of ThinkGearParser, then measures the parser alone on in-memory chunks.
+Without captures a synthetic stream of one minute of MindWave output is used.
+
+Usage: python -m benchmarks.bench_parser [capture.bin ...]
+"""
+import fcntl
+import os
+import struct
+import sys
+import termios
+import threading
+import time
+
+from NeuroSkyPy.parser import ThinkGearParser
+from NeuroSkyPy.sources import PacketGenerator
+
+
+def synthetic_stream(seconds=60, seed=0):
+    "seconds of MindWave output: 512 raw packets and one eSense/ASIC_EEG_POWER packet per second"
+    return PacketGenerator(seed=seed).packets(seconds)
+
+
+class PipeSerial(object):
+    "replays a stream through an OS pipe so that every read is a real syscall, like a serial port"
+
+    def __init__(self, stream):
+        rfd, wfd = os.pipe()
+        self.__file = os.fdopen(rfd, 'rb', buffering=0)
+        self.__writer = threading.Thread(target=self.__write, args=(wfd, stream), daemon=True)
+        self.__writer.start()
+
+    @staticmethod
+    def __write(wfd, stream):
+        with os.fdopen(wfd, 'wb', buffering=0) as out:
+            out.write(stream)
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.__file, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        return self.__file.read(size)
+
+    def close(self):
+        self.__writer.join()
+        self.__file.close()
+
+
+def legacy_parse(srl):
+    "the hex-string, one read per byte loop that __packetParser used to run"
+    packets = 0
+    while True:
+        p1 = srl.read(1).hex()
+        p2 = srl.read(1).hex()
+        while p1 != 'aa' or p2 != 'aa':
+            if not p2:
+                return packets
+            p1 = p2
+            p2 = srl.read(1).hex()
+        length = srl.read(1).hex()
+        if not length:
+            return packets
+        payload = []
+        checksum = 0
+        payloadLength = int(length, 16)
+        for i in range(payloadLength):
+            temp = srl.read(1).hex()
+            payload.append(temp)
+            checksum += int(temp, 16)
+        checksum = ~checksum & 0x000000ff
+        last = srl.read(1).hex()
+        if not last:
+            return packets
+        if checksum == int(last, 16):
+            packets += 1
+            values = {}
+            i = 0
+            while i < payloadLength:
+                code = payload[i]
+                if code in ('02', '04', '05', '16'):
+                    i = i + 1; values[code] = int(payload[i], 16)
+                elif code == '80':
+                    i = i + 2; val0 = int(payload[i], 16)
+                    i = i + 1; values[code] = val0 * 256 + int(payload[i], 16)
+                elif code == '83':
+                    i = i + 1
+                    for band in range(8):
+                        i = i + 1; val0 = int(payload[i], 16)
+                        i = i + 1; val1 = int(payload[i], 16)
+                        i = i + 1; values[band] = val0 * 65536 + val1 * 256 + int(payload[i], 16)
+                i = i + 1
+
+
+def chunked_parse(srl):
+    "the loop __packetParser runs now"
+    parser = ThinkGearParser()
+    packets = 0
+    while True:
+        data = srl.read(srl.in_waiting or 1)
+        if not data:
+            return packets
+        packets += len(parser.feed(data))
+
+
+def memory_parse(stream, chunk):
+    "parser cost alone, without reads"
+    parser = ThinkGearParser()
+    view = memoryview(stream)
+    packets = 0
+    for pos in range(0, len(stream), chunk):
+        packets += len(parser.feed(view[pos:pos + chunk]))
+    return packets
+
+
+def report(name, size, packets, elapsed):
+    print("%-24s %9d packets %8.3f s %12.0f packets/s %8.2f MB/s" %
+          (name, packets, elapsed, packets / elapsed, size / elapsed / 1e6))
+
+
+def main(paths):
+    streams = [open(path, 'rb').read() for path in paths] or [synthetic_stream()]
+    stream = b''.join(streams)
+    print("stream: %d bytes" % len(stream))
+
+    for name, loop in (("legacy per-byte", legacy_parse), ("ThinkGearParser", chunked_parse)):
+        srl = PipeSerial(stream)
+        start = time.perf_counter()
+        packets = loop(srl)
+        report(name + " pipe", len(stream), packets, time.perf_counter() - start)
+        srl.close()
+
+    for chunk in (64, 512, 4096):
+        start = time.perf_counter()
+        packets = memory_parse(stream, chunk)
+        report("ThinkGearParser %d B" % chunk, len(stream), packets, time.perf_counter() - start)
+
+    # recovery: packets still decoded when 1% of them are corrupted in each way
+    generator = PacketGenerator(badChecksum=0.01, truncated=0.01, lostSync=0.01, seed=0)
+    corrupted = generator.packets(60)
+    start = time.perf_counter()
+    packets = memory_parse(corrupted, 512)
+    report("corrupted 512 B", len(corrupted), packets, time.perf_counter() - start)
+    injected = generator.injected
+    print("corruption: %s, %d of %d packets decoded" % (
+        ", ".join("%s %d" % (kind, count) for kind, count in sorted(injected.items()) if kind != 'packets'),
+        packets, injected['packets']))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
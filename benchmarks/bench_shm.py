@@ -0,0 +1,74 @@
+"""Fan-out of decoded packets to other processes through the shared memory ring of NeuroSkyPy.shm.
+
+The packets of a synthetic stream are published as fast as possible while reader processes follow the ring,
+the last one sleeping between reads so that it gets lapped when the ring is small.
+
+Usage: python -m benchmarks.bench_shm [--readers 4] [--seconds 600] [--capacity 65536]
+"""
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+from NeuroSkyPy.parser import ThinkGearParser
+from NeuroSkyPy.shm import SharedRingPublisher, SharedRingReader, column
+from NeuroSkyPy.sources import PacketGenerator
+
+
+def follow(name, total, slow, attached, results):
+    "reads until total records were read or lost"
+    reader = SharedRingReader(name, oldest=True)
+    attached.set()
+    records = raw = 0
+    ordered = True
+    last = 0
+    start = time.perf_counter()
+    while records + reader.lost < total:
+        batch = reader.read(timeout=0.1)
+        if len(batch):
+            ordered &= bool(batch['seq'][0] > last and np.all(np.diff(batch['seq'].astype(np.int64)) == 1))
+            last = int(batch['seq'][-1])
+            records += len(batch)
+            raw += len(column(batch, 'rawValue')[1])
+            if slow:
+                time.sleep(0.01)
+    results.put((records, raw, reader.lost, reader.laps, ordered, time.perf_counter() - start))
+    reader.close()
+
+
+def main():
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--readers', type=int, default=4)
+    options.add_argument('--seconds', type=int, default=600, help="seconds of headset output published")
+    options.add_argument('--capacity', type=int, default=65536, help="records in the ring")
+    args = options.parse_args()
+
+    samples = ThinkGearParser().feed(PacketGenerator(seed=0).packets(args.seconds), 0)
+    publisher = SharedRingPublisher(args.capacity)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    attached = [context.Event() for _ in range(args.readers)]
+    readers = [context.Process(target=follow, args=(publisher.name, len(samples), i == args.readers - 1, attached[i],
+                                                    results)) for i in range(args.readers)]
+    for reader in readers:
+        reader.start()
+    for event in attached:
+        event.wait()
+
+    start = time.perf_counter()
+    for sample in samples:
+        publisher.publish(sample)
+    elapsed = time.perf_counter() - start
+    print("published %d packets in %.2f s: %.0f packets/s (%.0fx a headset)" %
+          (len(samples), elapsed, len(samples) / elapsed, len(samples) / elapsed / 513))
+    for reader in readers:
+        reader.join()
+    for _ in readers:
+        records, raw, lost, laps, ordered, seconds = results.get()
+        print("reader: %8d records %8d raw values %8d lost in %d laps, in order: %s" % (records, raw, lost, laps, ordered))
+    publisher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""Benchmark suite: parse throughput, sample-to-callback latency, memory per hour and CPU at 512 Hz.
+
+Every benchmark runs on the synthetic stream of NeuroSkyPy.sources, no headset is needed:
+    throughput  packets/s and MB/s of the legacy per-byte loop and of ThinkGearParser through an OS pipe,
+                of the parser alone on memory chunks and of the reader thread of NeuroSkyPy on a replay
+    latency     histogram of the time from the read of a packet to its callback, for every dispatcher policy
+    memory      memory allocated by a NeuroSkyPy object fed one simulated hour, sampled every few minutes
+    cpu         CPU% of the process reading a VirtualMindWave at 512 Hz in real time (POSIX)
+    hub         aggregate packets/s of one NeuroSkyHub reading --devices headsets (16) as fast as they write (POSIX)
+The results are written as JSON, compare two runs with --baseline to track regressions between releases.
+
+Usage: python -m benchmarks.suite [--output results.json] [--baseline previous.json] [--only latency cpu]
+                                  [--seconds 10] [--hours 1] [--devices 16]
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import time
+import tracemalloc
+from time import monotonic_ns
+
+from NeuroSkyPy import NeuroSkyPy
+from NeuroSkyPy.dispatch import POLICIES, CallbackDispatcher
+from NeuroSkyPy.sources import PacketGenerator, ReplaySource, VirtualMindWave
+from benchmarks import bench_hub
+from benchmarks.bench_parser import PipeSerial, chunked_parse, legacy_parse, memory_parse, synthetic_stream
+
+# upper edges of the latency histogram in microseconds, the last bucket holds everything slower
+LATENCY_EDGES_US = [2 ** i for i in range(18)]
+
+
+def rate(size, packets, elapsed):
+    return {
+        'packets': packets,
+        'seconds': elapsed,
+        'packetsPerSecond': packets / elapsed,
+        'megabytesPerSecond': size / elapsed / 1e6,
+    }
+
+
+def throughput(args):
+    "packets/s and MB/s of every parser over one minute of synthetic output"
+    stream = synthetic_stream(60)
+    results = {'bytes': len(stream)}
+    for name, loop in (('legacyPipe', legacy_parse), ('parserPipe', chunked_parse)):
+        srl = PipeSerial(stream)
+        start = time.perf_counter()
+        packets = loop(srl)
+        results[name] = rate(len(stream), packets, time.perf_counter() - start)
+        srl.close()
+    for chunk in (64, 512, 4096):
+        start = time.perf_counter()
+        packets = memory_parse(stream, chunk)
+        results['parserMemory%d' % chunk] = rate(len(stream), packets, time.perf_counter() - start)
+    # the whole reader thread: reads, parsing, latest values, buffers and callbacks
+    headset = NeuroSkyPy("replay", bufferSeconds=60)
+    start = time.perf_counter()
+    headset.start(ReplaySource(stream, realtime=False, timeout=0))
+    headset.wait()
+    elapsed = time.perf_counter() - start
+    # every packet of the stream has a raw value or a poorSignal
+    packets = headset.getBuffer('rawValue').count + headset.getBuffer('poorSignal').count
+    results['readerThread'] = rate(len(stream), packets, elapsed)
+    return results
+
+
+def histogram(latencies):
+    "counts of latencies (ns) per bucket of LATENCY_EDGES_US and their percentiles in microseconds"
+    counts = [0] * (len(LATENCY_EDGES_US) + 1)
+    for latency in latencies:
+        us = latency / 1e3
+        bucket = 0
+        while bucket < len(LATENCY_EDGES_US) and us >= LATENCY_EDGES_US[bucket]:
+            bucket += 1
+        counts[bucket] += 1
+    ordered = sorted(latencies)
+    percentiles = {}
+    for p in (50, 90, 99, 99.9):
+        percentiles['p%s' % p] = ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] / 1e3 if ordered else None
+    return {
+        'samples': len(ordered),
+        'edgesUs': LATENCY_EDGES_US,
+        'counts': counts,
+        'percentilesUs': percentiles,
+        'maxUs': ordered[-1] / 1e3 if ordered else None,
+    }
+
+
+def latency(args):
+    "time from the read of a packet to its 'packet' callback, replayed at 512 Hz, for every policy"
+    results = {}
+    stream = synthetic_stream(args.seconds, seed=1)
+    for policy in POLICIES:
+        latencies = []
+        dispatcher = CallbackDispatcher()
+        # the arrival times, not the sample times of the raw values, measure the delivery
+        headset = NeuroSkyPy("replay", bufferSeconds=args.seconds, dispatcher=dispatcher, sampleClock=False)
+
+        def callback(*delivered):
+            now = monotonic_ns()
+            if len(delivered) == 2:  # batch: (timestamps, samples)
+                latencies.extend(now - sample.timestamp for sample in delivered[1])
+            else:
+                latencies.append(now - delivered[0].timestamp)
+
+        # batches close after 64 packets or 50 ms, their latency is mostly that wait
+        headset.setCallBack("packet", callback, policy=policy, batchMillis=50)
+        headset.start(ReplaySource(stream, realtime=True))
+        headset.wait()
+        time.sleep(0.2)  # let the workers deliver the last values
+        dispatcher.close()
+        results[policy] = histogram(latencies)
+    return results
+
+
+def memory(args):
+    "memory allocated by NeuroSkyPy while it is fed args.hours of packets, the history buffers keep the whole session"
+    seconds = int(args.hours * 3600)
+    step = 300  # simulated seconds between two samples of the memory
+    generator = PacketGenerator(seed=2)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    headset = NeuroSkyPy("replay", bufferSeconds=seconds)
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    timeline = []
+    start = time.perf_counter()
+    for elapsed in range(step, seconds + step, step):
+        data = generator.packets(step)
+        for pos in range(0, len(data), 4096):
+            headset.feed(data[pos:pos + 4096])
+        del data
+        timeline.append({'simulatedSeconds': elapsed, 'bytes': tracemalloc.get_traced_memory()[0] - before})
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {
+        'simulatedHours': args.hours,
+        'wallSeconds': time.perf_counter() - start,
+        'packets': generator.injected['packets'],
+        'bytesAfterConstruction': allocated,
+        'bytesAtEnd': timeline[-1]['bytes'],
+        'growthBytes': timeline[-1]['bytes'] - allocated,
+        'peakBytes': peak,
+        'timeline': timeline,
+    }
+
+
+def _send(device, seconds):
+    "child process of the cpu benchmark, so the cost of the simulated headset is not counted"
+    device.start()
+    time.sleep(seconds)
+    device.stop()
+
+
+def cpu(args):
+    "CPU% of the process reading a VirtualMindWave at 512 Hz, with a callback on every raw value"
+    device = VirtualMindWave(seed=3)
+    headset = NeuroSkyPy(device.port, 57600)
+    values = []
+    headset.setCallBack("rawValue", values.append)
+    headset.start()
+    sender = multiprocessing.get_context('fork').Process(target=_send, args=(device, args.seconds + 1))
+    sender.start()
+    time.sleep(0.5)  # skip the start of the threads
+    count = len(values)
+    cpuTime = time.process_time()
+    start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - start
+    cpuTime = time.process_time() - cpuTime
+    count = len(values) - count
+    headset.stop()
+    sender.join()
+    device.close()
+    return {
+        'seconds': elapsed,
+        'rawValuesPerSecond': count / elapsed,
+        'cpuPercent': 100 * cpuTime / elapsed,
+    }
+
+
+def hub(args):
+    "packets/s, MB/s and CPU% of a NeuroSkyHub reading args.devices pipes fed args.seconds of data as fast as possible"
+    result, stats = bench_hub.run(args.devices, int(args.seconds))
+    return result
+
+
+BENCHMARKS = {
+    'throughput': throughput,
+    'latency': latency,
+    'memory': memory,
+    'cpu': cpu,
+    'hub': hub,
+}
+# benchmarks that need a POSIX system: a pty or fork
+POSIX_ONLY = {'cpu': "VirtualMindWave needs a POSIX pty", 'hub': "the hub needs selectable pipes and fork"}
+
+
+def version():
+    "version of setup.py next to the benchmarks"
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'setup.py')
+    try:
+        with open(path) as f:
+            return re.search(r'version\s*=\s*"([^"]+)"', f.read()).group(1)
+    except (OSError, AttributeError):
+        return None
+
+
+def numbers(results, prefix=''):
+    "flattens the numeric results into path -> value"
+    flat = {}
+    for key, value in results.items():
+        path = prefix + key
+        if isinstance(value, dict):
+            flat.update(numbers(value, path + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline):
+    "prints the change of every number measured in both runs"
+    current = numbers(results['results'])
+    previous = numbers(baseline['results'])
+    print("\nchange against %s (%s)" % (baseline.get('version'), baseline.get('date')))
+    for path in sorted(set(current) & set(previous)):
+        if previous[path]:
+            print("  %-60s %14.6g -> %14.6g %+8.1f%%" % (
+                path, previous[path], current[path], 100.0 * (current[path] - previous[path]) / previous[path]))
+
+
+def main(argv=None):
+    options = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    options.add_argument('--output', default='benchmark-results.json', help="JSON file of the results")
+    options.add_argument('--baseline', help="JSON file of a previous run to compare with")
+    options.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help="benchmarks to run, all by default")
+    options.add_argument('--seconds', type=float, default=10, help="duration of the latency and cpu benchmarks")
+    options.add_argument('--hours', type=float, default=1, help="simulated session of the memory benchmark")
+    options.add_argument('--devices', type=int, default=16, help="headsets read by the hub benchmark")
+    args = options.parse_args(argv)
+
+    results = {
+        'version': version(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': {},
+    }
+    for name in args.only or BENCHMARKS:
+        if name in POSIX_ONLY and os.name != 'posix':
+            print("%s: skipped, %s" % (name, POSIX_ONLY[name]))
+            continue
+        print("%s..." % name)
+        sys.stdout.flush()
+        results['results'][name] = BENCHMARKS[name](args)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(numbers(results['results']), indent=2))
+    print("written to %s" % args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
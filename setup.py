@@ -27,7 +27,6 @@ setup(
       long_description_content_type='text/markdown',
       install_requires=[
             'numpy',
-            'scikit-learn',
             'matplotlib',
             'pyserial',
             'pyyaml'
@@ -45,4 +44,7 @@ setup(
             "Topic :: Scientific/Engineering :: Medical Science Apps."
             ],
       python_requires=">=3.7",
+      entry_points={
+            'console_scripts': ['neuroskypy-batch=NeuroSkyPy.batch:main'],
+      },
       )